@@ -18,13 +18,25 @@
 
 __author__ = 'stevenle08@gmail.com (Steven Le)'
 
+import collections
+import contextlib
 import socket
 import ssl
 import struct
 import hashlib
 import itertools
+import select
+import threading
 # Needed to parse certificates for secret hash.
 import M2Crypto.X509
+from google.protobuf import message as protobuf_message
+from googletv import clock
+from googletv import metrics as metrics_lib
+from googletv import recorder as recorder_lib
+from googletv import resolver as resolver_lib
+from googletv import tcpinfo
+from googletv import tracing
+from googletv import transport
 from googletv.proto import keycodes_pb2
 from googletv.proto import polo_pb2
 from googletv.proto import remote_pb2
@@ -32,6 +44,26 @@ from googletv.proto import remote_pb2
 ENCODING_TYPE_HEXADECIMAL = polo_pb2.Options.Encoding.ENCODING_TYPE_HEXADECIMAL
 ROLE_TYPE_INPUT = polo_pb2.Options.ROLE_TYPE_INPUT
 
+# Maps each polo OuterMessage type to the class of its inner message.
+POLO_MESSAGE_CLASSES = {
+    polo_pb2.OuterMessage.MESSAGE_TYPE_CONFIGURATION: polo_pb2.Configuration,
+    polo_pb2.OuterMessage.MESSAGE_TYPE_CONFIGURATION_ACK:
+        polo_pb2.ConfigurationAck,
+    polo_pb2.OuterMessage.MESSAGE_TYPE_OPTIONS: polo_pb2.Options,
+    polo_pb2.OuterMessage.MESSAGE_TYPE_PAIRING_REQUEST: polo_pb2.PairingRequest,
+    polo_pb2.OuterMessage.MESSAGE_TYPE_PAIRING_REQUEST_ACK:
+        polo_pb2.PairingRequestAck,
+    polo_pb2.OuterMessage.MESSAGE_TYPE_SECRET: polo_pb2.Secret,
+    polo_pb2.OuterMessage.MESSAGE_TYPE_SECRET_ACK: polo_pb2.SecretAck,
+}
+
+# Fields of remote_pb2.ResponseMessage, in wire order.
+REMOTE_RESPONSE_FIELDS = ('data_message', 'fling_result_message')
+
+# Tracing details of the two decode steps of a polo message.
+_ENVELOPE_SPAN_ARGS = {'part': 'envelope'}
+_PAYLOAD_SPAN_ARGS = {'part': 'payload'}
+
 
 class Error(Exception):
   """Base class for all exceptions in this module."""
@@ -41,6 +73,275 @@ class MessageTypeError(Error):
   """Error thrown when a different message type is received than expected."""
 
 
+class StatusError(Error):
+  """Error thrown when Google TV replies with a status other than STATUS_OK.
+
+  Attributes:
+    status: The polo_pb2.OuterMessage.STATUS_* value received.
+  """
+
+  def __init__(self, status):
+    super(StatusError, self).__init__('Received bad status %d' % status)
+    self.status = status
+
+
+class FingerprintMismatchError(Error):
+  """Error thrown when the server certificate is not the one that was paired."""
+
+
+class NotPairedError(Error):
+  """Error thrown when no paired credential is known for a host."""
+
+
+class DeadlineExceededError(Error):
+  """Error thrown when a connection operation does not complete in time.
+
+  The connection is closed before this is raised.
+  """
+
+
+class DecodeError(Error):
+  """Error thrown when a received frame cannot be decoded."""
+
+
+class ConnectionClosedError(Error):
+  """Error thrown when Google TV closes the connection mid-read."""
+
+
+def frame(data):
+  """Prefixes a serialized message with its 4-byte big-endian length.
+
+  Args:
+    data: A serialized message.
+
+  Returns:
+    The framed message, ready to be passed to BaseProtocol.write.
+  """
+  return struct.pack('!I', len(data)) + data
+
+
+def rsa_public_numbers(cert):
+  """Returns the (exponent, modulus) of a cert's RSA key, as used by polo.
+
+  Args:
+    cert: An M2Crypto.X509.X509 object.
+
+  Returns:
+    A tuple of big-endian byte strings with leading null bytes removed.
+  """
+  def remove_null_bytes(v):
+    return ''.join(itertools.dropwhile(lambda x: x=='\0', v))
+
+  return tuple(remove_null_bytes(v[4:])
+               for v in cert.get_pubkey().get_rsa().pub())
+
+
+def _is_timeout(error):
+  """Returns whether a socket.error is a timeout.
+
+  Python 2 reports TLS handshake timeouts as ssl.SSLError, not socket.timeout.
+  """
+  return isinstance(error, socket.timeout) or (
+      isinstance(error, ssl.SSLError) and 'timed out' in str(error))
+
+
+def _decode_varint(data, pos):
+  result = 0
+  shift = 0
+  while True:
+    byte = data[pos]
+    pos += 1
+    result |= (byte & 0x7f) << shift
+    if not byte & 0x80:
+      return result, pos
+    shift += 7
+
+
+def decode_outer_message(data, length=None):
+  """Decodes the envelope of a polo OuterMessage without copying its payload.
+
+  Args:
+    data: A bytearray holding the serialized OuterMessage at offset 0.
+    length: Length of the message in data. Defaults to len(data).
+
+  Returns:
+    A (status, message_type, payload) tuple. payload is a read-only buffer
+    into data, so it is only valid as long as data is not modified.
+    message_type may be None if status is not STATUS_OK.
+
+  Raises:
+    DecodeError: If the message is truncated or malformed, or has status
+        STATUS_OK and a missing or unknown type.
+  """
+  end = len(data) if length is None else length
+  status = None
+  message_type = None
+  payload_start = payload_end = 0
+  pos = 0
+  try:
+    while pos < end:
+      tag, pos = _decode_varint(data, pos)
+      wire_type = tag & 0x7
+      if wire_type == 0:
+        value, pos = _decode_varint(data, pos)
+        field = tag >> 3
+        if field == 2:
+          status = value
+        elif field == 3:
+          message_type = value
+      elif wire_type == 2:
+        size, pos = _decode_varint(data, pos)
+        if tag >> 3 == 4:
+          payload_start, payload_end = pos, pos + size
+        pos += size
+      elif wire_type == 1:
+        pos += 8
+      elif wire_type == 5:
+        pos += 4
+      else:
+        raise DecodeError('Unsupported wire type %d' % wire_type)
+  except IndexError:
+    raise DecodeError('Truncated OuterMessage')
+  if pos != end or status is None:
+    raise DecodeError('Malformed OuterMessage')
+  if (status == polo_pb2.OuterMessage.STATUS_OK and
+      message_type not in POLO_MESSAGE_CLASSES):
+    raise DecodeError('Unknown OuterMessage type %r' % message_type)
+  return status, message_type, buffer(data, payload_start,
+                                      payload_end - payload_start)
+
+
+def _parse_from_view(message_class, view):
+  """Parses a message straight from a buffer, copying only if required."""
+  try:
+    return message_class.FromString(view)
+  except (TypeError, protobuf_message.DecodeError):
+    # Some protobuf implementations only accept str.
+    return message_class.FromString(str(view))
+
+
+def _to_str(data):
+  """Copies a bytes-like object (bytearray, buffer, memoryview) to a str."""
+  if isinstance(data, memoryview):
+    return data.tobytes()
+  return str(data)
+
+
+class _FlushMarker(object):
+  """Queued behind pending frames; set once they have been written."""
+
+  def __init__(self):
+    self.done = threading.Event()
+
+
+class _FrameWriter(object):
+  """Writes frames queued by any number of threads from one writer thread.
+
+  Producers only append to a deque, which is atomic, and set an event, so they
+  never wait on the network or on each other. The writer thread drains every
+  queued frame and sends them in as few writes as possible.
+  """
+
+  # Upper bound on the size of a single coalesced write.
+  MAX_BATCH_BYTES = 64 * 1024
+
+  def __init__(self, write):
+    self.error = None
+    self._write = write
+    self._frames = collections.deque()
+    self._wakeup = threading.Event()
+    # Set once the writer thread has stopped, for good or on an error.
+    self._dead = threading.Event()
+    self._thread = threading.Thread(target=self._run)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def put(self, framed):
+    if self.error is not None:
+      raise self.error
+    self._frames.append(framed)
+    self._wakeup.set()
+
+  def flush(self, timeout=None):
+    """Blocks until every frame queued so far has been written."""
+    if self.error is not None:
+      raise self.error
+    marker = _FlushMarker()
+    self._frames.append(marker)
+    self._wakeup.set()
+    # The writer sets _dead before releasing the markers left in the queue, so
+    # if it is not set yet this marker will be released either way.
+    if not self._dead.is_set():
+      marker.done.wait(timeout)
+    if self.error is not None:
+      raise self.error
+
+  def close(self, timeout=None):
+    """Writes the pending frames, then stops the writer thread.
+
+    Returns:
+      Whether the writer thread stopped within the timeout.
+    """
+    self._frames.append(None)
+    self._wakeup.set()
+    self._thread.join(timeout)
+    return not self._thread.is_alive()
+
+  def _run(self):
+    try:
+      self._drain()
+    finally:
+      self._dead.set()
+      # Release any flush() waiting on frames that will never be written.
+      while True:
+        try:
+          item = self._frames.popleft()
+        except IndexError:
+          break
+        if isinstance(item, _FlushMarker):
+          item.done.set()
+
+  def _drain(self):
+    frames = self._frames
+    while True:
+      self._wakeup.wait()
+      # Clear before draining so that a frame appended during the drain sets
+      # the event again instead of being missed.
+      self._wakeup.clear()
+      batch = []
+      batch_len = 0
+      while True:
+        try:
+          item = frames.popleft()
+        except IndexError:
+          break
+        if isinstance(item, str):
+          batch.append(item)
+          batch_len += len(item)
+          if batch_len < self.MAX_BATCH_BYTES:
+            continue
+        if batch and not self._write_batch(batch):
+          # Put the item back so that a flush marker is still released.
+          frames.appendleft(item)
+          return
+        batch = []
+        batch_len = 0
+        if item is None:
+          return
+        if isinstance(item, _FlushMarker):
+          item.done.set()
+      if batch and not self._write_batch(batch):
+        return
+
+  def _write_batch(self, batch):
+    try:
+      self._write(''.join(batch))
+      return True
+    except Exception as e:  # pylint: disable=broad-except
+      self.error = e
+      return False
+
+
 class BaseProtocol(object):
   """Base class for protocols used by this module.
 
@@ -48,16 +349,70 @@ class BaseProtocol(object):
     host: The host of the Google TV server.
     port: The port to connect to. Default is 9551 for Anymote Protocol and 9552
         for Pairing Protocol.
-    sock: A socket.socket object.
-    ssl: SSL-wrapped socket.socket object.
+    sock: A socket.socket object, created by connect().
+    ssl: SSL-wrapped socket.socket object, created by connect().
+    address: The resolved address connect() reached the server on.
+    threadsafe: If True, writes from any thread are queued and sent by a
+        dedicated writer thread, several frames per write. Writes then never
+        block on network I/O and frames are never interleaved. recv() must
+        still only be called from one thread; it waits for data without
+        holding the lock that keeps it from using the TLS connection at the
+        same time as the writer thread.
+    fingerprint: If set, the hex SHA-256 fingerprint the server certificate
+        must have. connect() raises FingerprintMismatchError otherwise.
+    connect_timeout: Seconds allowed for the whole of connect(): host lookup,
+        TCP connect and TLS handshake, or None to wait forever. A slow lookup
+        cannot be interrupted, but its time is taken out of the budget.
+    timeout: Seconds allowed for each send or recv, or None to wait forever.
+    resolver: The googletv.resolver.Resolver used to look up host. Defaults to
+        one shared by every protocol instance.
+    metrics: The googletv.metrics.ConnectionMetrics recording this
+        connection, or None. Pass metrics=True to create one, or a
+        googletv.metrics.Registry to create one that reports into it.
+    tracer: The googletv.tracing.Tracer told about each operation, or None.
+    recorder: The googletv.recorder.SessionRecorder every frame written and
+        read is appended to, or None.
+    profile: The googletv.transport.Profile of socket options, given as a
+        Profile or a name such as 'interactive'. Defaults to the system
+        defaults.
+    breaker: The googletv.breaker.CircuitBreaker consulted before connecting
+        and told whether the connect succeeded, or None.
   """
 
-  def __init__(self, host, port, certfile):
+  # Seconds close() gives the writer thread to send the queued frames before
+  # the connection is shut down under it.
+  CLOSE_TIMEOUT = 5.0
+
+  def __init__(self, host, port, certfile, threadsafe=False, fingerprint=None,
+               connect_timeout=None, timeout=None, resolver=None,
+               metrics=None, tracer=None, recorder=None, profile=None,
+               breaker=None):
     self.host = host
     self.port = port
-    self.sock = socket.socket()
-    self.ssl = ssl.wrap_socket(self.sock, certfile=certfile)
     self.certfile = certfile
+    self.threadsafe = threadsafe
+    self.fingerprint = fingerprint
+    self.connect_timeout = connect_timeout
+    self.timeout = timeout
+    self.resolver = resolver or resolver_lib.DEFAULT_RESOLVER
+    if metrics is True:
+      metrics = metrics_lib.ConnectionMetrics()
+    elif isinstance(metrics, metrics_lib.Registry):
+      metrics = metrics.connection(host)
+    self.metrics = metrics
+    self.tracer = tracer
+    self.recorder = recorder
+    self.profile = transport.get(profile)
+    self.breaker = breaker
+    self._corked = False
+    self.sock = None
+    self.ssl = None
+    self.address = None
+    self._deadline = None
+    self._writer = None
+    self._io_lock = None
+    self._handlers = {}
+    self._recv_buffer = bytearray(4096)
 
   def __enter__(self):
     self.connect()
@@ -67,24 +422,387 @@ class BaseProtocol(object):
     self.close()
 
   def close(self):
-    self.ssl.close()
+    if self._writer is not None:
+      if not self._writer.close(self.CLOSE_TIMEOUT):
+        # The writer is blocked on a stalled connection; shutting the socket
+        # down makes its write fail.
+        try:
+          self.sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+          pass
+        self._writer.close(self.CLOSE_TIMEOUT)
+      self._writer = None
+      self._io_lock = None
+    self._uncork()
+    self._close_socket()
+
+  def _close_socket(self):
+    if self.ssl is not None:
+      self.ssl.close()
+    # The SSL socket shares its file descriptor with self.sock, which has to be
+    # closed too for the connection to actually be shut down.
+    if self.sock is not None:
+      self.sock.close()
+    self._corked = False
+    if self.metrics is not None:
+      self.metrics.on_close()
 
   def connect(self):
-    self.ssl.connect((self.host, self.port))
+    """Connects to the server.
+
+    The host is resolved through the shared resolver cache, then every
+    resolved address is tried in parallel (see resolver.race_connect) and the
+    TLS handshake runs on the first connection to succeed.
+
+    Raises:
+      googletv.breaker.CircuitOpenError: If the breaker has given up on the
+          host for now.
+    """
+    if self.breaker is None:
+      self._connect()
+      return
+    self.breaker.allow(self.host)
+    try:
+      self._connect()
+    except (socket.error, DeadlineExceededError):
+      self.breaker.record_failure(self.host)
+      raise
+    except:
+      self.breaker.release(self.host)
+      raise
+    self.breaker.record_success(self.host)
+
+  def _connect(self):
+    start = clock.monotonic()
+    with self._span('connect'):
+      with self._span('resolve'):
+        self._connect_timeout(start)
+        addresses = self.resolver.resolve(self.host, self.port)
+      try:
+        resolved = clock.monotonic()
+        with self._span('tcp_connect'):
+          self.sock, self.address = resolver_lib.race_connect(
+              addresses, self._connect_timeout(start),
+              setup=self.profile.configure)
+        connected = clock.monotonic()
+        self.sock.settimeout(self._connect_timeout(start))
+        with self._span('tls_handshake'):
+          self.ssl = ssl.wrap_socket(self.sock, certfile=self.certfile)
+        if self.metrics is not None:
+          self.metrics.on_connect(connected - resolved,
+                                  clock.monotonic() - connected)
+      except socket.error as e:
+        if not _is_timeout(e):
+          self._close_socket()
+          raise
+        self._expire('connect')
+      self.ssl.settimeout(self.timeout)
+      if (self.fingerprint is not None and
+          self.peer_fingerprint() != self.fingerprint.lower()):
+        self.close()
+        raise FingerprintMismatchError(
+            'Server certificate of %s does not match the paired one' %
+            self.host)
+      if self.threadsafe:
+        # OpenSSL does not allow a read and a write on one connection at the
+        # same time.
+        self._io_lock = threading.Lock()
+        self._writer = _FrameWriter(self._write)
+
+  def _connect_timeout(self, start):
+    """Returns what is left of the connect budget that started at start."""
+    timeout = self.connect_timeout
+    if timeout is not None:
+      timeout -= clock.monotonic() - start
+      if timeout <= 0:
+        self._expire('connect')
+    return self._timeout_for('connect', timeout)
+
+  def _span(self, name, args=None):
+    """Returns a context manager reporting an operation to the tracer.
+
+    Args:
+      name: Name of the operation.
+      args: Optional dict of details about the operation.
+
+    Call sites on the message path test self.tracer first and skip the span
+    altogether when it is None, so that untraced calls enter no context
+    manager.
+    """
+    if self.tracer is None:
+      return tracing.NULL_SPAN
+    args = dict(args, host=self.host) if args else {'host': self.host}
+    return tracing.Span(self.tracer, name, args)
+
+  @contextlib.contextmanager
+  def deadline(self, seconds):
+    """Bounds the total time of every operation inside the block.
+
+    Deadlines carry through multi-step flows: each connect, send and recv in
+    the block gets at most the time remaining, and raises
+    DeadlineExceededError once it is used up. Nested deadlines can only
+    shorten the outer one.
+
+    Example:
+      with gtv.deadline(10):
+        gtv.handshake('client')
+
+    Args:
+      seconds: Time allowed for the whole block.
+    """
+    previous = self._deadline
+    deadline = clock.monotonic() + seconds
+    if previous is not None:
+      deadline = min(deadline, previous)
+    self._deadline = deadline
+    try:
+      yield
+    finally:
+      self._deadline = previous
+      if previous is None and self.ssl is not None:
+        try:
+          self.ssl.settimeout(self.timeout)
+        except socket.error:
+          pass  # The connection was closed inside the block.
+
+  def _timeout_for(self, operation, timeout):
+    """Returns the socket timeout for an operation, bounded by the deadline."""
+    if self._deadline is None:
+      return timeout
+    remaining = self._deadline - clock.monotonic()
+    if remaining <= 0:
+      self._expire(operation)
+    return remaining if timeout is None else min(timeout, remaining)
+
+  def _expire(self, operation):
+    self._close_socket()
+    raise DeadlineExceededError('%s to %s:%d timed out' % (
+        operation, self.host, self.port))
+
+  def subscribe(self, message_class, handler):
+    """Registers a handler for received messages of a given class.
+
+    Args:
+      message_class: A message class, e.g. polo_pb2.SecretAck or
+          remote_pb2.FlingResult.
+      handler: Function called with each received message of that class.
+    """
+    self._handlers.setdefault(message_class, []).append(handler)
+
+  def unsubscribe(self, message_class, handler):
+    """Removes a handler registered with subscribe()."""
+    self._handlers[message_class].remove(handler)
+
+  def _dispatch(self, message):
+    handlers = self._handlers.get(message.__class__)
+    if handlers:
+      for handler in handlers:
+        handler(message)
+
+  def peer_fingerprint(self):
+    """Returns the hex SHA-256 fingerprint of the server certificate."""
+    return hashlib.sha256(self.ssl.getpeercert(True)).hexdigest()
+
+  def tcp_info(self):
+    """Returns the kernel's googletv.tcpinfo.TcpInfo for the connection.
+
+    Returns None if not connected or not supported by the platform.
+    """
+    return tcpinfo.sample(self.sock)
+
+  def reconnect(self):
+    """Closes the connection and opens a new one on a fresh socket."""
+    if self.metrics is not None:
+      self.metrics.on_reconnect()
+    self.close()
+    self.connect()
+
+  def flush(self, timeout=None):
+    """Blocks until all queued frames are written (threadsafe mode only).
+
+    With the bulk transport profile, also uncorks the socket so that the
+    frames written since the last flush() go out.
+    """
+    if self._writer is not None:
+      self._writer.flush(timeout)
+    self._uncork()
+
+  def _uncork(self):
+    if self._corked:
+      self._corked = False
+      try:
+        transport.set_cork(self.sock, False)
+      except socket.error:
+        pass  # Closed; nothing left to push.
 
   def send(self, data):
-    data_len = struct.pack('!I', len(data))
-    sent = self.ssl.write(data_len + data)
-    assert sent == len(data) + 4
+    return self.write(frame(data))
+
+  def write(self, framed):
+    """Writes one or more already-framed messages in a single call.
+
+    Args:
+      framed: Bytes produced by concatenating the output of frame().
+
+    Returns:
+      The amount of data sent (or queued, in threadsafe mode), in bytes.
+    """
+    if self.metrics is not None:
+      self.metrics.on_send(metrics_lib.count_frames(framed), len(framed))
+    if self._writer is not None:
+      if not isinstance(framed, str):
+        # Queued frames may be written after the caller has reused or
+        # released its buffer, so take a copy.
+        framed = _to_str(framed)
+      self._writer.put(framed)
+      return len(framed)
+    return self._write(framed)
+
+  def _write(self, framed):
+    if self._deadline is not None:
+      self.ssl.settimeout(self._timeout_for('write', self.timeout))
+    if self.profile.cork and not self._corked:
+      transport.set_cork(self.sock, True)
+      self._corked = True
+    try:
+      if self.tracer is None:
+        sent = self._timed_write(framed)
+      else:
+        with self._span('write', {'size': len(framed)}):
+          sent = self._timed_write(framed)
+    except socket.error as e:
+      if not _is_timeout(e):
+        raise
+      self._expire('write')
+    assert sent == len(framed)
+    if self.recorder is not None:
+      self.recorder.record(recorder_lib.SENT, self.host, framed)
+    return sent
+
+  def _timed_write(self, framed):
+    if self.metrics is None:
+      return self._ssl_write(framed)
+    start = clock.monotonic()
+    sent = self._ssl_write(framed)
+    self.metrics.on_write(clock.monotonic() - start)
     return sent
 
   def recv(self):
-    len_raw = self.ssl.recv(4)
-    data_len = struct.unpack('!I', len_raw)[0]
-    data = self.ssl.recv(data_len)
-    assert len(data) == data_len
+    try:
+      if self.tracer is None:
+        len_raw, data = self._recv_data()
+      else:
+        with self._span('recv'):
+          len_raw, data = self._recv_data()
+    except socket.error as e:
+      if not _is_timeout(e):
+        raise
+      self._expire('recv')
+    if self.profile.quickack:
+      transport.quickack(self.sock)
+    if self.metrics is not None:
+      self.metrics.on_recv(4 + len(data))
+    if self.recorder is not None:
+      self.recorder.record(recorder_lib.RECEIVED, self.host, len_raw + data)
     return data
 
+  def _recv_frame(self):
+    """Reads one frame into a reusable buffer.
+
+    Returns:
+      A (buffer, length) tuple. The buffer is overwritten by the next call.
+    """
+    try:
+      if self.tracer is None:
+        size = self._recv_into_buffer()
+      else:
+        with self._span('recv'):
+          size = self._recv_into_buffer()
+    except socket.error as e:
+      if not _is_timeout(e):
+        raise
+      self._expire('recv')
+    if self.profile.quickack:
+      transport.quickack(self.sock)
+    if self.metrics is not None:
+      self.metrics.on_recv(4 + size)
+    if self.recorder is not None:
+      self.recorder.record(recorder_lib.RECEIVED, self.host,
+                           struct.pack('!I', size) +
+                           bytes(self._recv_buffer[:size]))
+    return self._recv_buffer, size
+
+  def _recv_data(self):
+    """Reads one frame, returning its header and payload as strings."""
+    len_raw = self._recv_exactly(4)
+    data_len = struct.unpack('!I', len_raw)[0]
+    return len_raw, self._recv_exactly(data_len)
+
+  def _recv_into_buffer(self):
+    """Reads one frame into self._recv_buffer and returns its size."""
+    header = self._recv_exactly(4)
+    size = struct.unpack('!I', header)[0]
+    if size > len(self._recv_buffer):
+      self._recv_buffer = bytearray(size)
+    view = memoryview(self._recv_buffer)
+    received = 0
+    while received < size:
+      if self._deadline is not None:
+        self.ssl.settimeout(self._timeout_for('recv', self.timeout))
+      count = self._ssl_read(self.ssl.recv_into, view[received:size],
+                             size - received)
+      if not count:
+        raise ConnectionClosedError(
+            'Connection closed after %d of %d bytes' % (received, size))
+      received += count
+    return size
+
+  def _ssl_write(self, data):
+    if self._io_lock is None:
+      return self.ssl.write(data)
+    with self._io_lock:
+      return self.ssl.write(data)
+
+  def _ssl_read(self, read, *args):
+    """Calls an SSL read method, in turn with the writer thread if any.
+
+    The lock is only taken once data has arrived, so that a recv() waiting
+    for a reply does not keep queued frames from being written.
+    """
+    if self._io_lock is None:
+      return read(*args)
+    with self._io_lock:
+      pending = self.ssl.pending()
+    if not pending:
+      ready = select.select([self.sock], [], [], self.ssl.gettimeout())[0]
+      if not ready:
+        raise socket.timeout('timed out')
+    with self._io_lock:
+      return read(*args)
+
+  def _recv_exactly(self, size):
+    """Reads exactly size bytes, across as many TLS records as needed.
+
+    Within a deadline, each read only gets the time remaining.
+    """
+    if self._deadline is not None:
+      self.ssl.settimeout(self._timeout_for('recv', self.timeout))
+    data = self._ssl_read(self.ssl.recv, size)
+    if len(data) == size:
+      return data
+    chunks = [data]
+    received = len(data)
+    while received < size:
+      if self._deadline is not None:
+        self.ssl.settimeout(self._timeout_for('recv', self.timeout))
+      chunk = self._ssl_read(self.ssl.recv, size - received)
+      if not chunk:
+        raise ConnectionClosedError(
+            'Connection closed after %d of %d bytes' % (received, size))
+      chunks.append(chunk)
+      received += len(chunk)
+    return ''.join(chunks)
+
 
 class PairingProtocol(BaseProtocol):
   """Google TV Pairing Protocol.
@@ -93,8 +811,9 @@ class PairingProtocol(BaseProtocol):
     https://developers.google.com/tv/remote/docs/pairing
   """
 
-  def __init__(self, host, certfile, port=9552):
-    super(PairingProtocol, self).__init__(host, port, certfile)
+  def __init__(self, host, certfile, port=9552, **kwargs):
+    super(PairingProtocol, self).__init__(host, port, certfile, **kwargs)
+    self._key_material = None
 
   def send_pairing_request(self, client_name, service_name='AnyMote'):
     """Initiates a new PairingRequest with the Google TV server.
@@ -103,10 +822,8 @@ class PairingProtocol(BaseProtocol):
       client_name: A string that can be used to identify the client making reqs.
       service_name: The name of the service to pair with.
     """
-    req = polo_pb2.PairingRequest()
-    req.service_name = service_name
-    req.client_name = client_name
-    self._send_message(req, polo_pb2.OuterMessage.MESSAGE_TYPE_PAIRING_REQUEST)
+    self._send_message(self._pairing_request(client_name, service_name),
+                       polo_pb2.OuterMessage.MESSAGE_TYPE_PAIRING_REQUEST)
 
   def send_options(self, *args, **kwargs):
     """Sends an Options message to the Google TV server.
@@ -114,11 +831,8 @@ class PairingProtocol(BaseProtocol):
     Currently, only a 4-length HEXADECIMAL message is supported. Will support
     other types in the future.
     """
-    options = polo_pb2.Options()
-    encoding = options.input_encodings.add()
-    encoding.type = ENCODING_TYPE_HEXADECIMAL
-    encoding.symbol_length = 4
-    self._send_message(options, polo_pb2.OuterMessage.MESSAGE_TYPE_OPTIONS)
+    self._send_message(self._options(),
+                       polo_pb2.OuterMessage.MESSAGE_TYPE_OPTIONS)
 
   def send_configuration(self, encoding_type=ENCODING_TYPE_HEXADECIMAL,
                          symbol_length=4, client_role=ROLE_TYPE_INPUT):
@@ -127,11 +841,76 @@ class PairingProtocol(BaseProtocol):
     Currently, only a 4-length HEXADECIMAL message is supported. Will support
     other types in the future.
     """
+    req = self._configuration(encoding_type, symbol_length, client_role)
+    self._send_message(req, polo_pb2.OuterMessage.MESSAGE_TYPE_CONFIGURATION)
+
+  def handshake(self, client_name, service_name='AnyMote', pipelined=False):
+    """Runs the initialization and configuration phases of pairing.
+
+    Lock-step, each of PairingRequest, Options and Configuration waits for its
+    reply, costing three round trips. Pipelined, the three messages are
+    written back to back and the replies are then validated in order, costing
+    one round trip. If the server rejects the pipelined messages, the
+    connection is re-opened and the handshake is retried in lock-step.
+
+    Args:
+      client_name: A string that can be used to identify the client making reqs.
+      service_name: The name of the service to pair with.
+      pipelined: Whether to try the pipelined handshake first.
+
+    Returns:
+      The PairingRequestAck received from Google TV.
+    """
+    with self._span('pairing.handshake', {'pipelined': pipelined}):
+      if pipelined:
+        try:
+          return self._pipelined_handshake(client_name, service_name)
+        except (Error, socket.error):
+          self.reconnect()
+      self.send_pairing_request(client_name, service_name)
+      ack = self.recv_pairing_request_ack()
+      self.send_options()
+      self.recv_options()
+      self.send_configuration()
+      self.recv_configuration_ack()
+      return ack
+
+  def _pipelined_handshake(self, client_name, service_name):
+    types = polo_pb2.OuterMessage
+    self.write(''.join([
+        frame(self._encode_message(
+            self._pairing_request(client_name, service_name),
+            types.MESSAGE_TYPE_PAIRING_REQUEST)),
+        frame(self._encode_message(
+            self._options(), types.MESSAGE_TYPE_OPTIONS)),
+        frame(self._encode_message(
+            self._configuration(ENCODING_TYPE_HEXADECIMAL, 4, ROLE_TYPE_INPUT),
+            types.MESSAGE_TYPE_CONFIGURATION)),
+    ]))
+    ack = self.recv_pairing_request_ack()
+    self.recv_options()
+    self.recv_configuration_ack()
+    return ack
+
+  def _pairing_request(self, client_name, service_name):
+    req = polo_pb2.PairingRequest()
+    req.service_name = service_name
+    req.client_name = client_name
+    return req
+
+  def _options(self):
+    options = polo_pb2.Options()
+    encoding = options.input_encodings.add()
+    encoding.type = ENCODING_TYPE_HEXADECIMAL
+    encoding.symbol_length = 4
+    return options
+
+  def _configuration(self, encoding_type, symbol_length, client_role):
     req = polo_pb2.Configuration()
     req.encoding.type = encoding_type
     req.encoding.symbol_length = symbol_length
     req.client_role = client_role
-    self._send_message(req, polo_pb2.OuterMessage.MESSAGE_TYPE_CONFIGURATION)
+    return req
 
   def send_secret(self, code):
     """Sends a Secret message to the Google TV server.
@@ -139,9 +918,10 @@ class PairingProtocol(BaseProtocol):
     Args:
       code: Hex code string displayed by the Google TV.
     """
-    req = polo_pb2.Secret()
-    req.secret = self._make_secret_payload(self._encode_hex_secret(code))
-    self._send_message(req, polo_pb2.OuterMessage.MESSAGE_TYPE_SECRET)
+    with self._span('pairing.send_secret'):
+      req = polo_pb2.Secret()
+      req.secret = self._make_secret_payload(self._encode_hex_secret(code))
+      self._send_message(req, polo_pb2.OuterMessage.MESSAGE_TYPE_SECRET)
 
   def _encode_hex_secret(self, secret):
     """Encodes a hex secret.
@@ -159,6 +939,26 @@ class PairingProtocol(BaseProtocol):
       result[i] = int(secret[start_index:end_index], 16)
     return bytes(result)
 
+  def prepare_secret(self):
+    """Parses the client and server public keys used by the secret hash.
+
+    send_secret() does this on demand. Calling it ahead of time, e.g. from a
+    worker thread while the user reads the code off the TV, takes certificate
+    parsing off the critical path. Must be called after connect().
+
+    Returns:
+      A (client exponent, client modulus, server exponent, server modulus)
+      tuple of big-endian byte strings.
+    """
+    if self._key_material is None:
+      with self._span('pairing.prepare_secret'):
+        servercert = M2Crypto.X509.load_cert_der_string(
+            self.ssl.getpeercert(True))
+        clientcert = M2Crypto.X509.load_cert(self.certfile)
+        self._key_material = (rsa_public_numbers(clientcert) +
+                              rsa_public_numbers(servercert))
+    return self._key_material
+
   def _make_secret_payload(self, encoded_secret):
     """Builds payload out of binary secret.
 
@@ -168,17 +968,7 @@ class PairingProtocol(BaseProtocol):
     Returns:
       Binary value to be used as the secret payload.
     """
-    servercert = M2Crypto.X509.load_cert_der_string(self.ssl.getpeercert(True))
-    clientcert = M2Crypto.X509.load_cert(self.certfile)
-
-    def get_key_pair(c):
-      return [remove_null_bytes(v[4:]) for v in c.get_pubkey().get_rsa().pub()]
-
-    def remove_null_bytes(v):
-      return ''.join(itertools.dropwhile(lambda x: x=='\0', v))
-
-    sexp, smod = get_key_pair(servercert)
-    cexp, cmod = get_key_pair(clientcert)
+    cexp, cmod, sexp, smod = self.prepare_secret()
 
     # From reference implementation, secret payload is the SHA256 hash of:
     #   client modulus
@@ -196,23 +986,42 @@ class PairingProtocol(BaseProtocol):
     digest.update(encoded_secret[len(encoded_secret) // 2:])
     return digest.digest()
 
-  def _send_message(self, message, message_type):
-    """Sends a message to the Google TV server.
+  def _encode_message(self, message, message_type):
+    """Serializes a message wrapped in an OuterMessage.
 
     Args:
       message: A proto request message.
       message_type: A polo_pb2.OuterMessage.MESSAGE_TYPE_* constant.
 
     Returns:
-      The amount of data sent, in bytes.
+      The serialized OuterMessage.
     """
     req = polo_pb2.OuterMessage()
     req.protocol_version = 1
     req.status = polo_pb2.OuterMessage.STATUS_OK
     req.type = message_type
     req.payload = message.SerializeToString()
-    data = req.SerializeToString()
-    return self.send(data)
+    return req.SerializeToString()
+
+  def _send_message(self, message, message_type):
+    """Sends a message to the Google TV server.
+
+    Args:
+      message: A proto request message.
+      message_type: A polo_pb2.OuterMessage.MESSAGE_TYPE_* constant.
+
+    Returns:
+      The amount of data sent, in bytes.
+    """
+    if self.metrics is not None:
+      self.metrics.on_message_sent(
+          polo_pb2.OuterMessage.MessageType.Name(message_type))
+    if self.tracer is None:
+      return self.send(self._encode_message(message, message_type))
+    with self._span('send', {'type': message_type}):
+      with self._span('encode'):
+        data = self._encode_message(message, message_type)
+      return self.send(data)
 
   def _recv_message(self, expected_type=None):
     """Reads a message from Google TV.
@@ -225,34 +1034,45 @@ class PairingProtocol(BaseProtocol):
       The inner message received from Google TV.
 
     Raises:
-      AssertionError: If a bad status was received from Google TV.
+      StatusError: If a bad status was received from Google TV.
       MessageTypeError: If an expected_type was provided and the received type
           does not match the expected.
     """
-    types = polo_pb2.OuterMessage
-    message_types = {
-        types.MESSAGE_TYPE_CONFIGURATION: polo_pb2.Configuration,
-        types.MESSAGE_TYPE_CONFIGURATION_ACK: polo_pb2.ConfigurationAck,
-        types.MESSAGE_TYPE_OPTIONS: polo_pb2.Options,
-        types.MESSAGE_TYPE_PAIRING_REQUEST: polo_pb2.PairingRequest,
-        types.MESSAGE_TYPE_PAIRING_REQUEST_ACK: polo_pb2.PairingRequestAck,
-        types.MESSAGE_TYPE_SECRET: polo_pb2.Secret,
-        types.MESSAGE_TYPE_SECRET_ACK: polo_pb2.SecretAck,
-    }
-
-    data = self.recv()
-    req = polo_pb2.OuterMessage.FromString(data)
-    # TODO: Check req.status and figure out how to deal with not OK.
-    assert req.status == polo_pb2.OuterMessage.STATUS_OK
+    if self.tracer is None:
+      return self._recv_polo_message(expected_type)
+    with self._span('recv_message'):
+      return self._recv_polo_message(expected_type)
+
+  def _recv_polo_message(self, expected_type):
+    data, length = self._recv_frame()
+    if self.tracer is None:
+      status, message_type, payload = decode_outer_message(data, length)
+    else:
+      with self._span('decode', _ENVELOPE_SPAN_ARGS):
+        status, message_type, payload = decode_outer_message(data, length)
+    if self.metrics is not None:
+      if status == polo_pb2.OuterMessage.STATUS_OK:
+        self.metrics.on_message_received(
+            polo_pb2.OuterMessage.MessageType.Name(message_type))
+      else:
+        self.metrics.on_message_received(
+            polo_pb2.OuterMessage.Status.Name(status))
+    if status != polo_pb2.OuterMessage.STATUS_OK:
+      raise StatusError(status)
 
     # If an expected_type is provided, then verify the received type.
-    if expected_type and expected_type != req.type:
-      expected = message_types[expected_type].__name__
-      actual = message_types[req.type].__name__
+    if expected_type and expected_type != message_type:
+      expected = POLO_MESSAGE_CLASSES[expected_type].__name__
+      actual = POLO_MESSAGE_CLASSES[message_type].__name__
       raise MessageTypeError('Expected %s but received %s' % (expected, actual))
 
-    message_type = message_types[req.type]
-    message = message_type.FromString(req.payload)
+    message_class = POLO_MESSAGE_CLASSES[message_type]
+    if self.tracer is None:
+      message = _parse_from_view(message_class, payload)
+    else:
+      with self._span('decode', _PAYLOAD_SPAN_ARGS):
+        message = _parse_from_view(message_class, payload)
+    self._dispatch(message)
     return message
 
   def recv_pairing_request_ack(self):
@@ -279,8 +1099,29 @@ class AnymoteProtocol(BaseProtocol):
     https://developers.google.com/tv/remote/docs/
   """
 
-  def __init__(self, host, certfile, port=9551):
-    super(AnymoteProtocol, self).__init__(host, port, certfile)
+  def __init__(self, host, certfile, port=9551, **kwargs):
+    super(AnymoteProtocol, self).__init__(host, port, certfile, **kwargs)
+
+  @classmethod
+  def from_store(cls, store, host, port=9551, **kwargs):
+    """Creates a protocol using the credential paired with host.
+
+    The connection checks that the server certificate is the one that was
+    paired.
+
+    Args:
+      store: A googletv.store.CredentialStore.
+      host: The host of the Google TV server.
+      port: The port to connect to.
+
+    Raises:
+      NotPairedError: If host has not been paired.
+    """
+    credential = store.get(host)
+    if credential is None:
+      raise NotPairedError('%s has not been paired' % host)
+    kwargs.setdefault('fingerprint', credential.fingerprint)
+    return cls(host, credential.certfile, port=port, **kwargs)
 
   def keycode(self, keycode, action):
     """Sends a KeyCode event to Google TV.
@@ -289,13 +1130,7 @@ class AnymoteProtocol(BaseProtocol):
       keycode: A Code from keycodes_pb2.
       action: Either "down" (pressed) or "up" (released).
     """
-    req = remote_pb2.RequestMessage()
-    req.key_event_message.keycode = keycode
-    if action == 'up':
-      req.key_event_message.action = keycodes_pb2.UP
-    else:
-      req.key_event_message.action = keycodes_pb2.DOWN
-    self._send_message(req)
+    self._send_message(self._keycode_request(keycode, action))
 
   def fling(self, uri):
     """Sends a Fling event to Google TV.
@@ -306,9 +1141,7 @@ class AnymoteProtocol(BaseProtocol):
     Args:
       uri: URI to send to Google TV.
     """
-    req = remote_pb2.RequestMessage()
-    req.fling_message.uri = uri
-    self._send_message(req)
+    self._send_message(self._fling_request(uri))
 
   def mouse(self, x=0, y=0):
     """Sends a MouseEvent to Google TV.
@@ -317,10 +1150,7 @@ class AnymoteProtocol(BaseProtocol):
       x: Relative movement of the cursor on the x-axis.
       y: Relative movement of the cursor on the y-axis.
     """
-    req = remote_pb2.RequestMessage()
-    req.mouse_event_message.x_delta = x
-    req.mouse_event_message.y_delta = y
-    self._send_message(req)
+    self._send_message(self._mouse_request(x, y))
 
   def press(self, keycode):
     """Sends a keycode down then up.
@@ -331,13 +1161,93 @@ class AnymoteProtocol(BaseProtocol):
     self.keycode(keycode, 'down')
     self.keycode(keycode, 'up')
 
-  def _send_message(self, message):
-    """Sends a RequestMessage wrapped in a RemoteMessage.
+  def encode_keycode(self, keycode, action):
+    """Returns the framed bytes of a KeyCode event, for use with write()."""
+    return frame(self._encode_message(self._keycode_request(keycode, action)))
+
+  def encode_press(self, keycode):
+    """Returns the framed bytes of a keycode down then up."""
+    return (self.encode_keycode(keycode, 'down') +
+            self.encode_keycode(keycode, 'up'))
+
+  def encode_fling(self, uri):
+    """Returns the framed bytes of a Fling event, for use with write()."""
+    return frame(self._encode_message(self._fling_request(uri)))
+
+  def encode_mouse(self, x=0, y=0):
+    """Returns the framed bytes of a MouseEvent, for use with write()."""
+    return frame(self._encode_message(self._mouse_request(x, y)))
+
+  def _keycode_request(self, keycode, action):
+    req = remote_pb2.RequestMessage()
+    req.key_event_message.keycode = keycode
+    if action == 'up':
+      req.key_event_message.action = keycodes_pb2.UP
+    else:
+      req.key_event_message.action = keycodes_pb2.DOWN
+    return req
+
+  def _fling_request(self, uri):
+    req = remote_pb2.RequestMessage()
+    req.fling_message.uri = uri
+    return req
+
+  def _mouse_request(self, x, y):
+    req = remote_pb2.RequestMessage()
+    req.mouse_event_message.x_delta = x
+    req.mouse_event_message.y_delta = y
+    return req
+
+  def recv_message(self):
+    """Reads a RemoteMessage from Google TV.
+
+    Responses it carries (remote_pb2.Data, remote_pb2.FlingResult) are passed
+    to the handlers registered with subscribe().
+
+    Returns:
+      The remote_pb2.RemoteMessage received.
+    """
+    if self.tracer is None:
+      message = remote_pb2.RemoteMessage.FromString(self.recv())
+    else:
+      with self._span('recv_message'):
+        data = self.recv()
+        with self._span('decode'):
+          message = remote_pb2.RemoteMessage.FromString(data)
+    if message.HasField('response_message'):
+      response = message.response_message
+      for field in REMOTE_RESPONSE_FIELDS:
+        if response.HasField(field):
+          if self.metrics is not None:
+            self.metrics.on_message_received(field)
+          self._dispatch(getattr(response, field))
+    return message
+
+  def _encode_message(self, message):
+    """Serializes a RequestMessage wrapped in a RemoteMessage.
 
     Args:
       message: A remote_pb2.RequestMessage object.
+
+    Returns:
+      The serialized RemoteMessage.
     """
     req = remote_pb2.RemoteMessage()
     req.request_message.CopyFrom(message)
-    data = req.SerializeToString()
-    return self.send(data)
+    return req.SerializeToString()
+
+  def _send_message(self, message):
+    """Sends a RequestMessage wrapped in a RemoteMessage.
+
+    Args:
+      message: A remote_pb2.RequestMessage object.
+    """
+    if self.metrics is not None:
+      for field, _ in message.ListFields():
+        self.metrics.on_message_sent(field.name)
+    if self.tracer is None:
+      return self.send(self._encode_message(message))
+    with self._span('send'):
+      with self._span('encode'):
+        data = self._encode_message(message)
+      return self.send(data)
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+#
+# Copyright 2012 Steven Le (stevenle08@gmail.com)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Per-host circuit breaker for fleet operations.
+
+Touching an unreachable TV costs a full connect timeout. A CircuitBreaker
+shared by many protocols remembers which hosts keep failing to connect and
+makes further connects to them fail at once with CircuitOpenError:
+
+  circuits = breaker.CircuitBreaker(failure_threshold=3, reset_timeout=60)
+  gtv = googletv.AnymoteProtocol(host, cert, breaker=circuits)
+  gtv.connect()  # Raises CircuitOpenError while the host's circuit is open.
+
+Each host's circuit is:
+  closed: Connects go through. failure_threshold consecutive connect
+      failures open it.
+  open: Connects fail immediately, until reset_timeout seconds have passed.
+  half_open: A single trial connect is let through; the others still fail
+      immediately. Success closes the circuit, failure opens it again.
+"""
+
+import threading
+import googletv
+from googletv import clock
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(googletv.Error):
+  """Error thrown when connecting to a host whose circuit is open.
+
+  Attributes:
+    host: The host.
+    retry_in: Seconds until a trial connect will be allowed.
+  """
+
+  def __init__(self, host, retry_in):
+    if retry_in > 0:
+      detail = 'retry in %.1f s' % retry_in
+    else:
+      detail = 'a trial connect is in progress'
+    super(CircuitOpenError, self).__init__(
+        'Circuit for %s is open; %s' % (host, detail))
+    self.host = host
+    self.retry_in = retry_in
+
+
+class _Circuit(object):
+
+  def __init__(self):
+    self.state = CLOSED
+    self.failures = 0
+    self.opened_at = None
+    self.trial_in_flight = False
+
+
+class CircuitBreaker(object):
+  """Tracks the connect failures of many hosts.
+
+  Safe to share between threads and protocols.
+
+  Attributes:
+    failure_threshold: Consecutive failures that open a circuit.
+    reset_timeout: Seconds a circuit stays open before a trial connect.
+  """
+
+  def __init__(self, failure_threshold=3, reset_timeout=30.0):
+    self.failure_threshold = failure_threshold
+    self.reset_timeout = reset_timeout
+    self._lock = threading.Lock()
+    self._circuits = {}
+
+  def allow(self, host):
+    """Checks that a connect to host may go ahead.
+
+    Raises:
+      CircuitOpenError: If the circuit is open, or half-open with its trial
+          connect already in flight.
+    """
+    with self._lock:
+      circuit = self._circuits.get(host)
+      if circuit is None or circuit.state == CLOSED:
+        return
+      retry_in = circuit.opened_at + self.reset_timeout - clock.monotonic()
+      if circuit.state == OPEN and retry_in <= 0:
+        circuit.state = HALF_OPEN
+      if circuit.state == HALF_OPEN and not circuit.trial_in_flight:
+        circuit.trial_in_flight = True
+        return
+      raise CircuitOpenError(host, max(0.0, retry_in))
+
+  def record_success(self, host):
+    """Closes the host's circuit."""
+    with self._lock:
+      self._circuits.pop(host, None)
+
+  def record_failure(self, host):
+    """Counts a connect failure, opening the circuit if needed."""
+    with self._lock:
+      circuit = self._circuits.get(host)
+      if circuit is None:
+        circuit = self._circuits[host] = _Circuit()
+      circuit.failures += 1
+      circuit.trial_in_flight = False
+      if (circuit.state == HALF_OPEN or
+          circuit.failures >= self.failure_threshold):
+        circuit.state = OPEN
+        circuit.opened_at = clock.monotonic()
+
+  def release(self, host):
+    """Ends a trial connect that neither succeeded nor failed to connect.
+
+    The circuit stays half-open and the next connect becomes the trial.
+    """
+    with self._lock:
+      circuit = self._circuits.get(host)
+      if circuit is not None:
+        circuit.trial_in_flight = False
+
+  def state(self, host):
+    """Returns CLOSED, OPEN or HALF_OPEN.
+
+    A circuit whose reset_timeout has passed is reported as HALF_OPEN even
+    before a trial connect moves it there.
+    """
+    with self._lock:
+      return self._state(self._circuits.get(host))
+
+  def states(self):
+    """Returns a dict mapping every host that has failed to its state.
+
+    Hosts are listed from their first failure until a connect succeeds, so
+    closed circuits below the failure threshold are included. Hosts not listed
+    are closed.
+    """
+    with self._lock:
+      return dict((host, self._state(circuit))
+                  for host, circuit in self._circuits.iteritems())
+
+  def failures(self, host):
+    """Returns the host's consecutive connect failures."""
+    with self._lock:
+      circuit = self._circuits.get(host)
+      return 0 if circuit is None else circuit.failures
+
+  def reset(self, host=None):
+    """Closes the circuit of a host, or of every host."""
+    with self._lock:
+      if host is None:
+        self._circuits.clear()
+      else:
+        self._circuits.pop(host, None)
+
+  def _state(self, circuit):
+    if circuit is None:
+      return CLOSED
+    if (circuit.state == OPEN and
+        clock.monotonic() - circuit.opened_at >= self.reset_timeout):
+      return HALF_OPEN
+    return circuit.state
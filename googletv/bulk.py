@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+#
+# Copyright 2012 Steven Le (stevenle08@gmail.com)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Concurrent pairing of many Google TVs.
+
+Pairing a site by hand means running the pairing script against every TV.
+BulkPairer runs the PairingProtocol handshakes concurrently and asks a
+callback for each secret code, so that pairing many TVs is limited by how fast
+the operator can enter the codes.
+
+Example:
+  from googletv import bulk
+
+  def get_code(host, server_name):
+    return raw_input('Code shown on %s (%s): ' % (server_name, host))
+
+  pairer = bulk.BulkPairer('cert.pem', get_code)
+  print bulk.format_results(pairer.run(['tv1.local', 'tv2.local']))
+"""
+
+import collections
+import os
+import threading
+from multiprocessing import pool
+import googletv
+from googletv import certs
+from googletv import clock
+
+# Outcome of pairing one host:
+#   host: The host that was paired.
+#   success: Whether the Google TV accepted the secret.
+#   secret: The secret hash returned by the Google TV, as a hex string.
+#   server_name: The server name from PairingRequestAck, if received.
+#   elapsed: Seconds spent on the host, including waiting for the code.
+#   error: The exception raised, if the pairing failed.
+PairingResult = collections.namedtuple(
+    'PairingResult',
+    ['host', 'success', 'secret', 'server_name', 'elapsed', 'error'])
+
+
+class QueueCodeSource(object):
+  """Code callback fed from a Queue.Queue of (host, code) items.
+
+  Useful when the codes come from a separate UI thread: the UI puts codes on
+  the queue in any order and each handshake receives the code for its host.
+  """
+
+  def __init__(self, queue, timeout=None):
+    self.timeout = timeout
+    self._queue = queue
+    self._codes = {}
+    self._cond = threading.Condition()
+    self._thread = threading.Thread(target=self._run)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def __call__(self, host, unused_server_name):
+    deadline = None if self.timeout is None else (
+        clock.monotonic() + self.timeout)
+    with self._cond:
+      while host not in self._codes:
+        remaining = None if deadline is None else deadline - clock.monotonic()
+        if remaining is not None and remaining <= 0:
+          raise googletv.Error('No code received for %s' % host)
+        self._cond.wait(remaining)
+      return self._codes.pop(host)
+
+  def _run(self):
+    while True:
+      host, code = self._queue.get()
+      with self._cond:
+        self._codes[host] = code
+        self._cond.notify_all()
+
+
+class BulkPairer(object):
+  """Pairs a certificate with many Google TVs concurrently.
+
+  Each host is paired on an I/O worker thread. Certificate parsing for the
+  secret hash is handed to a separate compute pool as soon as the handshake
+  completes, so it overlaps with waiting for the operator's code.
+
+  Attributes:
+    certfile: Path to the client certificate to pair. Ignored if cert_dir is
+        set.
+    get_code: Function taking (host, server_name) and returning the code
+        displayed by that Google TV. Called concurrently from worker threads.
+    client_name: Client name sent in the PairingRequest.
+    port: Pairing Protocol port.
+    workers: Maximum number of concurrent handshakes.
+    pipelined: Whether to use the pipelined handshake.
+    store: Optional googletv.store.CredentialStore. Hosts it already lists as
+        paired with certfile are skipped, and new pairings are recorded.
+    cert_dir: If set, each host is paired with its own certificate,
+        cert_dir/<host>.pem. Missing certificates are taken from cert_pool,
+        or generated if there is no pool.
+    cert_pool: Optional googletv.certs.CertPool used with cert_dir.
+    connect_timeout: Seconds allowed to connect to each host.
+    timeout: Seconds allowed for each send or recv.
+    deadline: Seconds allowed for each network phase of a pairing (the
+        handshake, then the secret exchange). Waiting for the code is not
+        included.
+    metrics: Optional googletv.metrics.Registry the pairing connections
+        report into.
+    breaker: Optional googletv.breaker.CircuitBreaker. Hosts whose circuit is
+        open fail at once instead of waiting for connect_timeout; share one
+        breaker between runs so that retries only wait on healthy hosts.
+  """
+
+  def __init__(self, certfile, get_code, client_name='googletv-anymote',
+               port=9552, workers=32, compute_workers=2, pipelined=True,
+               store=None, cert_dir=None, cert_pool=None, connect_timeout=5.0,
+               timeout=10.0, deadline=30.0, metrics=None, breaker=None):
+    self.certfile = certfile
+    self.get_code = get_code
+    self.client_name = client_name
+    self.port = port
+    self.workers = workers
+    self.compute_workers = compute_workers
+    self.pipelined = pipelined
+    self.store = store
+    self.cert_dir = cert_dir
+    self.cert_pool = cert_pool
+    self.connect_timeout = connect_timeout
+    self.timeout = timeout
+    self.deadline = deadline
+    self.metrics = metrics
+    self.breaker = breaker
+
+  def certfile_for(self, host):
+    """Returns the path of the client certificate used for host."""
+    if self.cert_dir is None:
+      return self.certfile
+    return os.path.join(self.cert_dir, '%s.pem' % host)
+
+  def run(self, hosts):
+    """Pairs every host.
+
+    Args:
+      hosts: Iterable of host names or addresses.
+
+    Returns:
+      A list of PairingResult, in the order of hosts.
+    """
+    hosts = list(hosts)
+    results = {}
+    if self.store is not None:
+      for host, credential in self.store.get_many(hosts).iteritems():
+        if credential.certfile == os.path.abspath(self.certfile_for(host)):
+          results[host] = PairingResult(host, True, None,
+                                        credential.server_name, 0.0, None)
+    pending = [host for host in hosts if host not in results]
+    if pending:
+      io_pool = pool.ThreadPool(min(self.workers, len(pending)))
+      compute_pool = pool.ThreadPool(self.compute_workers)
+      try:
+        paired = io_pool.map(lambda host: self._pair(host, compute_pool),
+                             pending, chunksize=1)
+      finally:
+        io_pool.close()
+        compute_pool.close()
+      results.update((result.host, result) for result in paired)
+    return [results[host] for host in hosts]
+
+  def _pair(self, host, compute_pool):
+    start = clock.monotonic()
+    server_name = None
+    certfile = self.certfile_for(host)
+    try:
+      if self.cert_dir is not None and not os.path.isfile(certfile):
+        if self.cert_pool is not None:
+          self.cert_pool.take(certfile)
+        else:
+          certs.generate_cert(certfile)
+      with googletv.PairingProtocol(
+          host, certfile, port=self.port, connect_timeout=self.connect_timeout,
+          timeout=self.timeout, metrics=self.metrics,
+          breaker=self.breaker) as gtv:
+        with gtv.deadline(self.deadline):
+          ack = gtv.handshake(self.client_name, pipelined=self.pipelined)
+        server_name = ack.server_name
+        key_material = compute_pool.apply_async(gtv.prepare_secret)
+        code = self.get_code(host, server_name)
+        key_material.get()
+        with gtv.deadline(self.deadline):
+          gtv.send_secret(code)
+          secret = gtv.recv_secret_ack().secret
+        if self.store is not None:
+          self.store.put(host, gtv.peer_fingerprint(), certfile,
+                         server_name=server_name)
+    except Exception as e:  # pylint: disable=broad-except
+      return PairingResult(host, False, None, server_name,
+                           clock.monotonic() - start, e)
+    return PairingResult(host, True, ''.join('%02X' % ord(x) for x in secret),
+                         server_name, clock.monotonic() - start, None)
+
+
+def format_results(results):
+  """Formats a list of PairingResult as a text table."""
+  rows = [('HOST', 'STATUS', 'SERVER NAME', 'SECONDS', 'DETAIL')]
+  for result in results:
+    if result.success and result.secret is None:
+      status, detail = 'paired', 'already in credential store'
+    elif result.success:
+      status, detail = 'paired', result.secret
+    else:
+      status, detail = 'failed', '%s: %s' % (type(result.error).__name__,
+                                              result.error)
+    rows.append((result.host, status, result.server_name or '-',
+                 '%.1f' % result.elapsed, detail))
+  widths = [max(len(row[i]) for row in rows) for i in xrange(4)]
+  lines = []
+  for row in rows:
+    cells = [cell.ljust(width) for cell, width in zip(row, widths)]
+    lines.append('  '.join(cells + [row[4]]))
+  return '\n'.join(lines)
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+#
+# Copyright 2012 Steven Le (stevenle08@gmail.com)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""In-process generation of self-signed client certificates.
+
+Generating certificates with M2Crypto avoids forking openssl for every
+certificate. CertPool goes further and generates keypairs and certificates in
+the background, ahead of demand, so that pairing can take a ready certificate
+immediately.
+
+Example:
+  from googletv import certs
+
+  certs.generate_cert('cert.pem')
+
+  cert_pool = certs.CertPool(size=8)
+  cert_pool.take('tv1.pem')
+"""
+
+import collections
+import os
+import random
+import tempfile
+import threading
+import time
+import M2Crypto.ASN1
+import M2Crypto.EVP
+import M2Crypto.RSA
+import M2Crypto.X509
+
+# Subject fields used by scripts/pair.py since its first version.
+DEFAULT_SUBJECT = collections.OrderedDict([
+    ('C', 'US'),
+    ('ST', 'CA'),
+    ('L', 'Mountain View'),
+    ('CN', 'anymote/python/googletv'),
+])
+
+
+def make_cert_pem(subject=None, bits=1024, days=365):
+  """Generates an RSA key and a self-signed certificate.
+
+  Args:
+    subject: Dict of X509 name fields (C, ST, L, CN, ...). Defaults to
+        DEFAULT_SUBJECT.
+    bits: RSA key size.
+    days: Validity period of the certificate.
+
+  Returns:
+    The private key followed by the certificate, PEM-encoded.
+  """
+  rsa = M2Crypto.RSA.gen_key(bits, 65537, lambda *unused_args: None)
+  pkey = M2Crypto.EVP.PKey()
+  pkey.assign_rsa(rsa, capture=False)
+
+  name = M2Crypto.X509.X509_Name()
+  for field, value in (subject or DEFAULT_SUBJECT).iteritems():
+    setattr(name, field, value)
+
+  now = long(time.time())
+  not_before = M2Crypto.ASN1.ASN1_UTCTIME()
+  not_before.set_time(now)
+  not_after = M2Crypto.ASN1.ASN1_UTCTIME()
+  not_after.set_time(now + days * 24 * 60 * 60)
+
+  cert = M2Crypto.X509.X509()
+  cert.set_version(2)
+  cert.set_serial_number(random.SystemRandom().getrandbits(63))
+  cert.set_subject(name)
+  cert.set_issuer(name)
+  cert.set_pubkey(pkey)
+  cert.set_not_before(not_before)
+  cert.set_not_after(not_after)
+  cert.sign(pkey, 'sha256')
+  return rsa.as_pem(cipher=None) + cert.as_pem()
+
+
+def write_pem(filename, pem):
+  """Atomically writes a PEM file readable only by its owner.
+
+  The data is written to a temporary file in the same directory and renamed
+  into place, so readers never see a partially written certificate.
+  """
+  directory = os.path.dirname(os.path.abspath(filename))
+  fd, tmp = tempfile.mkstemp(dir=directory, prefix='.cert-', suffix='.tmp')
+  try:
+    with os.fdopen(fd, 'w') as f:
+      f.write(pem)
+    os.rename(tmp, filename)
+  except:
+    os.unlink(tmp)
+    raise
+
+
+def generate_cert(filename, subject=None, bits=1024, days=365):
+  """Generates a self-signed certificate and writes it to filename."""
+  write_pem(filename, make_cert_pem(subject, bits, days))
+
+
+class CertPool(object):
+  """Keeps a supply of pre-generated certificates.
+
+  Background threads generate certificates until `size` are ready. take()
+  hands out a ready certificate, or generates one inline if the pool is
+  empty, and the pool refills behind it.
+  """
+
+  def __init__(self, size=8, workers=1, subject=None, bits=1024, days=365):
+    self.size = size
+    self.subject = subject
+    self.bits = bits
+    self.days = days
+    self._ready = collections.deque()
+    self._cond = threading.Condition()
+    self._in_progress = 0
+    self._closed = False
+    self._threads = []
+    for _ in xrange(workers):
+      thread = threading.Thread(target=self._run)
+      thread.daemon = True
+      thread.start()
+      self._threads.append(thread)
+
+  @property
+  def available(self):
+    """Number of certificates ready to be taken."""
+    return len(self._ready)
+
+  def take(self, filename=None):
+    """Takes a certificate from the pool.
+
+    Args:
+      filename: If provided, the certificate is atomically written there.
+
+    Returns:
+      The private key and certificate, PEM-encoded.
+    """
+    with self._cond:
+      pem = self._ready.popleft() if self._ready else None
+      self._cond.notify()
+    if pem is None:
+      pem = make_cert_pem(self.subject, self.bits, self.days)
+    if filename is not None:
+      write_pem(filename, pem)
+    return pem
+
+  def close(self, timeout=None):
+    """Stops generating certificates, waiting for any in progress."""
+    with self._cond:
+      self._closed = True
+      self._cond.notify_all()
+    for thread in self._threads:
+      thread.join(timeout)
+
+  def _run(self):
+    while True:
+      with self._cond:
+        while (not self._closed and
+               len(self._ready) + self._in_progress >= self.size):
+          self._cond.wait()
+        if self._closed:
+          return
+        self._in_progress += 1
+      pem = None
+      try:
+        pem = make_cert_pem(self.subject, self.bits, self.days)
+      finally:
+        with self._cond:
+          self._in_progress -= 1
+          if pem is not None:
+            self._ready.append(pem)
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+#
+# Copyright 2012 Steven Le (stevenle08@gmail.com)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Monotonic clock used for deadlines and latency measurements."""
+
+import sys
+import time
+
+# CLOCK_MONOTONIC from <time.h> on Linux.
+_CLOCK_MONOTONIC = 1
+
+
+def _make_clock_gettime():
+  """Returns a monotonic clock backed by clock_gettime, or None."""
+  if not sys.platform.startswith('linux'):
+    return None
+  # Imported here: ctypes.util pulls in subprocess and tempfile, and
+  # find_library runs ldconfig, which would be paid on every import.
+  import ctypes
+
+  class Timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+  try:
+    try:
+      librt = ctypes.CDLL('librt.so.1', use_errno=True)
+    except OSError:
+      import ctypes.util
+      librt = ctypes.CDLL(ctypes.util.find_library('rt'), use_errno=True)
+    clock_gettime = librt.clock_gettime
+  except (OSError, AttributeError):
+    return None
+  clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(Timespec)]
+
+  def monotonic():
+    # clock_gettime runs without the GIL, so each call needs its own struct.
+    ts = Timespec()
+    if clock_gettime(_CLOCK_MONOTONIC, ctypes.byref(ts)) != 0:
+      raise OSError(ctypes.get_errno(), 'clock_gettime failed')
+    return ts.tv_sec + ts.tv_nsec * 1e-9
+  return monotonic
+
+
+# Python 3.3+ provides time.monotonic. On older interpreters fall back to
+# clock_gettime(CLOCK_MONOTONIC), and to the wall clock as a last resort.
+monotonic = (getattr(time, 'monotonic', None) or _make_clock_gettime() or
+             time.time)
+
+
+def sleep_until(when, spin=0.002):
+  """Sleeps until the monotonic clock reaches the given time.
+
+  Args:
+    when: Target time, as returned by monotonic().
+    spin: The last `spin` seconds are busy-waited, as time.sleep can overshoot
+        by a scheduler tick.
+  """
+  remaining = when - monotonic()
+  if remaining > spin:
+    time.sleep(remaining - spin)
+  while monotonic() < when:
+    pass
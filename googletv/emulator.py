@@ -0,0 +1,402 @@
+#!/usr/bin/env python
+#
+# Copyright 2012 Steven Le (stevenle08@gmail.com)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Local stand-in for a Google TV, for load and latency testing.
+
+Emulator runs a polo pairing server and an Anymote server over TLS on
+loopback, so PairingProtocol and AnymoteProtocol can be benchmarked and
+soak-tested without a TV. The pairing server checks the secret hash exactly
+as a TV does; the Anymote server answers fling and data requests.
+
+Processing latency, jitter, a per-connection throughput cap and random
+connection drops are configurable.
+
+Example:
+  with emulator.Emulator('cert.pem', code='1234') as tv:
+    with googletv.PairingProtocol('127.0.0.1', 'cert.pem',
+                                  port=tv.pairing_port) as gtv:
+      gtv.handshake('test')
+      gtv.send_secret(tv.code)
+      gtv.recv_secret_ack()
+"""
+
+import Queue
+import collections
+import hashlib
+import os
+import random
+import socket
+import ssl
+import struct
+import threading
+import M2Crypto.X509
+import googletv
+from googletv import clock
+from googletv.proto import polo_pb2
+from googletv.proto import remote_pb2
+
+_OUTER = polo_pb2.OuterMessage
+
+
+def secret_hash(client_cert, server_cert, code):
+  """Computes the polo secret hash for a pairing code.
+
+  Args:
+    client_cert: M2Crypto.X509.X509 presented by the client.
+    server_cert: M2Crypto.X509.X509 presented by the server.
+    code: The hex code displayed by the TV.
+
+  Returns:
+    The SHA256 digest the client must send in its Secret message.
+  """
+  cexp, cmod = googletv.rsa_public_numbers(client_cert)
+  sexp, smod = googletv.rsa_public_numbers(server_cert)
+  encoded = code.decode('hex')
+  digest = hashlib.sha256()
+  for part in (cmod, cexp, smod, sexp, encoded[len(encoded) // 2:]):
+    digest.update(part)
+  return digest.digest()
+
+
+class _Connection(object):
+  """One accepted client connection.
+
+  The reader thread timestamps every frame as it arrives; the replier thread
+  sends each reply once the simulated processing time has elapsed, keeping
+  replies in request order.
+  """
+
+  def __init__(self, emulator, conn, handler):
+    self.emulator = emulator
+    self.conn = conn
+    self.handler = handler
+    self.replies = Queue.Queue()
+    self.last_due = 0.0
+    self.closed = False
+
+  def run(self):
+    replier = threading.Thread(target=self._reply)
+    replier.daemon = True
+    replier.start()
+    emulator = self.emulator
+    slot = 0.0
+    try:
+      while True:
+        if emulator.max_rate:
+          clock.sleep_until(slot)
+          slot = max(slot, clock.monotonic()) + 1.0 / emulator.max_rate
+        data = self._recv_frame()
+        if data is None:
+          break
+        arrived = clock.monotonic()
+        if emulator._should_drop():
+          break
+        try:
+          reply = self.handler(self, data, arrived)
+        except Exception:  # pylint: disable=broad-except
+          # A frame that cannot be decoded; hang up on the client.
+          emulator._count('errors')
+          break
+        if reply is not None:
+          due = max(arrived + emulator._processing_time(), self.last_due)
+          self.last_due = due
+          self.replies.put((due, reply))
+    except socket.error:
+      pass
+    finally:
+      self.replies.put(None)
+      replier.join()
+      self.close()
+
+  def close(self):
+    if self.closed:
+      return
+    self.closed = True
+    try:
+      self.conn.shutdown(socket.SHUT_RDWR)
+    except socket.error:
+      pass
+    self.conn.close()
+
+  def _reply(self):
+    while True:
+      item = self.replies.get()
+      if item is None:
+        return
+      due, data = item
+      clock.sleep_until(due)
+      try:
+        self.conn.write(googletv.frame(data))
+      except (socket.error, ValueError):
+        return
+
+  def _recv_exactly(self, size):
+    data = []
+    while size:
+      chunk = self.conn.recv(size)
+      if not chunk:
+        return None
+      data.append(chunk)
+      size -= len(chunk)
+    return ''.join(data)
+
+  def _recv_frame(self):
+    header = self._recv_exactly(4)
+    if header is None:
+      return None
+    return self._recv_exactly(struct.unpack('!I', header)[0])
+
+
+class Emulator(object):
+  """Emulates the pairing and Anymote servers of a Google TV.
+
+  Attributes:
+    code: The hex pairing code "displayed" for every pairing.
+    pairing_port: Port of the pairing server, once started.
+    anymote_port: Port of the Anymote server, once started.
+  """
+
+  def __init__(self, certfile, host='127.0.0.1', pairing_port=0,
+               anymote_port=0, code=None, server_name='emulator',
+               client_certs=None, latency=0.0, jitter=0.0, max_rate=None,
+               drop_rate=0.0, seed=None, on_request=None):
+    """Constructor.
+
+    Args:
+      certfile: Cert and private key file presented to clients.
+      host: Address to listen on.
+      pairing_port: Port of the pairing server; 0 picks a free port.
+      anymote_port: Port of the Anymote server; 0 picks a free port.
+      code: Hex pairing code; random 4 digits if not provided.
+      server_name: Name sent in PairingRequestAck.
+      client_certs: File of client certs the servers accept; connections
+          presenting any other cert are refused. The secret hash covers the
+          client key, so clients without a cert cannot pair. Defaults to
+          certfile, so clients may share the server cert.
+      latency: Seconds of processing time before each reply.
+      jitter: Maximum seconds randomly added to or removed from latency.
+      max_rate: Maximum frames per second read from each connection; the
+          rest wait in the socket buffers, pushing back on the client.
+      drop_rate: Probability that a received frame makes the server drop the
+          connection without answering.
+      seed: Seed for the jitter and drop random number generator.
+      on_request: Optional callback run on a server thread for every frame
+          received, with (kind, message, arrival time on the clock.monotonic()
+          clock). kind is the polo message type name, or the Anymote request
+          field name, e.g. 'key_event_message'.
+    """
+    self.certfile = certfile
+    self.host = host
+    self.code = code or os.urandom(2).encode('hex').upper()
+    self.server_name = server_name
+    self.client_certs = client_certs or certfile
+    self.latency = latency
+    self.jitter = jitter
+    self.max_rate = max_rate
+    self.drop_rate = drop_rate
+    self.on_request = on_request
+    self.pairing_port = pairing_port
+    self.anymote_port = anymote_port
+    self._server_cert = M2Crypto.X509.load_cert(certfile)
+    self._random = random.Random(seed)
+    self._lock = threading.Lock()
+    self._counters = collections.Counter()
+    self._listeners = []
+    self._threads = []
+    self._connections = set()
+    self._serving = set()
+
+  def __enter__(self):
+    self.start()
+    return self
+
+  def __exit__(self, unused_type, unused_val, unused_traceback):
+    self.stop()
+
+  def start(self):
+    """Starts listening and serving in background threads."""
+    self.pairing_port = self._listen(self.pairing_port, self._handle_polo)
+    self.anymote_port = self._listen(self.anymote_port, self._handle_anymote)
+
+  def stop(self):
+    """Closes the listeners and every open connection."""
+    for listener in self._listeners:
+      try:
+        listener.shutdown(socket.SHUT_RDWR)
+      except socket.error:
+        pass
+      listener.close()
+    for thread in self._threads:
+      thread.join()
+    with self._lock:
+      connections = list(self._connections)
+      serving = list(self._serving)
+    for connection in connections:
+      connection.close()
+    for thread in serving:
+      thread.join(1.0)
+    self._listeners = []
+    self._threads = []
+
+  def stats(self):
+    """Returns a dict of counters of connections, frames, outcomes and drops.
+
+    The keys are 'connections', each frame kind, 'pairings', 'bad_secrets',
+    'drops' and 'errors'.
+    """
+    with self._lock:
+      return dict(self._counters)
+
+  def _count(self, key):
+    with self._lock:
+      self._counters[key] += 1
+
+  def _processing_time(self):
+    delay = self.latency
+    if self.jitter:
+      delay += self._random.uniform(-self.jitter, self.jitter)
+    return max(0.0, delay)
+
+  def _should_drop(self):
+    if self.drop_rate and self._random.random() < self.drop_rate:
+      self._count('drops')
+      return True
+    return False
+
+  def _listen(self, port, handler):
+    listener = socket.socket()
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((self.host, port))
+    listener.listen(128)
+    self._listeners.append(listener)
+    thread = threading.Thread(target=self._accept, args=(listener, handler))
+    thread.daemon = True
+    thread.start()
+    self._threads.append(thread)
+    return listener.getsockname()[1]
+
+  def _accept(self, listener, handler):
+    while True:
+      try:
+        raw, _ = listener.accept()
+      except socket.error:
+        return
+      thread = threading.Thread(target=self._serve, args=(raw, handler))
+      thread.daemon = True
+      with self._lock:
+        self._serving.add(thread)
+      thread.start()
+
+  def _serve(self, raw, handler):
+    try:
+      try:
+        conn = ssl.wrap_socket(raw, server_side=True, certfile=self.certfile,
+                               cert_reqs=ssl.CERT_OPTIONAL,
+                               ca_certs=self.client_certs)
+      except (socket.error, ssl.SSLError):
+        raw.close()
+        return
+      self._count('connections')
+      connection = _Connection(self, conn, handler)
+      with self._lock:
+        self._connections.add(connection)
+      try:
+        connection.run()
+      finally:
+        with self._lock:
+          self._connections.discard(connection)
+    finally:
+      with self._lock:
+        self._serving.discard(threading.current_thread())
+
+  def _notify(self, kind, message, arrived):
+    self._count(kind)
+    if self.on_request is not None:
+      self.on_request(kind, message, arrived)
+
+  def _handle_polo(self, connection, data, arrived):
+    req = _OUTER.FromString(data)
+    message_class = googletv.POLO_MESSAGE_CLASSES.get(req.type)
+    if message_class is None:
+      self._count('errors')
+      return _OUTER(protocol_version=1,
+                    status=_OUTER.STATUS_ERROR).SerializeToString()
+    message = message_class.FromString(req.payload)
+    self._notify(_OUTER.MessageType.Name(req.type), message, arrived)
+
+    status = _OUTER.STATUS_OK
+    if req.type == _OUTER.MESSAGE_TYPE_PAIRING_REQUEST:
+      reply_type = _OUTER.MESSAGE_TYPE_PAIRING_REQUEST_ACK
+      reply = polo_pb2.PairingRequestAck(server_name=self.server_name)
+    elif req.type == _OUTER.MESSAGE_TYPE_OPTIONS:
+      reply_type = _OUTER.MESSAGE_TYPE_OPTIONS
+      reply = polo_pb2.Options(preferred_role=polo_pb2.Options.ROLE_TYPE_INPUT)
+      encoding = reply.input_encodings.add()
+      encoding.type = polo_pb2.Options.Encoding.ENCODING_TYPE_HEXADECIMAL
+      encoding.symbol_length = len(self.code)
+    elif req.type == _OUTER.MESSAGE_TYPE_CONFIGURATION:
+      reply_type = _OUTER.MESSAGE_TYPE_CONFIGURATION_ACK
+      reply = polo_pb2.ConfigurationAck()
+    elif req.type == _OUTER.MESSAGE_TYPE_SECRET:
+      expected = self._expected_secret(connection)
+      if expected is not None and message.secret == expected:
+        self._count('pairings')
+        reply_type = _OUTER.MESSAGE_TYPE_SECRET_ACK
+        reply = polo_pb2.SecretAck(secret=expected)
+      else:
+        self._count('bad_secrets')
+        status = _OUTER.STATUS_BAD_SECRET
+        reply_type = reply = None
+    else:
+      status = _OUTER.STATUS_ERROR
+      reply_type = reply = None
+
+    out = _OUTER(protocol_version=1, status=status)
+    if reply is not None:
+      out.type = reply_type
+      out.payload = reply.SerializeToString()
+    return out.SerializeToString()
+
+  def _expected_secret(self, connection):
+    der = connection.conn.getpeercert(True)
+    if der is None:
+      return None
+    client_cert = M2Crypto.X509.load_cert_der_string(der)
+    return secret_hash(client_cert, self._server_cert, self.code)
+
+  def _handle_anymote(self, connection, data, arrived):
+    message = remote_pb2.RemoteMessage.FromString(data)
+    if not message.HasField('request_message'):
+      return None
+    request = message.request_message
+    fields = request.ListFields()
+    if not fields:
+      return None
+    kind = fields[0][0].name
+    self._notify(kind, fields[0][1], arrived)
+
+    reply = remote_pb2.RemoteMessage()
+    if message.HasField('sequence_number'):
+      reply.sequence_number = message.sequence_number
+    if kind == 'fling_message':
+      reply.response_message.fling_result_message.result = (
+          remote_pb2.FlingResult.SUCCESS)
+    elif kind == 'data_message':
+      reply.response_message.data_message.CopyFrom(request.data_message)
+    else:
+      return None
+    return reply.SerializeToString()
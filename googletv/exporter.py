@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+#
+# Copyright 2012 Steven Le (stevenle08@gmail.com)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Prometheus text-format exporter for googletv.metrics.Registry.
+
+MetricsServer serves the metrics of a Registry over HTTP using only the
+standard library:
+
+  registry = metrics.Registry()
+  server = exporter.MetricsServer(registry, port=9464)
+  server.start()
+  gtv = googletv.AnymoteProtocol(host, cert, metrics=registry)
+
+Every scrape renders the per-host aggregates kept by the registry, so its
+cost grows with the number of hosts, not connections.
+"""
+
+import BaseHTTPServer
+import SocketServer
+import threading
+from googletv import metrics as metrics_lib
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# (name, type, help, HostMetrics attribute) of the per-host scalars.
+_HOST_METRICS = (
+    ('googletv_connections_open', 'gauge',
+     'Connections currently open.', 'open_connections'),
+    ('googletv_connects_total', 'counter',
+     'Successful connects.', 'connects'),
+    ('googletv_reconnects_total', 'counter',
+     'Reconnects.', 'reconnects'),
+    ('googletv_frames_sent_total', 'counter',
+     'Frames sent.', 'frames_sent'),
+    ('googletv_bytes_sent_total', 'counter',
+     'Bytes sent, including frame headers.', 'bytes_sent'),
+    ('googletv_frames_received_total', 'counter',
+     'Frames received.', 'frames_received'),
+    ('googletv_bytes_received_total', 'counter',
+     'Bytes received, including frame headers.', 'bytes_received'),
+)
+
+# (name, help, HostMetrics attribute) of the per-host message counters.
+_TYPE_METRICS = (
+    ('googletv_messages_sent_total', 'Messages sent, by type.',
+     'sent_by_type'),
+    ('googletv_messages_received_total', 'Messages received, by type.',
+     'received_by_type'),
+)
+
+# (name, help, HostMetrics attribute) of the per-host histograms.
+_HISTOGRAMS = (
+    ('googletv_connect_seconds', 'TCP connect duration.', 'connect_time'),
+    ('googletv_tls_handshake_seconds', 'TLS handshake duration.',
+     'handshake_time'),
+    ('googletv_send_latency_seconds', 'Socket write duration.',
+     'send_latency'),
+)
+
+
+def _escape(value):
+  return (str(value).replace('\\', '\\\\').replace('"', '\\"')
+          .replace('\n', '\\n'))
+
+
+def _labels(**labels):
+  return '{%s}' % ','.join('%s="%s"' % (k, _escape(v))
+                           for k, v in sorted(labels.iteritems()))
+
+
+def _format_bound(bound):
+  if bound == float('inf'):
+    return '+Inf'
+  return repr(bound)
+
+
+def render(registry):
+  """Renders the metrics of a Registry in the Prometheus text format."""
+  snapshots = sorted((host, m.snapshot())
+                     for host, m in registry.hosts().iteritems())
+  lines = []
+
+  for name, metric_type, help_text, key in _HOST_METRICS:
+    lines.append('# HELP %s %s' % (name, help_text))
+    lines.append('# TYPE %s %s' % (name, metric_type))
+    for host, snapshot in snapshots:
+      lines.append('%s%s %d' % (name, _labels(host=host), snapshot[key]))
+
+  for name, help_text, key in _TYPE_METRICS:
+    lines.append('# HELP %s %s' % (name, help_text))
+    lines.append('# TYPE %s counter' % name)
+    for host, snapshot in snapshots:
+      for message_type, count in sorted(snapshot[key].iteritems()):
+        lines.append('%s%s %d' % (
+            name, _labels(host=host, type=message_type), count))
+
+  bounds = [_format_bound(b) for b in metrics_lib.Histogram.upper_bounds()]
+  for name, help_text, key in _HISTOGRAMS:
+    lines.append('# HELP %s %s' % (name, help_text))
+    lines.append('# TYPE %s histogram' % name)
+    for host, snapshot in snapshots:
+      histogram = snapshot[key]
+      cumulative = 0
+      for bound, count in zip(bounds, histogram['buckets']):
+        cumulative += count
+        lines.append('%s_bucket%s %d' % (
+            name, _labels(host=host, le=bound), cumulative))
+      lines.append('%s_sum%s %r' % (name, _labels(host=host),
+                                    histogram['sum']))
+      lines.append('%s_count%s %d' % (name, _labels(host=host),
+                                      histogram['count']))
+
+  gauges = registry.gauges()
+  if gauges:
+    lines.append('# HELP googletv_gauge Values registered with add_gauge().')
+    lines.append('# TYPE googletv_gauge gauge')
+    for gauge_name, value in sorted(gauges.iteritems()):
+      lines.append('googletv_gauge%s %r' % (_labels(name=gauge_name),
+                                            float(value)))
+
+  lines.append('')
+  return '\n'.join(lines)
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+  def do_GET(self):  # pylint: disable=invalid-name
+    if self.path.split('?')[0] not in ('/', '/metrics'):
+      self.send_error(404)
+      return
+    body = render(self.server.registry)
+    self.send_response(200)
+    self.send_header('Content-Type', CONTENT_TYPE)
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, *args):
+    pass
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  daemon_threads = True
+  allow_reuse_address = True
+
+
+class MetricsServer(object):
+  """Serves a Registry at http://host:port/metrics from a background thread.
+
+  Attributes:
+    port: The port listened on, once started.
+  """
+
+  def __init__(self, registry, host='', port=9464):
+    self.registry = registry
+    self.host = host
+    self.port = port
+    self._server = None
+    self._thread = None
+
+  def start(self):
+    self._server = _Server((self.host, self.port), _Handler)
+    self._server.registry = self.registry
+    self.port = self._server.server_address[1]
+    self._thread = threading.Thread(target=self._server.serve_forever)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def stop(self):
+    if self._server is not None:
+      self._server.shutdown()
+      self._server.server_close()
+      self._thread.join()
+      self._server = None
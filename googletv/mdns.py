@@ -0,0 +1,516 @@
+#!/usr/bin/env python
+#
+# Copyright 2012 Steven Le (stevenle08@gmail.com)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Pure-Python multicast DNS discovery of Anymote services.
+
+discover() sends one-shot mDNS queries (RFC 6762) from an ephemeral port, so
+responders answer it directly, and collects every responder within a time
+budget. Instances whose SRV, TXT or address records were not included in the
+first answers are resolved with follow-up queries. The follow-ups for all
+pending names go out together, so the resolutions run in parallel.
+
+DiscoveryCache keeps the results in memory instead. It listens on the mDNS
+group for announcements and goodbyes, expires records when their TTL runs
+out, re-queries only records that are about to expire, and notifies
+subscribers when services appear or disappear.
+
+Example:
+  from googletv import mdns
+
+  for service in mdns.discover(timeout=2.0):
+    print service.name, service.address, service.port
+
+googletv.responder provides a local responder to test discovery against.
+"""
+
+import collections
+import select
+import socket
+import struct
+import threading
+from googletv import clock
+
+MDNS_ADDRESS = ('224.0.0.251', 5353)
+ANYMOTE_SERVICE = '_anymote._tcp.local'
+
+TYPE_A = 1
+TYPE_PTR = 12
+TYPE_TXT = 16
+TYPE_AAAA = 28
+TYPE_SRV = 33
+CLASS_IN = 1
+
+# Top bit of the class: "unicast response" in questions, "cache flush" in
+# records.
+_CLASS_FLAG = 0x8000
+_HEADER = struct.Struct('!HHHHHH')
+_RR = struct.Struct('!HHIH')
+_FLAG_RESPONSE = 0x8000
+
+# A resource record. data is a name for PTR, (priority, weight, port, target)
+# for SRV, an address string for A and AAAA, and raw bytes otherwise.
+Record = collections.namedtuple('Record', ['name', 'type', 'ttl', 'data'])
+
+# A discovered service instance. name keeps the case the responder used; DNS
+# names are otherwise compared case-insensitively.
+Service = collections.namedtuple(
+    'Service', ['name', 'host', 'address', 'port', 'addresses'])
+
+# Fractions of a record's TTL at which it is re-queried (RFC 6762, 5.2).
+REFRESH_POINTS = (0.80, 0.85, 0.90, 0.95)
+
+
+class ParseError(Exception):
+  """Error thrown when a DNS message is malformed."""
+
+
+def encode_name(name):
+  labels = [label for label in name.rstrip('.').split('.') if label]
+  return ''.join(chr(len(label)) + label for label in labels) + '\0'
+
+
+def encode_query(questions, unicast=True):
+  """Encodes a DNS query.
+
+  Args:
+    questions: List of (name, type) pairs.
+    unicast: Whether to ask responders to answer by unicast (QU bit).
+
+  Returns:
+    The query packet.
+  """
+  qclass = CLASS_IN | (_CLASS_FLAG if unicast else 0)
+  parts = [_HEADER.pack(0, 0, len(questions), 0, 0, 0)]
+  for name, qtype in questions:
+    parts.append(encode_name(name))
+    parts.append(struct.pack('!HH', qtype, qclass))
+  return ''.join(parts)
+
+
+def encode_response(records):
+  """Encodes a DNS response carrying records in its answer section.
+
+  Args:
+    records: List of Record, with data in the form parse_message() returns.
+        Only PTR, SRV, TXT, A and AAAA records are supported.
+
+  Returns:
+    The response packet.
+  """
+  parts = [_HEADER.pack(0, _FLAG_RESPONSE | 0x0400, 0, len(records), 0, 0)]
+  for record in records:
+    if record.type == TYPE_PTR:
+      rdata = encode_name(record.data)
+    elif record.type == TYPE_SRV:
+      priority, weight, port, target = record.data
+      rdata = struct.pack('!HHH', priority, weight, port) + encode_name(target)
+    elif record.type == TYPE_A:
+      rdata = socket.inet_aton(record.data)
+    elif record.type == TYPE_AAAA:
+      rdata = socket.inet_pton(socket.AF_INET6, record.data)
+    else:
+      rdata = record.data
+    parts.append(encode_name(record.name))
+    parts.append(_RR.pack(record.type, CLASS_IN, record.ttl, len(rdata)))
+    parts.append(rdata)
+  return ''.join(parts)
+
+
+def _decode_name(data, pos):
+  """Decodes a possibly compressed name; returns (name, end position)."""
+  labels = []
+  end = None
+  jumps = 0
+  while True:
+    if pos >= len(data):
+      raise ParseError('Name runs past the end of the message')
+    length = ord(data[pos])
+    if length & 0xc0 == 0xc0:
+      if pos + 1 >= len(data):
+        raise ParseError('Truncated name pointer')
+      if end is None:
+        end = pos + 2
+      jumps += 1
+      if jumps > 64:
+        raise ParseError('Name pointer loop')
+      pos = ((length & 0x3f) << 8) | ord(data[pos + 1])
+    elif length == 0:
+      return '.'.join(labels), end if end is not None else pos + 1
+    else:
+      labels.append(data[pos + 1:pos + 1 + length])
+      pos += 1 + length
+
+
+def parse_questions(data):
+  """Parses the question section of a DNS message.
+
+  Returns:
+    A list of (name, type) pairs, with lowercase names.
+
+  Raises:
+    ParseError: If the message is malformed.
+  """
+  if len(data) < _HEADER.size:
+    raise ParseError('Message too short')
+  qdcount = _HEADER.unpack_from(data)[2]
+  pos = _HEADER.size
+  questions = []
+  try:
+    for _ in xrange(qdcount):
+      name, pos = _decode_name(data, pos)
+      qtype = struct.unpack_from('!H', data, pos)[0]
+      pos += 4
+      questions.append((name.lower(), qtype))
+  except struct.error:
+    raise ParseError('Truncated question')
+  return questions
+
+
+def parse_message(data):
+  """Parses a DNS message.
+
+  Returns:
+    A (is_response, records) tuple, where records holds the records of the
+    answer, authority and additional sections.
+
+  Raises:
+    ParseError: If the message is malformed.
+  """
+  if len(data) < _HEADER.size:
+    raise ParseError('Message too short')
+  _, flags, qdcount, ancount, nscount, arcount = _HEADER.unpack_from(data)
+  pos = _HEADER.size
+  try:
+    for _ in xrange(qdcount):
+      _, pos = _decode_name(data, pos)
+      pos += 4
+    records = []
+    for _ in xrange(ancount + nscount + arcount):
+      name, pos = _decode_name(data, pos)
+      rtype, _, ttl, rdlength = _RR.unpack_from(data, pos)
+      pos += _RR.size
+      rdata_end = pos + rdlength
+      if rdata_end > len(data):
+        raise ParseError('Record data runs past the end of the message')
+      if rtype == TYPE_PTR:
+        value = _decode_name(data, pos)[0]
+      elif rtype == TYPE_SRV:
+        priority, weight, port = struct.unpack_from('!HHH', data, pos)
+        value = (priority, weight, port, _decode_name(data, pos + 6)[0])
+      elif rtype == TYPE_A and rdlength == 4:
+        value = socket.inet_ntoa(data[pos:rdata_end])
+      elif rtype == TYPE_AAAA and rdlength == 16:
+        value = socket.inet_ntop(socket.AF_INET6, data[pos:rdata_end])
+      else:
+        value = data[pos:rdata_end]
+      records.append(Record(name.lower(), rtype, ttl, value))
+      pos = rdata_end
+  except struct.error:
+    raise ParseError('Truncated record')
+  return bool(flags & _FLAG_RESPONSE), records
+
+
+class _Collector(object):
+  """Accumulates records and works out what is still unresolved."""
+
+  def __init__(self, service):
+    self.service = service.lower()
+    self.instances = []
+    # Lowercase instance name -> name as the responder spelled it.
+    self.names = {}
+    self.srv = {}
+    self.addresses = collections.defaultdict(list)
+
+  def add(self, records):
+    for record in records:
+      if record.type == TYPE_PTR and record.name == self.service:
+        key = record.data.lower()
+        if record.ttl and key not in self.instances:
+          self.instances.append(key)
+          self.names[key] = record.data
+      elif record.type == TYPE_SRV:
+        self.srv[record.name] = record.data
+      elif record.type in (TYPE_A, TYPE_AAAA):
+        if record.data not in self.addresses[record.name]:
+          self.addresses[record.name].append(record.data)
+
+  def missing(self):
+    """Returns the (name, type) questions needed to finish resolving."""
+    questions = []
+    for instance in self.instances:
+      srv = self.srv.get(instance)
+      if srv is None:
+        questions.append((instance, TYPE_SRV))
+      elif not self.addresses.get(srv[3].lower()):
+        questions.append((srv[3], TYPE_A))
+        questions.append((srv[3], TYPE_AAAA))
+    return questions
+
+  def services(self):
+    result = []
+    for instance in self.instances:
+      srv = self.srv.get(instance)
+      if srv is None:
+        continue
+      addresses = self.addresses.get(srv[3].lower(), [])
+      # Prefer IPv4, which every Google TV supports.
+      ordered = sorted(addresses, key=lambda address: ':' in address)
+      result.append(Service(self.names[instance], srv[3],
+                            ordered[0] if ordered else None, srv[2], ordered))
+    return result
+
+
+def discover(service=ANYMOTE_SERVICE, timeout=2.0, address=MDNS_ADDRESS,
+             requery_interval=0.25):
+  """Discovers every instance of a service on the local network.
+
+  Args:
+    service: The service type to browse, e.g. '_anymote._tcp.local'.
+    timeout: Time budget in seconds. Every answer received within it counts.
+    address: Where to send queries. Defaults to the mDNS multicast group; a
+        unicast address such as ('127.0.0.1', port) queries a single
+        responder, e.g. a googletv.responder.Responder.
+    requery_interval: Minimum delay between follow-up queries for the same
+        unresolved names.
+
+  Returns:
+    A list of Service tuples, in the order responders answered. address is
+    None if no address record was received for the host.
+  """
+  sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+  try:
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 255)
+    sock.bind(('', 0))
+    collector = _Collector(service)
+    deadline = clock.monotonic() + timeout
+    sock.sendto(encode_query([(service, TYPE_PTR)]), address)
+    asked = {}
+    while True:
+      now = clock.monotonic()
+      if now >= deadline:
+        break
+      questions = [q for q in collector.missing()
+                   if asked.get(q, 0) + requery_interval <= now]
+      if questions:
+        for q in questions:
+          asked[q] = now
+        sock.sendto(encode_query(questions), address)
+      readable = select.select([sock], [], [], min(deadline - now,
+                                                   requery_interval))[0]
+      if not readable:
+        continue
+      data = sock.recvfrom(9000)[0]
+      try:
+        is_response, records = parse_message(data)
+      except ParseError:
+        continue
+      if is_response:
+        collector.add(records)
+    return collector.services()
+  finally:
+    sock.close()
+
+
+class DiscoveryCache(object):
+  """Keeps an up-to-date view of a service's instances in memory.
+
+  A background thread listens on the mDNS group. Every response it receives,
+  whether it answers a query or is an unsolicited announcement, updates the
+  cache; records with a TTL of zero (goodbyes) are removed at once and other
+  records expire when their TTL runs out. Records are only re-queried when
+  they reach 80% of their TTL, so a stable network sees no queries between
+  refreshes.
+
+  Subscribers are called from the background thread with ('add', service) or
+  ('remove', service). A service whose records change is removed, then added.
+
+  Example:
+    cache = mdns.DiscoveryCache()
+    cache.subscribe(lambda event, service: log(event, service))
+    cache.start()
+    ...
+    services = cache.services()  # No network traffic.
+  """
+
+  def __init__(self, service=ANYMOTE_SERVICE, address=MDNS_ADDRESS,
+               bind_address=('', MDNS_ADDRESS[1])):
+    """Creates the cache.
+
+    Args:
+      service: The service type to browse.
+      address: Where to send queries, as a (host, port) pair. Defaults to the
+          mDNS multicast group.
+      bind_address: Address to listen on. The mDNS group is joined when
+          address is a multicast address.
+    """
+    self.service = service
+    self.address = address
+    self.bind_address = bind_address
+    self._records = {}
+    self._services = {}
+    self._subscribers = []
+    self._lock = threading.Lock()
+    self._sock = None
+    self._thread = None
+    self._stopped = False
+
+  def start(self):
+    """Opens the socket, sends the initial query and starts listening."""
+    self._sock = self._open_socket()
+    self._stopped = False
+    self._thread = threading.Thread(target=self._run)
+    self._thread.daemon = True
+    self._thread.start()
+    self.refresh()
+
+  def stop(self, timeout=None):
+    self._stopped = True
+    if self._thread is not None:
+      self._thread.join(timeout)
+      self._thread = None
+    if self._sock is not None:
+      self._sock.close()
+      self._sock = None
+
+  def refresh(self):
+    """Queries the network for the service now, regardless of TTLs."""
+    self._sock.sendto(encode_query([(self.service, TYPE_PTR)], unicast=False),
+                      self.address)
+
+  def subscribe(self, callback):
+    """Registers callback(event, service), with event 'add' or 'remove'."""
+    with self._lock:
+      self._subscribers.append(callback)
+
+  def unsubscribe(self, callback):
+    with self._lock:
+      self._subscribers.remove(callback)
+
+  def services(self):
+    """Returns the currently known services, from memory."""
+    with self._lock:
+      return self._services.values()
+
+  def _open_socket(self):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if hasattr(socket, 'SO_REUSEPORT'):
+      try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+      except socket.error:
+        pass  # Not supported by this kernel.
+    sock.bind(self.bind_address)
+    group = socket.inet_aton(socket.gethostbyname(self.address[0]))
+    if 224 <= ord(group[0]) <= 239:
+      membership = struct.pack('4s4s', group, socket.inet_aton('0.0.0.0'))
+      sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+      sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 255)
+    return sock
+
+  def _run(self):
+    while not self._stopped:
+      now = clock.monotonic()
+      with self._lock:
+        expired = self._expire(now)
+        questions, next_wakeup = self._due_refreshes(now)
+      if expired:
+        self._update_services()
+      if questions:
+        try:
+          self._sock.sendto(encode_query(questions, unicast=False),
+                            self.address)
+        except socket.error:
+          pass  # Retried at the next refresh point.
+      wait = min(max(next_wakeup - now, 0.0), 0.5)
+      readable = select.select([self._sock], [], [], wait)[0]
+      if not readable:
+        continue
+      try:
+        data = self._sock.recvfrom(9000)[0]
+        is_response, records = parse_message(data)
+      except (socket.error, ParseError):
+        continue
+      if is_response and records:
+        with self._lock:
+          self._add(records, clock.monotonic())
+        self._update_services()
+
+  def _add(self, records, now):
+    """Adds received records. Must be called with the lock held."""
+    for record in records:
+      key = (record.name, record.type, record.data)
+      if record.ttl == 0:
+        self._records.pop(key, None)
+      else:
+        # [record, expiry time, index of the next refresh point]
+        self._records[key] = [record, now + record.ttl, 0]
+
+  def _expire(self, now):
+    """Drops expired records. Must be called with the lock held."""
+    expired = [key for key, entry in self._records.iteritems()
+               if entry[1] <= now]
+    for key in expired:
+      del self._records[key]
+    return bool(expired)
+
+  def _due_refreshes(self, now):
+    """Returns (questions due now, time of the next refresh point).
+
+    Must be called with the lock held.
+    """
+    questions = []
+    next_wakeup = now + 60.0
+    for entry in self._records.itervalues():
+      record, expires, index = entry
+      if index >= len(REFRESH_POINTS):
+        continue
+      refresh_at = expires - record.ttl * (1 - REFRESH_POINTS[index])
+      if refresh_at <= now:
+        question = (record.name, record.type)
+        if question not in questions:
+          questions.append(question)
+        # Skip the points that have already passed.
+        while (index < len(REFRESH_POINTS) and
+               expires - record.ttl * (1 - REFRESH_POINTS[index]) <= now):
+          index += 1
+        entry[2] = index
+        if index < len(REFRESH_POINTS):
+          refresh_at = expires - record.ttl * (1 - REFRESH_POINTS[index])
+        else:
+          refresh_at = expires
+      next_wakeup = min(next_wakeup, refresh_at, expires)
+    return questions, next_wakeup
+
+  def _update_services(self):
+    """Recomputes the services and notifies subscribers of differences."""
+    with self._lock:
+      collector = _Collector(self.service)
+      collector.add([entry[0] for entry in self._records.itervalues()])
+      current = dict((s.name.lower(), s) for s in collector.services())
+      previous = self._services
+      self._services = current
+      subscribers = list(self._subscribers)
+    events = []
+    for name, service in previous.iteritems():
+      if current.get(name) != service:
+        events.append(('remove', service))
+    for name, service in current.iteritems():
+      if previous.get(name) != service:
+        events.append(('add', service))
+    for event, service in events:
+      for callback in subscribers:
+        callback(event, service)
@@ -0,0 +1,314 @@
+#!/usr/bin/env python
+#
+# Copyright 2012 Steven Le (stevenle08@gmail.com)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Per-connection counters and latency histograms.
+
+Pass metrics=True (or a ConnectionMetrics) to a protocol to record what it
+does:
+
+  gtv = googletv.AnymoteProtocol(host, cert, metrics=True)
+  ...
+  print gtv.metrics.snapshot()
+
+Pass a Registry instead to also aggregate the metrics of every connection per
+host, e.g. for googletv.exporter.
+
+Without metrics, each instrumented call site costs one `is None` test.
+"""
+
+import collections
+import struct
+import threading
+
+# Histogram bucket i counts durations below 2**i microseconds, up to about
+# two minutes; a final bucket counts everything longer.
+HISTOGRAM_BUCKETS = 28
+
+
+class Histogram(object):
+  """Log-bucketed histogram of durations in seconds, in fixed memory."""
+
+  def __init__(self):
+    self.counts = [0] * (HISTOGRAM_BUCKETS + 1)
+    self.count = 0
+    self.sum = 0.0
+    self.max = 0.0
+
+  def record(self, seconds):
+    index = int(seconds * 1e6).bit_length()
+    if index > HISTOGRAM_BUCKETS:
+      index = HISTOGRAM_BUCKETS
+    self.counts[index] += 1
+    self.count += 1
+    self.sum += seconds
+    if seconds > self.max:
+      self.max = seconds
+
+  def merge(self, other):
+    """Adds the values recorded by another Histogram."""
+    for i, count in enumerate(other.counts):
+      self.counts[i] += count
+    self.count += other.count
+    self.sum += other.sum
+    self.max = max(self.max, other.max)
+
+  @staticmethod
+  def upper_bounds():
+    """Returns the upper bound of each bucket in seconds, the last infinite."""
+    return [2 ** i / 1e6 for i in xrange(HISTOGRAM_BUCKETS)] + [float('inf')]
+
+  def percentile(self, p):
+    """Estimates a percentile as the upper bound of the bucket holding it.
+
+    Args:
+      p: A fraction between 0 and 1.
+
+    Returns:
+      Seconds, or None if nothing was recorded.
+    """
+    if not self.count:
+      return None
+    rank = p * self.count
+    seen = 0
+    for i, count in enumerate(self.counts):
+      seen += count
+      if seen >= rank and count:
+        if i == HISTOGRAM_BUCKETS:
+          return self.max
+        return min(2 ** i / 1e6, self.max)
+    return self.max
+
+  def snapshot(self):
+    return {
+        'count': self.count,
+        'sum': self.sum,
+        'max': self.max,
+        'p50': self.percentile(0.50),
+        'p99': self.percentile(0.99),
+        'buckets': list(self.counts),
+    }
+
+
+class ConnectionMetrics(object):
+  """What one protocol connection has done.
+
+  Frames and bytes are counted when they are handed to the protocol, so in
+  threadsafe mode they include frames still queued for the writer thread.
+
+  Attributes:
+    connected: Whether the connection is currently open.
+    connects: Number of successful connects.
+    reconnects: Number of reconnect() calls.
+    frames_sent, bytes_sent, frames_received, bytes_received: Totals, with
+        bytes including the 4-byte frame headers.
+    sent_by_type, received_by_type: collections.Counter of messages by type,
+        e.g. 'key_event_message' or 'MESSAGE_TYPE_SECRET'; polo replies with
+        an error status are counted under the status, e.g.
+        'STATUS_BAD_SECRET'. Frames encoded ahead of time and passed to
+        write() are only counted as frames.
+    connect_time: Histogram of TCP connect durations.
+    handshake_time: Histogram of TLS handshake durations.
+    send_latency: Histogram of the time each socket write took.
+    parent: A ConnectionMetrics every update is also applied to, e.g. the
+        HostMetrics of a Registry.
+  """
+
+  def __init__(self, parent=None):
+    self.parent = parent
+    self.connected = False
+    self.connects = 0
+    self.reconnects = 0
+    self.frames_sent = 0
+    self.bytes_sent = 0
+    self.frames_received = 0
+    self.bytes_received = 0
+    self.sent_by_type = collections.Counter()
+    self.received_by_type = collections.Counter()
+    self.connect_time = Histogram()
+    self.handshake_time = Histogram()
+    self.send_latency = Histogram()
+    self._lock = threading.Lock()
+
+  def on_connect(self, connect_time, handshake_time):
+    with self._lock:
+      self.connected = True
+      self.connects += 1
+      self.connect_time.record(connect_time)
+      self.handshake_time.record(handshake_time)
+    if self.parent is not None:
+      self.parent.on_connect(connect_time, handshake_time)
+
+  def on_close(self):
+    with self._lock:
+      was_connected = self.connected
+      self.connected = False
+    if was_connected and self.parent is not None:
+      self.parent.on_close()
+
+  def on_reconnect(self):
+    with self._lock:
+      self.reconnects += 1
+    if self.parent is not None:
+      self.parent.on_reconnect()
+
+  def on_send(self, frames, size):
+    with self._lock:
+      self.frames_sent += frames
+      self.bytes_sent += size
+    if self.parent is not None:
+      self.parent.on_send(frames, size)
+
+  def on_write(self, seconds):
+    with self._lock:
+      self.send_latency.record(seconds)
+    if self.parent is not None:
+      self.parent.on_write(seconds)
+
+  def on_recv(self, size):
+    with self._lock:
+      self.frames_received += 1
+      self.bytes_received += size
+    if self.parent is not None:
+      self.parent.on_recv(size)
+
+  def on_message_sent(self, message_type):
+    with self._lock:
+      self.sent_by_type[message_type] += 1
+    if self.parent is not None:
+      self.parent.on_message_sent(message_type)
+
+  def on_message_received(self, message_type):
+    with self._lock:
+      self.received_by_type[message_type] += 1
+    if self.parent is not None:
+      self.parent.on_message_received(message_type)
+
+  def snapshot(self):
+    """Returns a consistent copy of every metric as plain dicts and lists."""
+    with self._lock:
+      return {
+          'connected': self.connected,
+          'connects': self.connects,
+          'reconnects': self.reconnects,
+          'frames_sent': self.frames_sent,
+          'bytes_sent': self.bytes_sent,
+          'frames_received': self.frames_received,
+          'bytes_received': self.bytes_received,
+          'sent_by_type': dict(self.sent_by_type),
+          'received_by_type': dict(self.received_by_type),
+          'connect_time': self.connect_time.snapshot(),
+          'handshake_time': self.handshake_time.snapshot(),
+          'send_latency': self.send_latency.snapshot(),
+      }
+
+
+class HostMetrics(ConnectionMetrics):
+  """The metrics of every connection to one host, updated as they happen.
+
+  Attributes:
+    open_connections: Number of connections currently open.
+  """
+
+  def __init__(self):
+    super(HostMetrics, self).__init__()
+    self.open_connections = 0
+
+  def on_connect(self, connect_time, handshake_time):
+    super(HostMetrics, self).on_connect(connect_time, handshake_time)
+    with self._lock:
+      self.open_connections += 1
+
+  def on_close(self):
+    with self._lock:
+      self.open_connections -= 1
+      self.connected = self.open_connections > 0
+
+  def snapshot(self):
+    result = super(HostMetrics, self).snapshot()
+    result['open_connections'] = self.open_connections
+    return result
+
+
+class Registry(object):
+  """Aggregates the metrics of many connections per host.
+
+  Every connection created through a Registry updates its host's HostMetrics
+  as it goes, so reading the metrics of thousands of connections only walks
+  the hosts. Pass the registry as the metrics argument of a protocol:
+
+    registry = metrics.Registry()
+    gtv = googletv.AnymoteProtocol(host, cert, metrics=registry)
+
+  Gauges sampled at read time, such as queue depths, can be added too.
+  """
+
+  def __init__(self):
+    self._hosts = {}
+    self._gauges = {}
+    self._lock = threading.Lock()
+
+  def connection(self, host):
+    """Returns a new ConnectionMetrics reporting into the host's totals."""
+    return ConnectionMetrics(parent=self.host(host))
+
+  def host(self, host):
+    """Returns the HostMetrics of a host, creating it if needed."""
+    with self._lock:
+      metrics = self._hosts.get(host)
+      if metrics is None:
+        metrics = self._hosts[host] = HostMetrics()
+      return metrics
+
+  def hosts(self):
+    """Returns a dict mapping each host to its HostMetrics."""
+    with self._lock:
+      return dict(self._hosts)
+
+  def add_gauge(self, name, fn):
+    """Registers a value read when metrics are collected.
+
+    Args:
+      name: Name of the gauge, e.g. 'sender_queue_depth'.
+      fn: Callable returning a number.
+    """
+    with self._lock:
+      self._gauges[name] = fn
+
+  def add_queue(self, name, queue):
+    """Registers the depth of a googletv.sendqueue.SendQueue."""
+    self.add_gauge(name, lambda: queue.depth)
+
+  def remove_gauge(self, name):
+    with self._lock:
+      self._gauges.pop(name, None)
+
+  def gauges(self):
+    """Returns a dict mapping each gauge name to its current value."""
+    with self._lock:
+      gauges = dict(self._gauges)
+    return dict((name, fn()) for name, fn in gauges.iteritems())
+
+
+def count_frames(framed):
+  """Returns the number of frames in bytes produced by googletv.frame()."""
+  frames = 0
+  pos = 0
+  end = len(framed)
+  while pos < end:
+    pos += 4 + struct.unpack_from('!I', framed, pos)[0]
+    frames += 1
+  return frames
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+#
+# Copyright 2012 Steven Le (stevenle08@gmail.com)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Append-only binary log of the frames sent to and received from TVs.
+
+Pass a SessionRecorder to any number of protocols to capture their traffic:
+
+  session = recorder.SessionRecorder('session.rec')
+  gtv = googletv.AnymoteProtocol(host, cert, recorder=session)
+  ...
+  session.close()
+
+Files are named <path>.0000, <path>.0001, ...; a new file is started once
+the current one would grow past max_bytes. Existing files are never
+overwritten: a recorder created with the path of an earlier session, e.g.
+after a restart, continues with the next unused index. Each recorder writes a
+session of its own, numbering its files from part 0, so that a reader can tell
+where one session ends and the next begins. Timestamps are only comparable
+within a session, as the monotonic clock restarts with the machine. Each file
+starts with FILE_HEADER:
+
+  magic 'GTVREC', format version (uint16), wall-clock time and
+  clock.monotonic() time at which the file was opened (doubles), part: index
+  of the file within its session (uint32)
+
+followed by records, each a RECORD_HEADER then `length` bytes of data:
+
+  clock.monotonic() timestamp (double), kind (uint8), host id (uint16),
+  length (uint32)
+
+For SENT and RECEIVED records the data is framed bytes as produced by
+googletv.frame(); a SENT record holds everything passed to one socket write,
+which may be several frames. A HOST record, written before the first record
+of a host in each file, holds the host name the id stands for. All numbers
+are big-endian.
+"""
+
+import errno
+import os
+import struct
+import threading
+import time
+from googletv import clock
+
+MAGIC = 'GTVREC'
+VERSION = 2
+FILE_HEADER = struct.Struct('!6sHddI')
+RECORD_HEADER = struct.Struct('!dBHI')
+
+SENT = 0
+RECEIVED = 1
+HOST = 2
+
+
+def file_name(path, index):
+  return '%s.%04d' % (path, index)
+
+
+class SessionRecorder(object):
+  """Writes SENT and RECEIVED records, buffered, rotating by size.
+
+  Safe to share between protocols and threads.
+
+  Attributes:
+    path: Prefix of the file names.
+    max_bytes: Size at which a new file is started.
+    buffer_size: Bytes buffered in memory before they are written out.
+    index: Index of the file being written.
+    part: Index of the file being written within this recorder's session.
+  """
+
+  def __init__(self, path, max_bytes=64 * 1024 * 1024, buffer_size=64 * 1024):
+    self.path = path
+    self.max_bytes = max_bytes
+    self.buffer_size = buffer_size
+    self.index = -1
+    self.part = -1
+    self._lock = threading.Lock()
+    self._buffer = bytearray()
+    self._file = None
+    self._size = 0
+    self._host_ids = {}
+    self._open_next()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, unused_type, unused_val, unused_traceback):
+    self.close()
+
+  def record(self, kind, host, data):
+    """Appends a record.
+
+    Args:
+      kind: SENT or RECEIVED.
+      host: Host the data was exchanged with.
+      data: Framed bytes.
+    """
+    timestamp = clock.monotonic()
+    size = RECORD_HEADER.size + len(data)
+    with self._lock:
+      if self._file is None:
+        return
+      if self._size + size > self.max_bytes and self._host_ids:
+        self._rotate()
+      host_id = self._host_ids.get(host)
+      if host_id is None:
+        host_id = self._add_host(host, timestamp)
+      self._buffer += RECORD_HEADER.pack(timestamp, kind, host_id, len(data))
+      self._buffer += data
+      self._size += size
+      if len(self._buffer) >= self.buffer_size:
+        self._write_buffer()
+
+  def flush(self):
+    """Writes out buffered records."""
+    with self._lock:
+      if self._file is not None:
+        self._write_buffer()
+        self._file.flush()
+
+  def close(self):
+    with self._lock:
+      if self._file is not None:
+        self._write_buffer()
+        self._file.close()
+        self._file = None
+
+  def _add_host(self, host, timestamp):
+    host_id = len(self._host_ids)
+    self._host_ids[host] = host_id
+    name = host.encode('utf-8') if isinstance(host, unicode) else host
+    self._buffer += RECORD_HEADER.pack(timestamp, HOST, host_id, len(name))
+    self._buffer += name
+    self._size += RECORD_HEADER.size + len(name)
+    return host_id
+
+  def _write_buffer(self):
+    if self._buffer:
+      self._file.write(self._buffer)
+      self._buffer = bytearray()
+
+  def _rotate(self):
+    self._write_buffer()
+    self._file.close()
+    self._open_next()
+
+  def _open_next(self):
+    flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0)
+    while True:
+      self.index += 1
+      try:
+        fd = os.open(file_name(self.path, self.index), flags, 0666)
+        break
+      except OSError as e:
+        if e.errno != errno.EEXIST:
+          raise
+    self.part += 1
+    self._file = os.fdopen(fd, 'wb')
+    self._file.write(FILE_HEADER.pack(MAGIC, VERSION, time.time(),
+                                      clock.monotonic(), self.part))
+    self._size = FILE_HEADER.size
+    self._host_ids = {}
@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+#
+# Copyright 2012 Steven Le (stevenle08@gmail.com)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Replays sessions captured by googletv.recorder.
+
+Recordings are memory-mapped and walked lazily, so replaying a large capture
+does not load it into memory. Frames are re-sent through BaseProtocol.write()
+with their original spacing, or scaled by a speed factor:
+
+  replayer = replay.Replayer(lambda host: connect_to_test_tv(host), speed=2)
+  report = replayer.replay(replay.read_session('session.rec'))
+  print report
+
+A path holds one session per SessionRecorder that was created with it;
+read_session() reads the latest one unless told otherwise.
+
+Timing drift, how late each frame was written compared to its scaled
+schedule, is reported so that replays can be trusted to reproduce timing.
+"""
+
+import collections
+import glob
+import mmap
+import os
+import googletv
+from googletv import clock
+from googletv import recorder as recorder_lib
+
+# One recorded record. data is a read-only buffer into the mapped file and is
+# only valid while the Recording is open.
+Record = collections.namedtuple('Record', ['timestamp', 'kind', 'host', 'data'])
+
+
+class FormatError(googletv.Error):
+  """Raised when a file is not a recording this module can read."""
+
+
+class Recording(object):
+  """One memory-mapped recording file.
+
+  Attributes:
+    filename: Path of the file.
+    wall_time: Wall-clock time at which the file was opened.
+    start: clock.monotonic() time at which the file was opened.
+    part: Index of the file within its session.
+  """
+
+  def __init__(self, filename):
+    self.filename = filename
+    with open(filename, 'rb') as f:
+      if os.fstat(f.fileno()).st_size < recorder_lib.FILE_HEADER.size:
+        raise FormatError('%s is too short to be a recording' % filename)
+      self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, self.wall_time, self.start, self.part = (
+        recorder_lib.FILE_HEADER.unpack_from(self._map, 0))
+    if magic != recorder_lib.MAGIC or version != recorder_lib.VERSION:
+      self.close()
+      raise FormatError('%s is not a version %d recording' % (
+          filename, recorder_lib.VERSION))
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, unused_type, unused_val, unused_traceback):
+    self.close()
+
+  def close(self):
+    self._map.close()
+
+  def __iter__(self):
+    """Yields every SENT and RECEIVED Record, in file order.
+
+    A record cut short, e.g. by a crash of the recording process, ends the
+    iteration.
+    """
+    header = recorder_lib.RECORD_HEADER
+    data = self._map
+    end = len(data)
+    hosts = {}
+    pos = recorder_lib.FILE_HEADER.size
+    while pos + header.size <= end:
+      timestamp, kind, host_id, length = header.unpack_from(data, pos)
+      pos += header.size
+      if pos + length > end:
+        return
+      if kind == recorder_lib.HOST:
+        hosts[host_id] = data[pos:pos + length]
+      else:
+        yield Record(timestamp, kind, hosts.get(host_id),
+                     buffer(data, pos, length))
+      pos += length
+
+
+def session_files(path):
+  """Returns the files recorded with a path, in order."""
+  return sorted(glob.glob(path + '.[0-9][0-9][0-9][0-9]'))
+
+
+def read_part(filename):
+  """Returns the part number from the header of a recording file."""
+  with open(filename, 'rb') as f:
+    header = f.read(recorder_lib.FILE_HEADER.size)
+  if len(header) < recorder_lib.FILE_HEADER.size:
+    raise FormatError('%s is too short to be a recording' % filename)
+  magic, version, _, _, part = recorder_lib.FILE_HEADER.unpack(header)
+  if magic != recorder_lib.MAGIC or version != recorder_lib.VERSION:
+    raise FormatError('%s is not a version %d recording' % (
+        filename, recorder_lib.VERSION))
+  return part
+
+
+def sessions(path):
+  """Splits the files recorded with a path into sessions.
+
+  Every SessionRecorder created with the path, e.g. once per restart of the
+  recording process, writes a session of its own.
+
+  Returns:
+    A list of sessions, oldest first, each a list of file names in order.
+  """
+  result = []
+  previous = None
+  for filename in session_files(path):
+    part = read_part(filename)
+    if previous is None or part != previous + 1:
+      result.append([])
+    result[-1].append(filename)
+    previous = part
+  return result
+
+
+def read_session(path, kinds=(recorder_lib.SENT,), session=-1):
+  """Yields the records of one session, one file mapped at a time.
+
+  Only one session is read, as timestamps from different sessions cannot be
+  compared.
+
+  Args:
+    path: The path the SessionRecorder was created with.
+    kinds: Kinds of records to yield.
+    session: Index of the session in sessions(path); by default the latest.
+
+  Raises:
+    IndexError: If there is no such session.
+  """
+  found = sessions(path)
+  if not found:
+    return
+  for filename in found[session]:
+    with Recording(filename) as recording:
+      for record in recording:
+        if record.kind in kinds:
+          yield record
+
+
+class DriftReport(object):
+  """How closely a replay followed its schedule.
+
+  Attributes:
+    frames: Number of writes replayed.
+    bytes: Number of bytes replayed.
+    recorded_duration: Seconds between the first and last write recorded.
+    duration: Seconds the replay took.
+    drifts: Sorted lateness of each write in seconds.
+  """
+
+  def __init__(self, frames, size, recorded_duration, duration, drifts):
+    self.frames = frames
+    self.bytes = size
+    self.recorded_duration = recorded_duration
+    self.duration = duration
+    self.drifts = sorted(drifts)
+
+  def percentile(self, p):
+    if not self.drifts:
+      return 0.0
+    return self.drifts[min(len(self.drifts) - 1, int(p * len(self.drifts)))]
+
+  def __str__(self):
+    return ('%d writes, %d bytes in %.3f s (recorded %.3f s); drift p50 '
+            '%.3f ms, p99 %.3f ms, max %.3f ms' % (
+                self.frames, self.bytes, self.duration,
+                self.recorded_duration, self.percentile(0.5) * 1000,
+                self.percentile(0.99) * 1000, self.percentile(1.0) * 1000))
+
+
+class Replayer(object):
+  """Writes recorded frames to live connections.
+
+  Attributes:
+    get_protocol: Function taking a recorded host and returning the connected
+        BaseProtocol its frames are written to. Called once per host.
+    speed: Replay speed relative to the recording, e.g. 2 for twice as fast;
+        None replays as fast as possible.
+  """
+
+  def __init__(self, get_protocol, speed=1.0):
+    self.get_protocol = get_protocol
+    self.speed = speed
+    self._protocols = {}
+
+  def protocols(self):
+    """Returns a dict mapping each replayed host to its protocol."""
+    return dict(self._protocols)
+
+  def replay(self, records):
+    """Writes each record to its host's protocol on the scaled schedule.
+
+    Args:
+      records: Iterable of Record, e.g. from read_session().
+
+    Returns:
+      A DriftReport.
+    """
+    drifts = []
+    frames = 0
+    size = 0
+    first = last = None
+    start = clock.monotonic()
+    for record in records:
+      protocol = self._protocols.get(record.host)
+      if protocol is None:
+        protocol = self._protocols[record.host] = self.get_protocol(
+            record.host)
+      if first is None:
+        first = record.timestamp
+        start = clock.monotonic()
+      last = record.timestamp
+      # Copy out of the mapped file, which a threadsafe protocol may only
+      # write after the Recording has been closed. Done before sleeping so
+      # that it does not add to the drift.
+      data = str(record.data)
+      if self.speed:
+        due = start + (record.timestamp - first) / self.speed
+        clock.sleep_until(due)
+        drifts.append(clock.monotonic() - due)
+      protocol.write(data)
+      frames += 1
+      size += len(data)
+    for protocol in self._protocols.itervalues():
+      protocol.flush()
+    return DriftReport(frames, size, (last or 0.0) - (first or 0.0),
+                       clock.monotonic() - start, drifts)
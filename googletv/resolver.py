@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+#
+# Copyright 2012 Steven Le (stevenle08@gmail.com)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Cached host resolution and parallel ("happy eyeballs") connects.
+
+Resolving mDNS names such as NSZGT1-6131194.local through the system resolver
+can take seconds, much longer than the connection itself. Resolver caches
+results for a TTL and is shared by every protocol instance through
+DEFAULT_RESOLVER. race_connect() then connects to every resolved address,
+IPv4 and IPv6, starting a new attempt every `stagger` seconds (or as soon as
+one fails) and keeps the first that succeeds, as in RFC 8305.
+"""
+
+import errno
+import select
+import socket
+import threading
+from googletv import clock
+
+# Delay between connection attempts recommended by RFC 8305.
+DEFAULT_STAGGER = 0.25
+
+_IN_PROGRESS = (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY)
+
+
+class Resolver(object):
+  """Thread-safe getaddrinfo cache.
+
+  Concurrent lookups of the same host share a single getaddrinfo call.
+  Failed lookups are cached for negative_ttl seconds.
+  """
+
+  def __init__(self, ttl=60.0, negative_ttl=5.0):
+    self.ttl = ttl
+    self.negative_ttl = negative_ttl
+    self._cache = {}
+    self._in_flight = {}
+    self._lock = threading.Lock()
+
+  def resolve(self, host, port):
+    """Returns the (family, sockaddr) pairs of host, interleaved by family.
+
+    Raises:
+      socket.gaierror: If the host cannot be resolved.
+    """
+    key = (host, port)
+    while True:
+      with self._lock:
+        entry = self._cache.get(key)
+        if entry is not None and entry[0] > clock.monotonic():
+          if isinstance(entry[1], socket.error):
+            raise entry[1]
+          return entry[1]
+        event = self._in_flight.get(key)
+        if event is None:
+          event = self._in_flight[key] = threading.Event()
+          break
+      event.wait()
+
+    entry = None
+    try:
+      try:
+        infos = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+        result = interleave([(info[0], info[4]) for info in infos])
+        entry = (clock.monotonic() + self.ttl, result)
+      except socket.gaierror as e:
+        result = None
+        entry = (clock.monotonic() + self.negative_ttl, e)
+    finally:
+      # Other errors (e.g. UnicodeError for a bad name) are not cached, but
+      # waiting threads must still be woken up to try for themselves.
+      with self._lock:
+        if entry is not None:
+          self._cache[key] = entry
+        del self._in_flight[key]
+      event.set()
+    if result is None:
+      raise entry[1]
+    return result
+
+  def invalidate(self, host=None):
+    """Forgets cached results for host, or for every host."""
+    with self._lock:
+      if host is None:
+        self._cache.clear()
+      else:
+        for key in [key for key in self._cache if key[0] == host]:
+          del self._cache[key]
+
+
+DEFAULT_RESOLVER = Resolver()
+
+
+def interleave(addresses):
+  """Alternates address families, keeping the order within each family."""
+  by_family = []
+  for family, sockaddr in addresses:
+    for group in by_family:
+      if group[0][0] == family:
+        group.append((family, sockaddr))
+        break
+    else:
+      by_family.append([(family, sockaddr)])
+  result = []
+  while by_family:
+    for group in list(by_family):
+      result.append(group.pop(0))
+      if not group:
+        by_family.remove(group)
+  return result
+
+
+def race_connect(addresses, timeout=None, stagger=DEFAULT_STAGGER,
+                 setup=None):
+  """Connects to the first reachable address.
+
+  Attempts start in order, each `stagger` seconds after the previous one or
+  immediately after one fails. The first connection to complete wins and the
+  others are closed.
+
+  Args:
+    addresses: List of (family, sockaddr) pairs, as returned by
+        Resolver.resolve.
+    timeout: Seconds allowed for the whole race, or None to wait forever.
+    stagger: Delay before starting the next attempt.
+    setup: Optional function called with each socket before it connects,
+        e.g. to set socket options.
+
+  Returns:
+    A (socket, sockaddr) tuple. The socket is in blocking mode.
+
+  Raises:
+    socket.timeout: If no attempt succeeded in time.
+    socket.error: If every attempt failed.
+  """
+  if not addresses:
+    raise socket.error('No addresses to connect to')
+  start = clock.monotonic()
+  deadline = None if timeout is None else start + timeout
+  remaining_addresses = list(addresses)
+  pending = {}
+  next_attempt = start
+  last_error = None
+  try:
+    while remaining_addresses or pending:
+      now = clock.monotonic()
+      if deadline is not None and now >= deadline:
+        raise socket.timeout('Connection timed out')
+      if remaining_addresses and (not pending or now >= next_attempt):
+        family, sockaddr = remaining_addresses.pop(0)
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        if setup is not None:
+          setup(sock)
+        sock.setblocking(0)
+        err = sock.connect_ex(sockaddr)
+        if err == 0:
+          sock.setblocking(1)
+          return sock, sockaddr
+        if err in _IN_PROGRESS:
+          pending[sock] = sockaddr
+          next_attempt = now + stagger
+        else:
+          last_error = socket.error(err, '%s: %s' % (sockaddr, errno.errorcode
+                                                       .get(err, err)))
+          sock.close()
+        continue
+
+      wake = deadline
+      if remaining_addresses:
+        wake = next_attempt if wake is None else min(wake, next_attempt)
+      wait = None if wake is None else max(0.0, wake - now)
+      _, writable, _ = select.select([], list(pending), [], wait)
+      for sock in writable:
+        sockaddr = pending.pop(sock)
+        err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if err == 0:
+          sock.setblocking(1)
+          return sock, sockaddr
+        last_error = socket.error(err, '%s: %s' % (sockaddr, errno.errorcode
+                                                     .get(err, err)))
+        sock.close()
+        # A failure starts the next attempt right away.
+        next_attempt = clock.monotonic()
+    raise last_error
+  finally:
+    for sock in pending:
+      sock.close()
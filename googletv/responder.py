@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+#
+# Copyright 2012 Steven Le (stevenle08@gmail.com)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Local mDNS responder, for testing discovery without a TV.
+
+Responder answers the queries of googletv.mdns on a unicast UDP port, as the
+responders on Google TVs answer on the mDNS group:
+
+  with responder.Responder() as fake:
+    fake.add('Living Room._anymote._tcp.local', 'tv1.local', '127.0.0.1', 9551)
+    services = mdns.discover(address=('127.0.0.1', fake.port), timeout=0.5)
+
+By default a PTR query is answered with the SRV and address records of every
+instance too. With additionals=False only the PTR records are sent, so the
+follow-up queries are exercised as well. Adding or removing a service
+announces the change to every address that has queried, so DiscoveryCache
+sees announcements and goodbyes.
+"""
+
+import select
+import socket
+import threading
+from googletv import mdns
+
+
+class Responder(object):
+  """Answers mDNS queries for a set of service instances.
+
+  Attributes:
+    port: The UDP port queries are answered on, once started.
+    ttl: TTL of the records sent.
+    additionals: Whether PTR answers carry the SRV and address records.
+    queries: Number of queries answered so far.
+  """
+
+  def __init__(self, host='127.0.0.1', port=0, service=mdns.ANYMOTE_SERVICE,
+               ttl=120, additionals=True):
+    self.host = host
+    self.port = port
+    self.service = service
+    self.ttl = ttl
+    self.additionals = additionals
+    self.queries = 0
+    self._instances = {}
+    self._peers = set()
+    self._lock = threading.Lock()
+    self._sock = None
+    self._thread = None
+    self._stopped = False
+
+  def __enter__(self):
+    self.start()
+    return self
+
+  def __exit__(self, unused_type, unused_val, unused_traceback):
+    self.stop()
+
+  def start(self):
+    self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    self._sock.bind((self.host, self.port))
+    self.port = self._sock.getsockname()[1]
+    self._stopped = False
+    self._thread = threading.Thread(target=self._run)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def stop(self):
+    self._stopped = True
+    if self._thread is not None:
+      self._thread.join()
+      self._thread = None
+    if self._sock is not None:
+      self._sock.close()
+      self._sock = None
+
+  def add(self, name, host, address, port):
+    """Starts advertising a service instance.
+
+    Args:
+      name: Instance name, e.g. 'Living Room._anymote._tcp.local'.
+      host: Host name the instance's SRV record points to.
+      address: IPv4 address of host.
+      port: Port of the service.
+    """
+    instance = (name, host, address, port)
+    with self._lock:
+      self._instances[name.lower()] = instance
+    self._announce(self._records(instance, self.ttl))
+
+  def remove(self, name):
+    """Stops advertising an instance and sends goodbyes for it."""
+    with self._lock:
+      instance = self._instances.pop(name.lower())
+    self._announce(self._records(instance, 0))
+
+  def _records(self, instance, ttl):
+    """Returns the PTR, SRV and A records of an instance."""
+    name, host, address, port = instance
+    return [mdns.Record(self.service, mdns.TYPE_PTR, ttl, name),
+            mdns.Record(name, mdns.TYPE_SRV, ttl, (0, 0, port, host)),
+            mdns.Record(host, mdns.TYPE_A, ttl, address)]
+
+  def _answer(self, questions):
+    """Returns the records answering a list of (name, type) questions."""
+    with self._lock:
+      instances = self._instances.values()
+    answers = []
+    for qname, qtype in questions:
+      for instance in instances:
+        ptr, srv, a = self._records(instance, self.ttl)
+        if qname == self.service.lower() and qtype == mdns.TYPE_PTR:
+          answers.extend([ptr, srv, a] if self.additionals else [ptr])
+        elif qname == srv.name.lower() and qtype == mdns.TYPE_SRV:
+          answers.append(srv)
+        elif qname == a.name.lower() and qtype == mdns.TYPE_A:
+          answers.append(a)
+    return answers
+
+  def _announce(self, records):
+    with self._lock:
+      peers = list(self._peers)
+    if self._sock is None:
+      return
+    packet = mdns.encode_response(records)
+    for peer in peers:
+      try:
+        self._sock.sendto(packet, peer)
+      except socket.error:
+        pass
+
+  def _run(self):
+    while not self._stopped:
+      if not select.select([self._sock], [], [], 0.1)[0]:
+        continue
+      try:
+        data, peer = self._sock.recvfrom(9000)
+        questions = mdns.parse_questions(data)
+      except (socket.error, mdns.ParseError):
+        continue
+      with self._lock:
+        self._peers.add(peer)
+        self.queries += 1
+      answers = self._answer(questions)
+      if answers:
+        try:
+          self._sock.sendto(mdns.encode_response(answers), peer)
+        except socket.error:
+          pass
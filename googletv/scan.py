@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+#
+# Copyright 2012 Steven Le (stevenle08@gmail.com)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Parallel TCP port scanner, for networks where multicast is blocked.
+
+scan() probes every address of a CIDR range for the Anymote (9551) and
+pairing (9552) ports with non-blocking connects, keeping at most
+`concurrency` probes in flight, each bounded by `timeout`. Open ports can
+optionally be confirmed with a TLS handshake. A server that rejects the
+handshake with a TLS alert, e.g. because it wants a client certificate, still
+counts as confirmed; pass certfile to present one.
+
+Example:
+  from googletv import scan
+
+  for result in scan.scan('192.168.0.0/22'):
+    print result.address, result.port
+"""
+
+import collections
+import errno
+import select
+import socket
+import ssl
+import struct
+from multiprocessing import pool
+from googletv import clock
+
+DEFAULT_PORTS = (9551, 9552)
+
+_IN_PROGRESS = (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY)
+
+# An open port:
+#   address: IPv4 address string.
+#   port: The open port.
+#   tls: True if the port answered a TLS handshake, with a session or an alert,
+#       False if it did not, None if it was not attempted.
+#   elapsed: Seconds the TCP connect took.
+ScanResult = collections.namedtuple(
+    'ScanResult', ['address', 'port', 'tls', 'elapsed'])
+
+
+def expand_cidr(cidr):
+  """Yields the host addresses of an IPv4 CIDR range, e.g. '10.0.0.0/22'.
+
+  The network and broadcast addresses are skipped for prefixes shorter than
+  /31. A bare address yields just that address.
+  """
+  address, _, prefix = cidr.partition('/')
+  prefix = int(prefix) if prefix else 32
+  if not 0 <= prefix <= 32:
+    raise ValueError('Invalid prefix length in %r' % cidr)
+  base = struct.unpack('!I', socket.inet_aton(address))[0]
+  mask = (0xffffffff << (32 - prefix)) & 0xffffffff
+  first = base & mask
+  last = first | (~mask & 0xffffffff)
+  if prefix < 31:
+    first += 1
+    last -= 1
+  for value in xrange(first, last + 1):
+    yield socket.inet_ntoa(struct.pack('!I', value))
+
+
+class _Poller(object):
+  """Minimal write-readiness poller over epoll, poll or select."""
+
+  def __init__(self):
+    if hasattr(select, 'epoll'):
+      self._epoll = select.epoll()
+      self._poll = None
+    elif hasattr(select, 'poll'):
+      self._epoll = None
+      self._poll = select.poll()
+    else:
+      self._epoll = self._poll = None
+      self._fds = set()
+
+  def register(self, fd):
+    if self._epoll is not None:
+      self._epoll.register(fd, select.EPOLLOUT)
+    elif self._poll is not None:
+      self._poll.register(fd, select.POLLOUT)
+    else:
+      self._fds.add(fd)
+
+  def unregister(self, fd):
+    if self._epoll is not None:
+      self._epoll.unregister(fd)
+    elif self._poll is not None:
+      self._poll.unregister(fd)
+    else:
+      self._fds.discard(fd)
+
+  def wait(self, timeout):
+    """Returns the fds that are writable (or failed) within timeout."""
+    if self._epoll is not None:
+      return [fd for fd, _ in self._epoll.poll(timeout)]
+    if self._poll is not None:
+      return [fd for fd, _ in self._poll.poll(timeout * 1000)]
+    return select.select([], list(self._fds), [], timeout)[1]
+
+  def close(self):
+    if self._epoll is not None:
+      self._epoll.close()
+
+
+def _probe(targets, ports, concurrency, timeout):
+  """Yields (sock, address, port, elapsed) for every port that accepted."""
+  pending = ((address, port) for address in targets for port in ports)
+  in_flight = {}
+  # Probes in start order; since they share one timeout, the oldest one is
+  # always the next to time out.
+  started = collections.deque()
+  poller = _Poller()
+  exhausted = False
+  try:
+    while True:
+      while not exhausted and len(in_flight) < concurrency:
+        try:
+          address, port = next(pending)
+        except StopIteration:
+          exhausted = True
+          break
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(0)
+        err = sock.connect_ex((address, port))
+        now = clock.monotonic()
+        if err == 0:
+          yield sock, address, port, 0.0
+        elif err in _IN_PROGRESS:
+          fd = sock.fileno()
+          in_flight[fd] = (sock, address, port, now)
+          started.append((now + timeout, fd, sock))
+          poller.register(fd)
+        else:
+          sock.close()
+      if not in_flight:
+        if exhausted:
+          return
+        continue
+
+      now = clock.monotonic()
+      for fd in poller.wait(max(0.0, started[0][0] - now)):
+        sock, address, port, start = in_flight.pop(fd)
+        poller.unregister(fd)
+        if sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) == 0:
+          yield sock, address, port, clock.monotonic() - start
+        else:
+          sock.close()
+
+      # Drop probes that completed, then time out the expired ones.
+      now = clock.monotonic()
+      while started:
+        deadline, fd, sock = started[0]
+        entry = in_flight.get(fd)
+        if entry is not None and entry[0] is sock:
+          if deadline > now:
+            break
+          del in_flight[fd]
+          poller.unregister(fd)
+          sock.close()
+        started.popleft()
+  finally:
+    for sock, _, _, _ in in_flight.itervalues():
+      sock.close()
+    poller.close()
+
+
+def _confirm_tls(sock, timeout, certfile):
+  try:
+    sock.setblocking(1)
+    sock.settimeout(timeout)
+    tls = ssl.wrap_socket(sock, certfile=certfile)
+    tls.close()
+    return True
+  except ssl.SSLError as e:
+    # An alert is a TLS record, so the server speaks TLS even though it
+    # refused this handshake.
+    return 'ALERT' in (getattr(e, 'reason', None) or '')
+  except socket.error:
+    return False
+  finally:
+    sock.close()
+
+
+def scan(targets, ports=DEFAULT_PORTS, concurrency=512, timeout=0.5,
+         verify_tls=False, tls_timeout=2.0, tls_workers=32, certfile=None):
+  """Finds open ports across many hosts.
+
+  Args:
+    targets: A CIDR string such as '192.168.0.0/22', or an iterable of
+        addresses.
+    ports: Ports to probe on every address.
+    concurrency: Maximum number of connects in flight.
+    timeout: Seconds allowed for each connect.
+    verify_tls: Whether to confirm each open port with a TLS handshake.
+    tls_timeout: Seconds allowed for each TLS handshake.
+    tls_workers: Number of concurrent TLS handshakes.
+    certfile: Optional client cert and key file presented in TLS handshakes.
+
+  Returns:
+    A list of ScanResult, sorted by address and port.
+  """
+  if isinstance(targets, basestring):
+    targets = expand_cidr(targets)
+  open_ports = list(_probe(targets, ports, concurrency, timeout))
+  if verify_tls and open_ports:
+    workers = pool.ThreadPool(min(tls_workers, len(open_ports)))
+    try:
+      tls = workers.map(
+          lambda item: _confirm_tls(item[0], tls_timeout, certfile),
+          open_ports)
+    finally:
+      workers.close()
+  else:
+    for item in open_ports:
+      item[0].close()
+    tls = [None] * len(open_ports)
+  results = [ScanResult(address, port, ok, elapsed)
+             for (_, address, port, elapsed), ok in zip(open_ports, tls)]
+  results.sort(key=lambda r: (socket.inet_aton(r.address), r.port))
+  return results
@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+#
+# Copyright 2012 Steven Le (stevenle08@gmail.com)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Bounded, priority-aware outgoing queue for Anymote events.
+
+When a Google TV stalls, blocking writes back up into the threads producing
+events. QueuedSender decouples producers from the connection: events are put
+on a bounded SendQueue and a background thread writes them to the TV.
+
+Events fall into two priority classes, which decide what happens when the
+queue is full:
+
+  PRIORITY_REQUIRED: key events (including power) and flings. Never dropped
+      or merged; room is made for them by merging pending mouse moves, and
+      only if none can be merged does the producer wait, like
+      Queue.Queue.put.
+  PRIORITY_LOW: mouse moves. The oldest pending moves are merged to make room
+      and, if nothing can be merged, the new move is dropped.
+
+Events are delivered in the order they were put. Mouse moves are only merged
+with a later move if no key event lies between them, so the cursor is always
+at the right place when a key is pressed. A press() is queued as a single
+item so its down and up events are never split.
+"""
+
+import collections
+import threading
+import googletv
+from googletv import clock
+
+PRIORITY_REQUIRED = 0
+PRIORITY_LOW = 1
+
+_KIND_KEY = 'key'
+_KIND_FLING = 'fling'
+_KIND_MOUSE = 'mouse'
+
+
+class QueueFullError(googletv.Error):
+  """Error thrown when an event cannot be queued before the timeout."""
+
+
+class QueueClosedError(googletv.Error):
+  """Error thrown when an event is put on a closed queue."""
+
+
+class SendQueue(object):
+  """Bounded FIFO of outgoing events with a merge/drop policy for mouse moves.
+
+  Items are lists of [kind, priority, payload]. The payload of a mouse item is
+  an [x, y] delta, so that it can be merged; other payloads are framed bytes.
+
+  Attributes:
+    maxsize: Maximum number of pending items.
+    merged: Number of mouse moves merged into a later move.
+    dropped: Number of mouse moves dropped because nothing could be merged.
+    high_water: Largest depth seen.
+    closed: Whether close() was called.
+  """
+
+  def __init__(self, maxsize=64):
+    if maxsize < 2:
+      raise ValueError('maxsize must be at least 2')
+    self.maxsize = maxsize
+    self.merged = 0
+    self.dropped = 0
+    self.high_water = 0
+    self.closed = False
+    self._items = collections.deque()
+    self._lock = threading.Lock()
+    self._not_empty = threading.Condition(self._lock)
+    self._not_full = threading.Condition(self._lock)
+
+  @property
+  def depth(self):
+    """Number of pending items."""
+    return len(self._items)
+
+  def stats(self):
+    """Returns a dict of the queue metrics."""
+    with self._lock:
+      return {
+          'depth': len(self._items),
+          'high_water': self.high_water,
+          'merged': self.merged,
+          'dropped': self.dropped,
+      }
+
+  def close(self):
+    """Rejects further items and wakes every thread waiting on the queue."""
+    with self._lock:
+      self.closed = True
+      self._not_full.notify_all()
+      self._not_empty.notify_all()
+
+  def put(self, kind, priority, payload, timeout=None):
+    """Queues an item, applying the policy of its priority class when full.
+
+    Args:
+      kind: One of the _KIND_* constants.
+      priority: One of the PRIORITY_* constants.
+      payload: [x, y] for mouse moves, framed bytes otherwise.
+      timeout: For PRIORITY_REQUIRED items, seconds to wait for room. None
+          waits forever.
+
+    Returns:
+      False if the item was a mouse move that was dropped, True otherwise.
+
+    Raises:
+      QueueFullError: If no room was made before the timeout.
+      QueueClosedError: If the queue is closed, or is closed while waiting.
+    """
+    with self._lock:
+      if self.closed:
+        raise QueueClosedError('Send queue is closed')
+      if priority == PRIORITY_LOW:
+        if len(self._items) >= self.maxsize and not self._merge_oldest_mouse():
+          tail = self._items[-1]
+          if tail[0] == _KIND_MOUSE:
+            tail[2][0] += payload[0]
+            tail[2][1] += payload[1]
+            self.merged += 1
+            return True
+          self.dropped += 1
+          return False
+      elif len(self._items) >= self.maxsize and not self._merge_oldest_mouse():
+        deadline = None if timeout is None else clock.monotonic() + timeout
+        while len(self._items) >= self.maxsize:
+          if self.closed:
+            raise QueueClosedError('Send queue is closed')
+          if deadline is None:
+            self._not_full.wait()
+            continue
+          remaining = deadline - clock.monotonic()
+          if remaining <= 0:
+            raise QueueFullError('Send queue is full (%d items)' % self.maxsize)
+          self._not_full.wait(remaining)
+      self._items.append([kind, priority, payload])
+      if len(self._items) > self.high_water:
+        self.high_water = len(self._items)
+      self._not_empty.notify()
+      return True
+
+  def get(self, timeout=None):
+    """Removes and returns the oldest item, or None on timeout."""
+    with self._lock:
+      if not self._items:
+        self._not_empty.wait(timeout)
+        if not self._items:
+          return None
+      item = self._items.popleft()
+      self._not_full.notify()
+      return item
+
+  def _merge_oldest_mouse(self):
+    """Merges the oldest mergeable mouse move into the next one.
+
+    A move can only be merged into a later move if no key event lies between
+    them. Must be called with the lock held.
+
+    Returns:
+      True if an item was freed.
+    """
+    pending = None
+    for index, item in enumerate(self._items):
+      kind = item[0]
+      if kind == _KIND_KEY:
+        pending = None
+      elif kind == _KIND_MOUSE:
+        if pending is not None:
+          older = self._items[pending]
+          item[2][0] += older[2][0]
+          item[2][1] += older[2][1]
+          del self._items[pending]
+          self.merged += 1
+          return True
+        pending = index
+    return False
+
+
+class QueuedSender(object):
+  """Sends Anymote events through a SendQueue drained by a writer thread.
+
+  QueuedSender has the same event methods as AnymoteProtocol; they return as
+  soon as the event is queued.
+
+  Attributes:
+    protocol: The connected AnymoteProtocol events are written to.
+    queue: The SendQueue.
+    error: The exception that stopped the writer thread, if any.
+  """
+
+  def __init__(self, protocol, maxsize=64, put_timeout=None):
+    self.protocol = protocol
+    self.queue = SendQueue(maxsize)
+    self.put_timeout = put_timeout
+    self.error = None
+    self._closed = False
+    self._thread = threading.Thread(target=self._run)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def keycode(self, keycode, action):
+    self._put(_KIND_KEY, PRIORITY_REQUIRED,
+              self.protocol.encode_keycode(keycode, action))
+
+  def press(self, keycode):
+    self._put(_KIND_KEY, PRIORITY_REQUIRED, self.protocol.encode_press(keycode))
+
+  def fling(self, uri):
+    self._put(_KIND_FLING, PRIORITY_REQUIRED, self.protocol.encode_fling(uri))
+
+  def mouse(self, x=0, y=0):
+    return self._put(_KIND_MOUSE, PRIORITY_LOW, [x, y])
+
+  def close(self, timeout=None):
+    """Stops the writer thread after the pending events are written."""
+    self._closed = True
+    self._thread.join(timeout)
+    if not self._thread.is_alive():
+      self.queue.close()
+
+  def _put(self, kind, priority, payload):
+    if self.error is not None:
+      raise self.error
+    try:
+      return self.queue.put(kind, priority, payload, timeout=self.put_timeout)
+    except QueueClosedError:
+      # The writer thread stopped while we were waiting for room.
+      if self.error is not None:
+        raise self.error
+      raise
+
+  def _run(self):
+    while True:
+      item = self.queue.get(timeout=0.1)
+      if item is None:
+        if self._closed:
+          return
+        continue
+      kind, _, payload = item
+      if kind == _KIND_MOUSE:
+        payload = self.protocol.encode_mouse(payload[0], payload[1])
+      try:
+        self.protocol.write(payload)
+      except Exception as e:  # pylint: disable=broad-except
+        self.error = e
+        # Nothing drains the queue anymore; release blocked producers.
+        self.queue.close()
+        return
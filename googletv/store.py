@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+#
+# Copyright 2012 Steven Le (stevenle08@gmail.com)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""On-disk store of paired credentials.
+
+After pairing, the store records which client certificate was paired with
+which Google TV, identified by host and by the SHA-256 fingerprint of the
+server certificate. It is a SQLite database indexed on both, so looking up a
+host (or every host of a fleet, in one query) is a single indexed read, and
+every write is an atomic transaction.
+
+Example:
+  from googletv import store
+
+  credentials = store.CredentialStore('credentials.db')
+  with googletv.AnymoteProtocol.from_store(credentials, 'tv1.local') as gtv:
+    gtv.press(keycodes_pb2.KEYCODE_HOME)
+"""
+
+import collections
+import os
+import sqlite3
+import threading
+import time
+
+# A paired credential:
+#   host: Host the certificate was paired with.
+#   fingerprint: Hex SHA-256 fingerprint of the server certificate.
+#   certfile: Absolute path of the paired client certificate.
+#   paired_at: Pairing time, in seconds since the epoch.
+#   server_name: Server name from PairingRequestAck.
+Credential = collections.namedtuple(
+    'Credential', ['host', 'fingerprint', 'certfile', 'paired_at',
+                   'server_name'])
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS credentials (
+  host TEXT PRIMARY KEY,
+  fingerprint TEXT NOT NULL,
+  certfile TEXT NOT NULL,
+  paired_at REAL NOT NULL,
+  server_name TEXT
+);
+CREATE INDEX IF NOT EXISTS credentials_fingerprint ON credentials (fingerprint);
+'''
+
+_COLUMNS = 'host, fingerprint, certfile, paired_at, server_name'
+
+# SQLite limits the number of bound parameters in a statement.
+_MAX_PARAMS = 500
+
+
+class CredentialStore(object):
+  """SQLite-backed map of host and fingerprint to paired credentials.
+
+  Safe to share between threads.
+  """
+
+  def __init__(self, path):
+    self.path = path
+    self._lock = threading.Lock()
+    self._conn = sqlite3.connect(path, check_same_thread=False)
+    with self._lock:
+      if path != ':memory:':
+        # WAL lets other processes read while a write is in progress.
+        self._conn.execute('PRAGMA journal_mode=WAL')
+      self._conn.executescript(_SCHEMA)
+
+  def close(self):
+    with self._lock:
+      self._conn.close()
+
+  def get(self, host):
+    """Returns the Credential for host, or None."""
+    with self._lock:
+      row = self._conn.execute(
+          'SELECT %s FROM credentials WHERE host = ?' % _COLUMNS,
+          (host,)).fetchone()
+    return Credential(*row) if row else None
+
+  def get_many(self, hosts):
+    """Returns a dict mapping each paired host in hosts to its Credential."""
+    hosts = list(hosts)
+    result = {}
+    with self._lock:
+      for i in xrange(0, len(hosts), _MAX_PARAMS):
+        chunk = hosts[i:i + _MAX_PARAMS]
+        rows = self._conn.execute(
+            'SELECT %s FROM credentials WHERE host IN (%s)' % (
+                _COLUMNS, ','.join('?' * len(chunk))), chunk)
+        for row in rows:
+          result[row[0]] = Credential(*row)
+    return result
+
+  def find(self, fingerprint):
+    """Returns the Credentials paired with a server certificate fingerprint."""
+    with self._lock:
+      rows = self._conn.execute(
+          'SELECT %s FROM credentials WHERE fingerprint = ?' % _COLUMNS,
+          (fingerprint,)).fetchall()
+    return [Credential(*row) for row in rows]
+
+  def is_paired(self, host, certfile, fingerprint=None):
+    """Returns whether certfile is paired with host (and fingerprint)."""
+    credential = self.get(host)
+    if credential is None:
+      return False
+    if fingerprint is not None and credential.fingerprint != fingerprint:
+      return False
+    return credential.certfile == os.path.abspath(certfile)
+
+  def put(self, host, fingerprint, certfile, server_name=None,
+          paired_at=None):
+    """Records a pairing, replacing any previous credential for host.
+
+    Returns:
+      The stored Credential.
+    """
+    credential = Credential(host, fingerprint, os.path.abspath(certfile),
+                            time.time() if paired_at is None else paired_at,
+                            server_name)
+    with self._lock:
+      with self._conn:
+        self._conn.execute(
+            'INSERT OR REPLACE INTO credentials (%s) VALUES (?, ?, ?, ?, ?)' %
+            _COLUMNS, credential)
+    return credential
+
+  def delete(self, host):
+    """Forgets the credential for host."""
+    with self._lock:
+      with self._conn:
+        self._conn.execute('DELETE FROM credentials WHERE host = ?', (host,))
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+#
+# Copyright 2012 Steven Le (stevenle08@gmail.com)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Synchronized dispatch of Anymote events to many Google TVs.
+
+Sending the same event to many TVs from a single loop creates a spread in
+arrival times that grows with the number of TVs. SynchronizedDispatcher
+estimates the one-way latency of each connection, pre-encodes the frames and
+releases each write at an offset so that the frames arrive at the same time.
+
+Example:
+  import googletv
+  from googletv import sync
+
+  tvs = [googletv.AnymoteProtocol(host, CERT) for host in HOSTS]
+  for tv in tvs:
+    tv.connect()
+  dispatcher = sync.SynchronizedDispatcher(tvs)
+  dispatcher.calibrate()
+  result = dispatcher.press(keycodes_pb2.KEYCODE_MEDIA_PLAY)
+  print 'Estimated arrival spread: %.3f ms' % (result.estimated_spread * 1000)
+
+Arrival times are estimated from the write times and the kernel's RTT of each
+connection; nothing observes when a TV actually processes the event.
+"""
+
+import collections
+from googletv import clock
+
+# Outcome of a synchronized dispatch:
+#   estimated_spread: Seconds between the earliest and latest estimated
+#       arrival, over the protocols that were written successfully.
+#   arrivals: Dict mapping each protocol to its estimated arrival time relative
+#       to the target arrival time, in seconds.
+#   errors: Dict mapping each protocol that failed to the raised exception.
+DispatchResult = collections.namedtuple(
+    'DispatchResult', ['estimated_spread', 'arrivals', 'errors'])
+
+
+class SynchronizedDispatcher(object):
+  """Writes the same event to many connections so that it arrives in sync.
+
+  Attributes:
+    protocols: Connected AnymoteProtocol objects.
+    latencies: Dict mapping each protocol to its estimated one-way latency in
+        seconds. Populated by calibrate(), and may be set directly.
+    lead: Seconds between staging the frames and the first release.
+  """
+
+  def __init__(self, protocols, lead=0.02):
+    self.protocols = list(protocols)
+    self.latencies = {}
+    self.lead = lead
+
+  def calibrate(self):
+    """Estimates the one-way latency of every connection.
+
+    The one-way latency is taken to be half the kernel's smoothed RTT of the
+    existing connection (see googletv.tcpinfo). Where TCP_INFO is not
+    available the latency is taken to be 0; set latencies directly instead.
+
+    Returns:
+      The latencies dict.
+    """
+    for protocol in self.protocols:
+      info = protocol.tcp_info()
+      self.latencies[protocol] = info.rtt / 2 if info is not None else 0.0
+    return self.latencies
+
+  def dispatch(self, encode):
+    """Writes a pre-encoded event to every connection in sync.
+
+    All frames are encoded up front. A single loop then releases each write at
+    `max latency - connection latency` after the start, so that per-write cost
+    is only the write itself and no thread scheduling jitter is added.
+
+    Args:
+      encode: A function taking a protocol and returning the framed bytes to
+          write to it, e.g. lambda gtv: gtv.encode_press(keycode).
+
+    Returns:
+      A DispatchResult.
+    """
+    if not self.latencies:
+      self.calibrate()
+    max_latency = max(self.latencies.get(p, 0.0) for p in self.protocols)
+    # Slowest connections are released first.
+    staged = sorted(((max_latency - self.latencies.get(p, 0.0), p, encode(p))
+                     for p in self.protocols), key=lambda item: item[0])
+    written = {}
+    errors = {}
+    start = clock.monotonic() + self.lead
+    target = start + max_latency
+    for offset, protocol, data in staged:
+      clock.sleep_until(start + offset)
+      written[protocol] = clock.monotonic()
+      try:
+        protocol.write(data)
+      except Exception as e:  # pylint: disable=broad-except
+        errors[protocol] = e
+
+    arrivals = {}
+    for protocol, when in written.iteritems():
+      if protocol not in errors:
+        arrivals[protocol] = (when + self.latencies.get(protocol, 0.0) -
+                              target)
+    spread = 0.0
+    if arrivals:
+      spread = max(arrivals.values()) - min(arrivals.values())
+    return DispatchResult(estimated_spread=spread, arrivals=arrivals,
+                          errors=errors)
+
+  def keycode(self, keycode, action):
+    """Sends a KeyCode event to every connection in sync."""
+    return self.dispatch(lambda p: p.encode_keycode(keycode, action))
+
+  def press(self, keycode):
+    """Sends a keycode down then up to every connection in sync."""
+    return self.dispatch(lambda p: p.encode_press(keycode))
+
+  def fling(self, uri):
+    """Sends a Fling event to every connection in sync."""
+    return self.dispatch(lambda p: p.encode_fling(uri))
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+#
+# Copyright 2012 Steven Le (stevenle08@gmail.com)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Live TCP statistics of connections, from Linux TCP_INFO.
+
+sample() reads the kernel's view of a connected socket: smoothed RTT and its
+variance, retransmissions and unacknowledged data. BaseProtocol.tcp_info()
+samples its own socket. StallWatchdog samples many connections periodically
+and flags the ones that look stalled, so a scheduler can route around a sick
+TV before sends to it start blocking:
+
+  def on_stall(protocol, info, reason):
+    print '%s stalled: %s' % (protocol.host, reason)
+
+  watchdog = tcpinfo.StallWatchdog(on_stall=on_stall)
+  watchdog.add(gtv)
+  watchdog.start()
+
+On other platforms sample() returns None and nothing is ever flagged.
+"""
+
+import collections
+import socket
+import struct
+import threading
+
+# struct tcp_info: 8 one-byte fields, then u32 fields from tcpi_rto on.
+_BASE = struct.Struct('=BBBBBBBB24I')
+# Later kernels append tcpi_pacing_rate, tcpi_max_pacing_rate,
+# tcpi_bytes_acked, tcpi_bytes_received (u64), tcpi_segs_out, tcpi_segs_in,
+# tcpi_notsent_bytes and tcpi_min_rtt (u32).
+_EXTENDED = struct.Struct('=4Q4I')
+_TCP_INFO_LEN = _BASE.size + _EXTENDED.size
+
+# A sample of TCP_INFO. Times are in seconds.
+#   state: TCP state, e.g. 1 for ESTABLISHED.
+#   retransmits: Retransmissions of the oldest unacknowledged segment so far,
+#       i.e. consecutive RTO backoffs in progress.
+#   rto: Current retransmission timeout.
+#   snd_mss: Maximum segment size for sending, in bytes.
+#   unacked: Segments sent but not yet acknowledged.
+#   lost: Segments considered lost.
+#   last_data_sent, last_ack_recv: Time since data was last sent and an ACK
+#       last received.
+#   rtt, rttvar: Smoothed round-trip time and its mean deviation.
+#   snd_cwnd: Congestion window, in segments.
+#   total_retrans: Retransmitted segments over the connection's life.
+#   notsent_bytes: Bytes queued but not yet sent, or None on older kernels.
+#   min_rtt: Minimum RTT observed, or None on older kernels.
+TcpInfo = collections.namedtuple('TcpInfo', [
+    'state', 'retransmits', 'rto', 'snd_mss', 'unacked', 'lost',
+    'last_data_sent', 'last_ack_recv', 'rtt', 'rttvar', 'snd_cwnd',
+    'total_retrans', 'notsent_bytes', 'min_rtt'])
+
+
+def sample(sock):
+  """Returns a TcpInfo for a connected socket, or None if unavailable."""
+  tcp_info = getattr(socket, 'TCP_INFO', None)
+  if tcp_info is None or sock is None:
+    return None
+  try:
+    data = sock.getsockopt(socket.IPPROTO_TCP, tcp_info, _TCP_INFO_LEN)
+  except socket.error:
+    return None
+  if len(data) < _BASE.size:
+    return None
+  fields = _BASE.unpack_from(data)
+  (state, _, retransmits, _, _, _, _, _,
+   rto, _, snd_mss, _, unacked, _, lost, _, _, last_data_sent, _, _,
+   last_ack_recv, _, _, rtt, rttvar, _, snd_cwnd, _, _, _, _,
+   total_retrans) = fields
+  notsent_bytes = min_rtt = None
+  if len(data) >= _TCP_INFO_LEN:
+    extended = _EXTENDED.unpack_from(data, _BASE.size)
+    notsent_bytes = extended[6]
+    min_rtt = extended[7] / 1e6
+  return TcpInfo(state, retransmits, rto / 1e6, snd_mss, unacked, lost,
+                 last_data_sent / 1e3, last_ack_recv / 1e3, rtt / 1e6,
+                 rttvar / 1e6, snd_cwnd, total_retrans, notsent_bytes,
+                 min_rtt)
+
+
+class StallWatchdog(object):
+  """Flags connections whose TCP state looks stalled.
+
+  A connection is considered stalled when any of:
+    - the kernel is retransmitting its oldest segment for the
+      max_retransmits-th time in a row;
+    - data has been outstanding without any ACK for longer than stall_time
+      (and than 4 RTTs);
+    - bytes are waiting to be sent but nothing has been sent for longer than
+      stall_time, e.g. because the TV stopped reading and closed its window;
+    - the backlog, unacked plus unsent bytes, grew on each of the last
+      `window` samples. Unacked segments are counted as snd_mss bytes each.
+  It recovers once none of these hold.
+
+  Attributes:
+    interval: Seconds between samples, when started.
+    on_stall: Optional function taking (protocol, TcpInfo, reason), called
+        when a connection becomes stalled.
+    on_recover: Optional function taking (protocol, TcpInfo), called when it
+        recovers.
+  """
+
+  def __init__(self, interval=1.0, on_stall=None, on_recover=None,
+               max_retransmits=2, stall_time=2.0, window=3):
+    self.interval = interval
+    self.on_stall = on_stall
+    self.on_recover = on_recover
+    self.max_retransmits = max_retransmits
+    self.stall_time = stall_time
+    self.window = window
+    self._lock = threading.Lock()
+    self._protocols = {}
+    self._stopped = threading.Event()
+    self._thread = None
+
+  def add(self, protocol):
+    """Starts watching a BaseProtocol."""
+    with self._lock:
+      self._protocols[id(protocol)] = _Watched(protocol, self.window)
+
+  def remove(self, protocol):
+    with self._lock:
+      self._protocols.pop(id(protocol), None)
+
+  def stalled(self):
+    """Returns the watched protocols currently considered stalled."""
+    with self._lock:
+      return [w.protocol for w in self._protocols.itervalues()
+              if w.reason is not None]
+
+  def is_stalled(self, protocol):
+    with self._lock:
+      watched = self._protocols.get(id(protocol))
+      return watched is not None and watched.reason is not None
+
+  def check(self):
+    """Samples every watched protocol once, running the callbacks."""
+    with self._lock:
+      watched = list(self._protocols.itervalues())
+    for w in watched:
+      info = sample(w.protocol.sock)
+      if info is None:
+        continue
+      reason = self._diagnose(w, info)
+      was_stalled = w.reason is not None
+      w.reason = reason
+      if reason is not None and not was_stalled:
+        if self.on_stall is not None:
+          self.on_stall(w.protocol, info, reason)
+      elif reason is None and was_stalled:
+        if self.on_recover is not None:
+          self.on_recover(w.protocol, info)
+
+  def start(self):
+    """Samples every interval seconds from a background thread."""
+    self._stopped.clear()
+    self._thread = threading.Thread(target=self._run)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def stop(self):
+    self._stopped.set()
+    if self._thread is not None:
+      self._thread.join()
+      self._thread = None
+
+  def _run(self):
+    while not self._stopped.wait(self.interval):
+      self.check()
+
+  def _diagnose(self, watched, info):
+    backlog = info.unacked * info.snd_mss + (info.notsent_bytes or 0)
+    history = watched.backlog
+    history.append(backlog)
+    if info.retransmits >= self.max_retransmits:
+      return '%d retransmissions of the same segment' % info.retransmits
+    if info.unacked and info.last_ack_recv > max(self.stall_time,
+                                                 4 * info.rtt):
+      return 'no ACK for %.1f s with %d segments outstanding' % (
+          info.last_ack_recv, info.unacked)
+    if info.notsent_bytes and info.last_data_sent > self.stall_time:
+      return 'nothing sent for %.1f s with %d bytes waiting' % (
+          info.last_data_sent, info.notsent_bytes)
+    if len(history) == history.maxlen and all(
+        a < b for a, b in zip(history, list(history)[1:])):
+      return 'backlog grew on %d samples in a row, to %d bytes' % (
+          len(history) - 1, backlog)
+    return None
+
+
+class _Watched(object):
+
+  def __init__(self, protocol, window):
+    self.protocol = protocol
+    self.backlog = collections.deque(maxlen=window + 1)
+    self.reason = None
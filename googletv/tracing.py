@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+#
+# Copyright 2012 Steven Le (stevenle08@gmail.com)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Opt-in tracing of protocol operations.
+
+Pass a Tracer to a protocol to be told when each operation starts and ends:
+
+  recorder = tracing.ChromeTraceRecorder()
+  with googletv.AnymoteProtocol(host, cert, tracer=recorder) as gtv:
+    gtv.fling(uri)
+  recorder.save('fling.json')
+
+The saved file opens in chrome://tracing or https://ui.perfetto.dev.
+
+Spans:
+  connect: connect(), made of resolve, tcp_connect and tls_handshake.
+  send: Sending one message, made of encode and write.
+  write: Writing framed bytes to the socket. In threadsafe mode this happens
+      on the writer thread.
+  recv_message: Receiving one message, made of recv and decode.
+  pairing.handshake, pairing.send_secret, pairing.prepare_secret: Pairing
+      steps.
+
+With no tracer set, spans are no-ops and their arguments are never built.
+"""
+
+import json
+import threading
+from googletv import clock
+
+
+class Tracer(object):
+  """Receives span start and end callbacks. The base class ignores them."""
+
+  def start_span(self, name, args):
+    """Called when an operation starts.
+
+    Args:
+      name: Name of the span, e.g. 'connect'.
+      args: Dict of details, always including 'host'.
+
+    Returns:
+      A token passed back to end_span().
+    """
+    return None
+
+  def end_span(self, token, error=None):
+    """Called when an operation ends.
+
+    Args:
+      token: The value start_span() returned.
+      error: The exception that ended the operation, if any.
+    """
+    pass
+
+
+class CallbackTracer(Tracer):
+  """Forwards spans to two functions.
+
+  Attributes:
+    on_start: Function taking (name, args) and returning a token.
+    on_end: Function taking (token, error).
+  """
+
+  def __init__(self, on_start, on_end):
+    self.on_start = on_start
+    self.on_end = on_end
+
+  def start_span(self, name, args):
+    return self.on_start(name, args)
+
+  def end_span(self, token, error=None):
+    self.on_end(token, error)
+
+
+class ChromeTraceRecorder(Tracer):
+  """Records spans as Chrome trace-event JSON.
+
+  Attributes:
+    max_events: Spans beyond this many are dropped, bounding memory use.
+    dropped: Number of spans dropped.
+  """
+
+  def __init__(self, max_events=1000000):
+    self.max_events = max_events
+    self.dropped = 0
+    self._events = []
+    self._pid = 1
+
+  def start_span(self, name, args):
+    return (name, args, clock.monotonic(), threading.current_thread().ident)
+
+  def end_span(self, token, error=None):
+    end = clock.monotonic()
+    if len(self._events) >= self.max_events:
+      self.dropped += 1
+      return
+    name, args, start, tid = token
+    if error is not None:
+      args = dict(args, error=repr(error))
+    self._events.append({
+        'name': name,
+        'cat': name.split('.')[0],
+        'ph': 'X',
+        'ts': start * 1e6,
+        'dur': (end - start) * 1e6,
+        'pid': self._pid,
+        'tid': tid,
+        'args': args,
+    })
+
+  def events(self):
+    """Returns the recorded trace events."""
+    return list(self._events)
+
+  def save(self, filename):
+    """Writes the recorded spans to a JSON file."""
+    with open(filename, 'w') as f:
+      json.dump({'traceEvents': self._events, 'displayTimeUnit': 'ms'}, f)
+
+
+class Span(object):
+  """Context manager reporting one operation to a Tracer."""
+
+  __slots__ = ('tracer', 'name', 'args', 'token')
+
+  def __init__(self, tracer, name, args):
+    self.tracer = tracer
+    self.name = name
+    self.args = args
+    self.token = None
+
+  def __enter__(self):
+    self.token = self.tracer.start_span(self.name, self.args)
+    return self
+
+  def __exit__(self, unused_type, value, unused_traceback):
+    self.tracer.end_span(self.token, value)
+
+
+class _NullSpan(object):
+  """Stands in for Span when there is no tracer."""
+
+  __slots__ = ()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, unused_type, unused_value, unused_traceback):
+    pass
+
+
+NULL_SPAN = _NullSpan()
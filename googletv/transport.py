@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+#
+# Copyright 2012 Steven Le (stevenle08@gmail.com)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Transport profiles: socket options tuned for a kind of traffic.
+
+Pass a profile to a protocol, by name or as a Profile:
+
+  gtv = googletv.AnymoteProtocol(host, cert, profile='interactive')
+
+Profiles:
+  default: The operating system defaults (Nagle's algorithm enabled).
+  interactive: For key presses and other latency-sensitive events. Disables
+      Nagle's algorithm (TCP_NODELAY), so a small frame is never held back
+      waiting for the ACK of the previous one, and re-arms TCP_QUICKACK after
+      every read so that replies are acknowledged at once.
+  bulk: For bursts of frames. Corks the socket (TCP_CORK) on the first write
+      and uncorks it at flush(), so a batch leaves in as few full-sized
+      segments as possible.
+
+Send and receive buffer sizes can be set on any profile with
+with_buffers(). Options the platform does not support are skipped.
+"""
+
+import socket
+
+# Linux only; None elsewhere.
+TCP_CORK = getattr(socket, 'TCP_CORK', None)
+TCP_QUICKACK = getattr(socket, 'TCP_QUICKACK', None)
+
+
+class Profile(object):
+  """Socket options for a connection.
+
+  Attributes:
+    name: Name of the profile.
+    nodelay: Whether to disable Nagle's algorithm.
+    quickack: Whether to re-arm TCP_QUICKACK after every read.
+    cork: Whether to cork writes until flush().
+    sndbuf: Send buffer size in bytes, or None for the default.
+    rcvbuf: Receive buffer size in bytes, or None for the default.
+  """
+
+  def __init__(self, name, nodelay=False, quickack=False, cork=False,
+               sndbuf=None, rcvbuf=None):
+    self.name = name
+    self.nodelay = nodelay
+    self.quickack = quickack and TCP_QUICKACK is not None
+    self.cork = cork and TCP_CORK is not None
+    self.sndbuf = sndbuf
+    self.rcvbuf = rcvbuf
+
+  def __repr__(self):
+    return '<Profile %s>' % self.name
+
+  def with_buffers(self, sndbuf=None, rcvbuf=None):
+    """Returns a copy of the profile with the given buffer sizes."""
+    return Profile(self.name, nodelay=self.nodelay, quickack=self.quickack,
+                   cork=self.cork, sndbuf=sndbuf, rcvbuf=rcvbuf)
+
+  def configure(self, sock):
+    """Applies the options to a socket before it connects.
+
+    The receive buffer has to be sized before connecting for the TCP window
+    scale to account for it.
+    """
+    if self.sndbuf is not None:
+      sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.sndbuf)
+    if self.rcvbuf is not None:
+      sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf)
+    if self.nodelay:
+      sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+def set_cork(sock, corked):
+  sock.setsockopt(socket.IPPROTO_TCP, TCP_CORK, 1 if corked else 0)
+
+
+def quickack(sock):
+  sock.setsockopt(socket.IPPROTO_TCP, TCP_QUICKACK, 1)
+
+
+DEFAULT = Profile('default')
+INTERACTIVE = Profile('interactive', nodelay=True, quickack=True)
+BULK = Profile('bulk', cork=True)
+
+PROFILES = dict((p.name, p) for p in (DEFAULT, INTERACTIVE, BULK))
+
+
+def get(profile):
+  """Returns the Profile for a name, a Profile, or None (the default)."""
+  if profile is None:
+    return DEFAULT
+  if isinstance(profile, Profile):
+    return profile
+  try:
+    return PROFILES[profile]
+  except KeyError:
+    raise ValueError('Unknown transport profile %r' % profile)
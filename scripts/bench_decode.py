@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+#
+# Copyright 2012 Steven Le (stevenle08@gmail.com)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Microbenchmark of polo OuterMessage decoding.
+
+Compares the FromString chain (parse the OuterMessage, then parse a copy of
+its payload) with googletv.decode_outer_message, which parses the envelope
+in place and the inner message from a buffer into the frame.
+
+  scripts$ ./bench_decode.py --iterations=100000
+"""
+
+import optparse
+import timeit
+import googletv
+from googletv.proto import polo_pb2
+
+
+def get_parser():
+  """Creates an optparse.OptionParser object used by this script."""
+  usage = 'Usage: %prog [--iterations=100000] [--payload-size=64]'
+  parser = optparse.OptionParser(usage=usage)
+
+  parser.add_option(
+      '--iterations',
+      default=100000,
+      type='int',
+      help='Number of decodes per run.')
+
+  parser.add_option(
+      '--payload-size',
+      default=64,
+      type='int',
+      help='Length of the server name in the PairingRequestAck.')
+
+  return parser
+
+
+def make_frame(payload_size):
+  ack = polo_pb2.PairingRequestAck(server_name='x' * payload_size)
+  outer = polo_pb2.OuterMessage(
+      protocol_version=1, status=polo_pb2.OuterMessage.STATUS_OK,
+      type=polo_pb2.OuterMessage.MESSAGE_TYPE_PAIRING_REQUEST_ACK,
+      payload=ack.SerializeToString())
+  return outer.SerializeToString()
+
+
+def decode_chain(data):
+  req = polo_pb2.OuterMessage.FromString(data)
+  return googletv.POLO_MESSAGE_CLASSES[req.type].FromString(req.payload)
+
+
+def decode_in_place(buf, length):
+  _, message_type, payload = googletv.decode_outer_message(buf, length)
+  return googletv._parse_from_view(  # pylint: disable=protected-access
+      googletv.POLO_MESSAGE_CLASSES[message_type], payload)
+
+
+def main():
+  options = get_parser().parse_args()[0]
+  data = make_frame(options.payload_size)
+  buf = bytearray(data)
+  length = len(data)
+  assert decode_chain(data) == decode_in_place(buf, length)
+
+  n = options.iterations
+  chain = min(timeit.repeat(lambda: decode_chain(data), number=n, repeat=3))
+  in_place = min(timeit.repeat(lambda: decode_in_place(buf, length), number=n,
+                               repeat=3))
+  print 'Frame: %d bytes, %d iterations' % (length, n)
+  print 'FromString chain:      %6.2f us/decode' % (chain / n * 1e6)
+  print 'decode_outer_message:  %6.2f us/decode' % (in_place / n * 1e6)
+
+
+if __name__ == '__main__':
+  main()
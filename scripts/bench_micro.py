@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+#
+# Copyright 2012 Steven Le (stevenle08@gmail.com)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Microbenchmarks of the encode, frame and decode hot paths.
+
+Times each benchmark as the best of several runs and reports microseconds per
+operation. Results can be written as JSON and compared against a baseline
+saved by an earlier run, so that a slower hot path shows up in review:
+
+  scripts$ ./bench_micro.py --output=baseline.json
+  ... change the code ...
+  scripts$ ./bench_micro.py --baseline=baseline.json
+
+Baselines are only comparable when taken on the same machine and Python.
+The exit status is 1 if any benchmark is slower than the baseline by more
+than --threshold.
+
+bench_micro_baseline.json is a reference run of the tree before the hot paths
+were reworked, for the benchmarks it supports (send_keycode and import). The
+other benchmarks are reported as new. To compare on another machine,
+regenerate it there from that tree:
+
+  scripts$ PYTHONPATH=/path/to/old/tree ./bench_micro.py --only=send_keycode \
+      --only=import --output=bench_micro_baseline.json
+"""
+
+import json
+import optparse
+import os
+import platform
+import subprocess
+import sys
+import timeit
+import googletv
+from googletv.proto import keycodes_pb2
+from googletv.proto import polo_pb2
+
+
+def get_parser():
+  """Creates an optparse.OptionParser object used by this script."""
+  usage = ('Usage: %prog [--iterations=100000] [--output=results.json] '
+           '[--baseline=baseline.json] [--threshold=0.1] [--only=NAME]')
+  parser = optparse.OptionParser(usage=usage)
+
+  parser.add_option(
+      '--iterations',
+      default=100000,
+      type='int',
+      help='Number of operations per run.')
+
+  parser.add_option(
+      '--repeat',
+      default=5,
+      type='int',
+      help='Number of runs; the fastest one is reported.')
+
+  parser.add_option(
+      '--output',
+      default=None,
+      help='Write the results to this JSON file.')
+
+  parser.add_option(
+      '--baseline',
+      default=None,
+      help='Compare against results saved with --output.')
+
+  parser.add_option(
+      '--threshold',
+      default=0.1,
+      type='float',
+      help='Relative slowdown reported as a regression.')
+
+  parser.add_option(
+      '--only',
+      action='append',
+      default=[],
+      help='Run only this benchmark; may be repeated.')
+
+  return parser
+
+
+class NullSocket(object):
+  """Stands in for the SSL socket so that send() does no I/O."""
+
+  def write(self, data):
+    return len(data)
+
+
+def make_protocol(**kwargs):
+  gtv = googletv.AnymoteProtocol('127.0.0.1', 'cert.pem', **kwargs)
+  gtv.ssl = NullSocket()
+  return gtv
+
+
+def make_polo_frame():
+  ack = polo_pb2.PairingRequestAck(server_name='x' * 32)
+  outer = polo_pb2.OuterMessage(
+      protocol_version=1, status=polo_pb2.OuterMessage.STATUS_OK,
+      type=polo_pb2.OuterMessage.MESSAGE_TYPE_PAIRING_REQUEST_ACK,
+      payload=ack.SerializeToString())
+  return bytearray(outer.SerializeToString())
+
+
+def bench_encode_keycode():
+  gtv = make_protocol()
+  return lambda: gtv.encode_keycode(keycodes_pb2.KEYCODE_A, 'down')
+
+
+def bench_encode_mouse():
+  gtv = make_protocol()
+  return lambda: gtv.encode_mouse(12, -7)
+
+
+def bench_encode_fling():
+  gtv = make_protocol()
+  return lambda: gtv.encode_fling('http://www.google.com/')
+
+
+def bench_frame():
+  # pylint: disable=protected-access
+  gtv = make_protocol()
+  data = gtv._encode_message(
+      gtv._keycode_request(keycodes_pb2.KEYCODE_A, 'down'))
+  return lambda: googletv.frame(data)
+
+
+def bench_send_keycode():
+  gtv = make_protocol()
+  return lambda: gtv.keycode(keycodes_pb2.KEYCODE_A, 'down')
+
+
+def bench_send_keycode_metrics():
+  gtv = make_protocol(metrics=True)
+  return lambda: gtv.keycode(keycodes_pb2.KEYCODE_A, 'down')
+
+
+def bench_decode_polo():
+  buf = make_polo_frame()
+  length = len(buf)
+  classes = googletv.POLO_MESSAGE_CLASSES
+
+  def decode():
+    _, message_type, payload = googletv.decode_outer_message(buf, length)
+    return googletv._parse_from_view(  # pylint: disable=protected-access
+        classes[message_type], payload)
+  return decode
+
+
+def bench_secret_payload():
+  # pylint: disable=protected-access
+  gtv = googletv.PairingProtocol('127.0.0.1', 'cert.pem')
+  # Key material as prepare_secret() would return it for 2048-bit keys.
+  gtv._key_material = ('\x01\x00\x01', '\xc3' * 256,
+                       '\x01\x00\x01', '\xa5' * 256)
+  secret = gtv._encode_hex_secret('12AB')
+  return lambda: gtv._make_secret_payload(secret)
+
+
+BENCHMARKS = [
+    ('encode_keycode', bench_encode_keycode),
+    ('encode_mouse', bench_encode_mouse),
+    ('encode_fling', bench_encode_fling),
+    ('frame', bench_frame),
+    ('send_keycode', bench_send_keycode),
+    ('send_keycode_metrics', bench_send_keycode_metrics),
+    ('decode_polo', bench_decode_polo),
+    ('secret_payload', bench_secret_payload),
+]
+
+
+def time_import(repeat):
+  """Returns the fastest `import googletv` in a fresh interpreter, in us."""
+  package_dir = os.path.dirname(os.path.dirname(os.path.abspath(
+      googletv.__file__)))
+  code = ('import time; t = time.time(); import googletv; '
+          'print time.time() - t')
+  env = dict(os.environ)
+  # Let the first run cache bytecode, so that the best run times the import
+  # of an installed package rather than compiling it.
+  env.pop('PYTHONDONTWRITEBYTECODE', None)
+  env['PYTHONPATH'] = os.pathsep.join(
+      filter(None, [package_dir, env.get('PYTHONPATH')]))
+  timings = [float(subprocess.check_output([sys.executable, '-c', code],
+                                           env=env))
+             for _ in xrange(repeat)]
+  return min(timings) * 1e6
+
+
+def run(names, iterations, repeat):
+  """Runs the selected benchmarks.
+
+  Returns:
+    A dict mapping benchmark names to microseconds per operation.
+  """
+  results = {}
+  for name, setup in BENCHMARKS:
+    if names and name not in names:
+      continue
+    fn = setup()
+    timeit.timeit(fn, number=max(1, iterations // 10))  # Warm up.
+    best = min(timeit.repeat(fn, number=iterations, repeat=repeat))
+    results[name] = best / iterations * 1e6
+  if not names or 'import' in names:
+    results['import'] = time_import(repeat)
+  return results
+
+
+def compare(results, baseline, threshold):
+  """Prints each result next to its baseline.
+
+  Returns:
+    The names of the benchmarks that regressed by more than threshold.
+  """
+  regressions = []
+  print '%-22s %12s %12s %8s' % ('benchmark', 'baseline us', 'current us',
+                                 'change')
+  for name in sorted(results):
+    current = results[name]
+    before = baseline.get(name)
+    if before is None:
+      print '%-22s %12s %12.3f %8s' % (name, '-', current, 'new')
+      continue
+    change = (current - before) / before
+    flag = ''
+    if change > threshold:
+      regressions.append(name)
+      flag = '  REGRESSION'
+    print '%-22s %12.3f %12.3f %+7.1f%%%s' % (name, before, current,
+                                            change * 100, flag)
+  return regressions
+
+
+def main():
+  options = get_parser().parse_args()[0]
+  results = run(options.only, options.iterations, options.repeat)
+  report = {
+      'python': platform.python_version(),
+      'platform': platform.platform(),
+      'iterations': options.iterations,
+      'unit': 'us/op',
+      'results': results,
+  }
+  if options.output:
+    with open(options.output, 'w') as f:
+      json.dump(report, f, indent=2, separators=(',', ': '),
+                sort_keys=True)
+      f.write('\n')
+
+  if not options.baseline:
+    for name in sorted(results):
+      print '%-22s %10.3f us' % (name, results[name])
+    return
+  with open(options.baseline) as f:
+    baseline = json.load(f)
+  if baseline.get('python') != report['python']:
+    print 'Warning: baseline was taken with Python %s' % baseline.get('python')
+  if compare(results, baseline['results'], options.threshold):
+    sys.exit(1)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+#
+# Copyright 2012 Steven Le (stevenle08@gmail.com)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Benchmarks the lock-step and pipelined pairing handshakes.
+
+Runs the local emulator (googletv.emulator) with every reply delayed by a
+simulated round-trip time, then times PairingProtocol.handshake() in both
+modes.
+
+  scripts$ ./bench_pairing.py --cert=cert.pem --rtt=0.05 --runs=10
+"""
+
+import optparse
+import os
+import sys
+import googletv
+from googletv import clock
+from googletv import emulator
+
+
+def get_parser():
+  """Creates an optparse.OptionParser object used by this script."""
+  usage = 'Usage: %prog [--cert=cert.pem] [--rtt=0.05] [--runs=10]'
+  parser = optparse.OptionParser(usage=usage)
+
+  parser.add_option(
+      '--cert',
+      default='cert.pem',
+      help='Path to cert file, used by both the client and the server.')
+
+  parser.add_option(
+      '--rtt',
+      default=0.05,
+      type='float',
+      help='Simulated round-trip time in seconds.')
+
+  parser.add_option(
+      '--runs',
+      default=10,
+      type='int',
+      help='Number of handshakes per mode.')
+
+  return parser
+
+
+def time_handshakes(port, certfile, runs, pipelined):
+  timings = []
+  for _ in xrange(runs):
+    start = clock.monotonic()
+    with googletv.PairingProtocol('127.0.0.1', certfile, port=port) as gtv:
+      gtv.handshake('bench', pipelined=pipelined)
+    timings.append(clock.monotonic() - start)
+  return timings
+
+
+def main():
+  parser = get_parser()
+  options = parser.parse_args()[0]
+  if not os.path.isfile(options.cert):
+    sys.exit('No cert file. Use --cert.')
+
+  print 'Simulated RTT: %.1f ms, %d runs per mode' % (options.rtt * 1000,
+                                                      options.runs)
+  with emulator.Emulator(options.cert, latency=options.rtt) as tv:
+    for name, pipelined in (('lock-step', False), ('pipelined', True)):
+      timings = sorted(time_handshakes(tv.pairing_port, options.cert,
+                                       options.runs, pipelined))
+      print '%-10s min %7.1f ms  median %7.1f ms  max %7.1f ms' % (
+          name, timings[0] * 1000, timings[len(timings) // 2] * 1000,
+          timings[-1] * 1000)
+
+if __name__ == '__main__':
+  main()
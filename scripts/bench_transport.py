@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+#
+# Copyright 2012 Steven Le (stevenle08@gmail.com)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Benchmarks the transport profiles against the local emulator.
+
+For each profile (see googletv.transport), measures:
+  press: Time from press() until the emulator has read the key-up frame,
+      with --gap seconds between presses like a person pressing keys.
+  burst: Time from the first of --burst back-to-back writes of a pre-encoded
+      key event until the emulator has read the last one, including flush().
+
+  scripts$ ./bench_transport.py --cert=cert.pem --presses=50
+"""
+
+import optparse
+import os
+import sys
+import threading
+import time
+import googletv
+from googletv import clock
+from googletv import emulator
+from googletv import transport
+from googletv.proto import keycodes_pb2
+
+
+def get_parser():
+  """Creates an optparse.OptionParser object used by this script."""
+  usage = ('Usage: %prog [--cert=cert.pem] [--presses=50] [--gap=0.1] '
+           '[--burst=200]')
+  parser = optparse.OptionParser(usage=usage)
+
+  parser.add_option(
+      '--cert',
+      default='cert.pem',
+      help='Path to cert file, used by both the client and the server.')
+
+  parser.add_option(
+      '--presses',
+      default=50,
+      type='int',
+      help='Number of presses per profile.')
+
+  parser.add_option(
+      '--gap',
+      default=0.1,
+      type='float',
+      help='Seconds between presses.')
+
+  parser.add_option(
+      '--burst',
+      default=200,
+      type='int',
+      help='Number of key events per burst.')
+
+  return parser
+
+
+class Arrivals(object):
+  """Collects the times the emulator read key events."""
+
+  def __init__(self):
+    self.times = []
+    self._changed = threading.Condition()
+
+  def on_request(self, kind, unused_message, arrived):
+    if kind == 'key_event_message':
+      with self._changed:
+        self.times.append(arrived)
+        self._changed.notify_all()
+
+  def wait_for(self, count, timeout=5.0):
+    """Returns the arrival time of the count-th key event."""
+    deadline = clock.monotonic() + timeout
+    with self._changed:
+      while len(self.times) < count:
+        remaining = deadline - clock.monotonic()
+        if remaining <= 0:
+          raise googletv.Error('Emulator did not receive the key events')
+        self._changed.wait(remaining)
+      return self.times[count - 1]
+
+
+def summary(name, timings):
+  timings = sorted(timings)
+  return '%-6s median %7.3f ms  p90 %7.3f ms  max %7.3f ms' % (
+      name, timings[len(timings) // 2] * 1000,
+      timings[int(len(timings) * 0.9)] * 1000, timings[-1] * 1000)
+
+
+def bench(port, certfile, profile, arrivals, options):
+  presses = []
+  bursts = []
+  with googletv.AnymoteProtocol('127.0.0.1', certfile, port=port,
+                                profile=profile) as gtv:
+    expected = len(arrivals.times)
+    for _ in xrange(options.presses):
+      time.sleep(options.gap)
+      start = clock.monotonic()
+      gtv.press(keycodes_pb2.KEYCODE_A)
+      gtv.flush()
+      expected += 2
+      presses.append(arrivals.wait_for(expected) - start)
+
+    framed = gtv.encode_keycode(keycodes_pb2.KEYCODE_A, 'down')
+    for _ in xrange(5):
+      time.sleep(options.gap)
+      start = clock.monotonic()
+      for _ in xrange(options.burst):
+        gtv.write(framed)
+      gtv.flush()
+      expected += options.burst
+      bursts.append(arrivals.wait_for(expected) - start)
+  return presses, bursts
+
+
+def main():
+  options = get_parser().parse_args()[0]
+  if not os.path.isfile(options.cert):
+    sys.exit('No cert file. Use --cert.')
+
+  arrivals = Arrivals()
+  with emulator.Emulator(options.cert, on_request=arrivals.on_request) as tv:
+    for name in ('default', 'interactive', 'bulk'):
+      presses, bursts = bench(tv.anymote_port, options.cert,
+                              transport.get(name), arrivals, options)
+      print '%s:' % name
+      print '  ' + summary('press', presses)
+      print '  ' + summary('burst', bursts)
+
+
+if __name__ == '__main__':
+  main()
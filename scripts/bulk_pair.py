@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+#
+# Copyright 2012 Steven Le (stevenle08@gmail.com)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Pairs a certificate with many Google TV servers at once.
+
+Hosts are read from the command line or from a file (one per line). The
+handshakes run concurrently, and the script prompts for each TV's code as soon
+as the TV displays it.
+"""
+
+import optparse
+import os
+import Queue
+import sys
+import threading
+from googletv import bulk
+from googletv import certs
+from googletv import store
+
+
+def get_parser():
+  """Creates an optparse.OptionParser object used by this script."""
+  usage = ('Usage: %prog [--hosts-file=] [--port=9552] [--cert=cert.pem] '
+           '[host ...]')
+  parser = optparse.OptionParser(usage=usage)
+
+  parser.add_option(
+      '--cert',
+      default='cert.pem',
+      help='Path to cert file.')
+
+  parser.add_option(
+      '--cert-dir',
+      help='Pair each host with its own cert, <cert-dir>/<host>.pem.')
+
+  parser.add_option(
+      '--hosts-file',
+      help='File listing one host per line.')
+
+  parser.add_option(
+      '--port',
+      default=9552,
+      type='int',
+      help='Port number.')
+
+  parser.add_option(
+      '--workers',
+      default=32,
+      type='int',
+      help='Maximum number of concurrent handshakes.')
+
+  parser.add_option(
+      '--timeout',
+      default=10.0,
+      type='float',
+      help='Seconds allowed for each connect, send or recv.')
+
+  parser.add_option(
+      '--client-name',
+      default='googletv-anymote',
+      help='Client name shown on the Google TVs.')
+
+  parser.add_option(
+      '--store',
+      help='Credential store; already paired hosts are skipped.')
+
+  return parser
+
+
+def read_hosts(options, args):
+  hosts = list(args)
+  if options.hosts_file:
+    with open(options.hosts_file) as f:
+      hosts.extend(line.strip() for line in f
+                   if line.strip() and not line.startswith('#'))
+  return hosts
+
+
+def main():
+  parser = get_parser()
+  options, args = parser.parse_args()
+  hosts = read_hosts(options, args)
+  if not hosts:
+    sys.exit(parser.get_usage())
+  cert_pool = None
+  if options.cert_dir:
+    if not os.path.isdir(options.cert_dir):
+      os.makedirs(options.cert_dir)
+    cert_pool = certs.CertPool(size=min(len(hosts), 16))
+  elif not os.path.isfile(options.cert):
+    certs.generate_cert(options.cert)
+
+  # Worker threads ask for codes through this queue; the main thread prompts.
+  prompts = Queue.Queue()
+
+  def get_code(host, server_name):
+    reply = Queue.Queue()
+    prompts.put((host, server_name, reply))
+    return reply.get()
+
+  pairer = bulk.BulkPairer(options.cert, get_code,
+                           client_name=options.client_name, port=options.port,
+                           workers=options.workers,
+                           connect_timeout=options.timeout,
+                           timeout=options.timeout,
+                           cert_dir=options.cert_dir, cert_pool=cert_pool,
+                           store=store.CredentialStore(options.store)
+                           if options.store else None)
+  results = []
+  runner = threading.Thread(target=lambda: results.extend(pairer.run(hosts)))
+  runner.daemon = True
+  runner.start()
+  print 'Pairing %d hosts...' % len(hosts)
+  while runner.is_alive():
+    try:
+      host, server_name, reply = prompts.get(timeout=0.2)
+    except Queue.Empty:
+      continue
+    reply.put(raw_input('Code from %s (%s): ' % (server_name or host, host)))
+  print bulk.format_results(results)
+
+
+if __name__ == '__main__':
+  main()
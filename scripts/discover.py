@@ -14,62 +14,100 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-"""Simple script to discover a Google TV server.
 
-Currently only supports discovery of one Google TV server. If there are
-multiple Google TVs on the network, see the pybonjour documentation for sample
-scripts.
+"""Discovers the Google TV servers on the local network.
 
-Requires pybonjour:
-  http://code.google.com/p/pybonjour/
+Sends multicast DNS queries for the Anymote service and prints every server
+that answers within the time budget. With --scan, a CIDR range is port-scanned
+instead, for networks that drop multicast.
 """
 
 __author__ = 'stevenle08@gmail.com (Steven Le)'
 
-import select
-import pybonjour
+import optparse
+import time
+from googletv import mdns
+from googletv import scan
 
-REGTYPE  = '_anymote._tcp'
-TIMEOUT  = 5
 
+def get_parser():
+  """Creates an optparse.OptionParser object used by this script."""
+  usage = ('Usage: %prog [--timeout=2] [--watch] '
+           '[--scan=192.168.0.0/22 [--tls [--cert=cert.pem]]]')
+  parser = optparse.OptionParser(usage=usage)
 
-def BrowseCallback(sdRef, flags, interfaceIndex, errorCode, serviceName,
-                   regtype, replyDomain):
-    if errorCode != pybonjour.kDNSServiceErr_NoError:
-        return
+  parser.add_option(
+      '--timeout',
+      default=2.0,
+      type='float',
+      help='Seconds to wait for answers.')
 
-    resolved = False
+  parser.add_option(
+      '--watch',
+      action='store_true',
+      default=False,
+      help='Keep listening and print servers as they come and go.')
 
-    def ResolveCallback(sdRef, flags, interfaceIndex, errorCode, fullname,
-                        hosttarget, port, txtRecord):
-      global resolved
-      if errorCode == pybonjour.kDNSServiceErr_NoError:
-        print 'Resolved service:'
-        print '  host =', hosttarget
-        print '  port       =', port
-        resolved = True
+  parser.add_option(
+      '--scan',
+      default=None,
+      help='Port-scan this CIDR range instead of using multicast DNS.')
 
-    resolver = pybonjour.DNSServiceResolve(
-        0, interfaceIndex, serviceName, regtype, replyDomain, ResolveCallback)
-    try:
-      while not resolved:
-        ready = select.select([resolver], [], [], TIMEOUT)
-        if resolver not in ready[0]:
-            print 'Resolve timed out'
-            break
-        pybonjour.DNSServiceProcessResult(resolver)
-    finally:
-      resolver.close()
+  parser.add_option(
+      '--tls',
+      action='store_true',
+      default=False,
+      help='With --scan, confirm open ports with a TLS handshake.')
 
+  parser.add_option(
+      '--cert',
+      default=None,
+      help='With --tls, client cert file to present in the handshakes.')
 
-def main():
-  browser = pybonjour.DNSServiceBrowse(regtype=REGTYPE, callBack=BrowseCallback)
+  return parser
+
+
+def watch():
+  def on_event(event, service):
+    print '%s %s %s:%d' % ('+' if event == 'add' else '-', service.name,
+                           service.address or service.host, service.port)
+
+  cache = mdns.DiscoveryCache()
+  cache.subscribe(on_event)
+  cache.start()
   try:
-    ready = select.select([browser], [], [])
-    if browser in ready[0]:
-      pybonjour.DNSServiceProcessResult(browser)
-  finally:
-    browser.close()
+    while True:
+      time.sleep(1)
+  except KeyboardInterrupt:
+    cache.stop()
+
+
+def port_scan(cidr, verify_tls, certfile):
+  results = scan.scan(cidr, verify_tls=verify_tls, certfile=certfile)
+  if not results:
+    print 'No Google TV found'
+  for result in results:
+    if result.tls is False:
+      continue
+    print '%s:%d' % (result.address, result.port)
+
+
+def main():
+  options = get_parser().parse_args()[0]
+  if options.scan:
+    port_scan(options.scan, options.tls, options.cert)
+    return
+  if options.watch:
+    watch()
+    return
+  services = mdns.discover(timeout=options.timeout)
+  if not services:
+    print 'No Google TV found'
+  for service in services:
+    print 'Resolved service: %s' % service.name
+    print '  host    = %s' % service.host
+    print '  address = %s' % (service.address or '(unresolved)')
+    print '  port    = %d' % service.port
 
 
 if __name__ == '__main__':
@@ -22,6 +22,7 @@ import optparse
 import os
 import sys
 import googletv
+from googletv import store
 from googletv.proto import keycodes_pb2
 
 
@@ -46,6 +47,10 @@ def get_parser():
       type='int',
       help='Port number.')
 
+  parser.add_option(
+      '--store',
+      help='Credential store; overrides --cert with the paired cert.')
+
   return parser
 
 
@@ -58,8 +63,16 @@ def main():
   host = options.host
   port = options.port
   cert = options.cert
-  if not os.path.isfile(cert):
-    sys.exit('No cert file. Use --cert.')
+  if options.store:
+    try:
+      gtv = googletv.AnymoteProtocol.from_store(
+          store.CredentialStore(options.store), host, port=port)
+    except googletv.NotPairedError:
+      sys.exit('%s is not in the credential store. Pair it first.' % host)
+  else:
+    if not os.path.isfile(cert):
+      sys.exit('No cert file. Use --cert.')
+    gtv = googletv.AnymoteProtocol(host, cert, port=port)
 
   keys = []
   for arg in args:
@@ -71,7 +84,7 @@ def main():
       direction = None
     keys.append((keycode, direction))
 
-  with googletv.AnymoteProtocol(host, cert, port=port) as gtv:
+  with gtv:
     for (keycode, direction) in keys:
       if direction:
         action = 'up' if direction.lower() == 'u' else 'down'
@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+#
+# Copyright 2012 Steven Le (stevenle08@gmail.com)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Load generator: N Anymote clients sending a traffic mix at a target rate.
+
+Starts the local emulator (googletv.emulator) in a child process, so the CPU
+figures cover the clients only, then runs N AnymoteProtocol clients, each
+sending a mix of key presses, mouse moves and flings at a fixed rate for a
+fixed duration.
+
+Clients send in one of three modes:
+  sync: Every client thread calls AnymoteProtocol directly.
+  threaded: Clients use threadsafe=True, so a writer thread per connection
+      batches the frames.
+  queued: Clients use googletv.sendqueue.QueuedSender.
+
+Send latency is measured from the time an event was scheduled to the time
+the send call returned, so a client that falls behind its schedule shows up
+in the latency rather than silently sending fewer events. Clients sleep
+without spinning between events, so the CPU figure is not inflated by the
+wait.
+
+  scripts$ ./loadgen.py --cert=cert.pem --clients=50 --rate=100 --duration=10
+"""
+
+import multiprocessing
+import optparse
+import os
+import random
+import sys
+import threading
+import googletv
+from googletv import clock
+from googletv import emulator
+from googletv import sendqueue
+from googletv.proto import keycodes_pb2
+
+MODES = ('sync', 'threaded', 'queued')
+KINDS = ('key', 'mouse', 'fling')
+
+
+def get_parser():
+  """Creates an optparse.OptionParser object used by this script."""
+  usage = ('Usage: %prog [--cert=cert.pem] [--clients=10] [--rate=50] '
+           '[--duration=10] [--mode=sync] [--mix=key:70,mouse:25,fling:5]')
+  parser = optparse.OptionParser(usage=usage)
+
+  parser.add_option(
+      '--cert',
+      default='cert.pem',
+      help='Path to cert file, used by both the clients and the server.')
+
+  parser.add_option(
+      '--clients',
+      default=10,
+      type='int',
+      help='Number of concurrent clients.')
+
+  parser.add_option(
+      '--rate',
+      default=50.0,
+      type='float',
+      help='Events per second sent by each client.')
+
+  parser.add_option(
+      '--duration',
+      default=10.0,
+      type='float',
+      help='Seconds to send for.')
+
+  parser.add_option(
+      '--mode',
+      default='sync',
+      choices=MODES,
+      help='How clients send: %s.' % ', '.join(MODES))
+
+  parser.add_option(
+      '--mix',
+      default='key:70,mouse:25,fling:5',
+      help='Relative weights of each event kind.')
+
+  parser.add_option(
+      '--latency',
+      default=0.0,
+      type='float',
+      help='Processing latency of the emulated server, in seconds.')
+
+  parser.add_option(
+      '--seed',
+      default=0,
+      type='int',
+      help='Seed for the event mix.')
+
+  return parser
+
+
+def parse_mix(text):
+  """Parses 'key:70,mouse:25' into cumulative [(weight, kind)] thresholds."""
+  weights = []
+  for item in text.split(','):
+    kind, _, weight = item.partition(':')
+    if kind not in KINDS:
+      raise ValueError('Unknown event kind %r' % kind)
+    weights.append((float(weight or 1), kind))
+  total = sum(w for w, _ in weights)
+  cumulative = []
+  acc = 0.0
+  for weight, kind in weights:
+    acc += weight / total
+    cumulative.append((acc, kind))
+  return cumulative
+
+
+def serve(certfile, latency, pipe):
+  """Runs the emulator in a child process until told to stop."""
+  with emulator.Emulator(certfile, latency=latency) as tv:
+    pipe.send(tv.anymote_port)
+    pipe.recv()
+    pipe.send(tv.stats())
+
+
+class Client(threading.Thread):
+  """One connection sending events on a fixed schedule."""
+
+  def __init__(self, port, certfile, mode, rate, mix, seed):
+    super(Client, self).__init__()
+    self.daemon = True
+    self.mode = mode
+    self.rate = rate
+    self.mix = mix
+    self.start_at = None
+    self.end = None
+    self.random = random.Random(seed)
+    self.latencies = []
+    self.error = None
+    self.gtv = googletv.AnymoteProtocol(
+        '127.0.0.1', certfile, port=port, threadsafe=(mode == 'threaded'))
+    self.gtv.connect()
+
+  def run(self):
+    gtv = self.gtv
+    sender = gtv
+    if self.mode == 'queued':
+      sender = sendqueue.QueuedSender(gtv, put_timeout=5.0)
+    interval = 1.0 / self.rate
+    latencies = self.latencies
+    due = self.start_at
+    try:
+      while due < self.end:
+        clock.sleep_until(due, spin=0)
+        kind = self.choose()
+        if kind == 'key':
+          sender.press(keycodes_pb2.KEYCODE_A)
+        elif kind == 'mouse':
+          sender.mouse(1, -1)
+        else:
+          sender.fling('http://www.google.com/')
+        latencies.append(clock.monotonic() - due)
+        due += interval
+      if sender is not gtv:
+        sender.close()
+      gtv.flush()
+    except (googletv.Error, EnvironmentError) as e:
+      self.error = e
+    finally:
+      gtv.close()
+
+  def choose(self):
+    value = self.random.random()
+    for threshold, kind in self.mix:
+      if value < threshold:
+        return kind
+    return self.mix[-1][1]
+
+
+def percentile(values, p):
+  return values[min(len(values) - 1, int(p * len(values)))]
+
+
+def main():
+  options = get_parser().parse_args()[0]
+  if not os.path.isfile(options.cert):
+    sys.exit('No cert file. Use --cert.')
+  mix = parse_mix(options.mix)
+
+  pipe, child_pipe = multiprocessing.Pipe()
+  server = multiprocessing.Process(
+      target=serve, args=(options.cert, options.latency, child_pipe))
+  server.daemon = True
+  server.start()
+  port = pipe.recv()
+
+  clients = [Client(port, options.cert, options.mode, options.rate, mix,
+                    options.seed + i)
+             for i in xrange(options.clients)]
+  # Once every client is connected, they start together with their schedules
+  # spread evenly across one interval.
+  start = clock.monotonic() + 0.1
+  end = start + options.duration
+  offset = 1.0 / options.rate / options.clients
+  for i, client in enumerate(clients):
+    client.start_at = start + i * offset
+    client.end = end
+  cpu_before = sum(os.times()[:2])
+  for client in clients:
+    client.start()
+  for client in clients:
+    client.join()
+  cpu = sum(os.times()[:2]) - cpu_before
+  elapsed = clock.monotonic() - start
+
+  pipe.send('stop')
+  stats = pipe.recv()
+  server.join()
+
+  latencies = sorted(l for c in clients for l in c.latencies)
+  errors = [c.error for c in clients if c.error is not None]
+  received = sum(stats.get(kind + '_message', 0)
+                 for kind in ('key_event', 'mouse_event', 'fling'))
+  print 'Clients: %d (%s), %.0f events/s each, %.1f s' % (
+      options.clients, options.mode, options.rate, options.duration)
+  if not latencies:
+    sys.exit('No events sent.')
+  print 'Sent:    %d events, %.0f events/s' % (len(latencies),
+                                               len(latencies) / elapsed)
+  print 'Server:  %d frames received' % received
+  print 'Latency: p50 %.3f ms  p99 %.3f ms  p999 %.3f ms  max %.3f ms' % (
+      percentile(latencies, 0.50) * 1000, percentile(latencies, 0.99) * 1000,
+      percentile(latencies, 0.999) * 1000, latencies[-1] * 1000)
+  print 'CPU:     %.1f ms per 1k events' % (cpu / len(latencies) * 1e6)
+  if errors:
+    print 'Errors:  %d clients failed, e.g. %r' % (len(errors), errors[0])
+
+
+if __name__ == '__main__':
+  main()
@@ -21,10 +21,10 @@ __author__ = 'stevenle08@gmail.com (Steven Le)'
 import logging
 import optparse
 import os
-import shlex
-import subprocess
 import sys
 import googletv
+from googletv import certs
+from googletv import store
 
 
 def get_parser():
@@ -48,27 +48,17 @@ def get_parser():
       type='int',
       help='Port number.')
 
-  return parser
+  parser.add_option(
+      '--pipeline',
+      action='store_true',
+      default=False,
+      help='Send the handshake messages back to back (saves round trips).')
 
+  parser.add_option(
+      '--store',
+      help='Credential store to record the pairing in.')
 
-def generate_cert(filename, country='US', state='CA', city='Mountain View',
-                  cn='anymote\/python\/googletv'):
-  """Generates a self-signed certificate."""
-  kwargs = {
-      'city': city,
-      'cn': cn,
-      'country': country,
-      'filename': filename,
-      'state': state,
-  }
-  command = [
-      'openssl req -x509 -nodes -days 365',
-      '-subj \'/C=%(country)s/ST=%(state)s/L=%(city)s/CN=%(cn)s\'',
-      '-newkey rsa:1024 -keyout %(filename)s -out %(filename)s',
-  ]
-  command = ' '.join(command) % kwargs
-  args = shlex.split(command)
-  p = subprocess.Popen(args)
+  return parser
 
 
 def main():
@@ -78,26 +68,29 @@ def main():
   port = options.port
   cert = options.cert
   if not os.path.isfile(cert):
-    generate_cert(cert)
+    certs.generate_cert(cert)
+  credentials = store.CredentialStore(options.store) if options.store else None
+  if credentials and credentials.is_paired(host, cert):
+    print '%s is already paired with %s' % (host, cert)
+    return
 
   print 'Initiating pairing...'
   with googletv.PairingProtocol(host, cert, port=port) as gtv:
     client_name = raw_input('Client name: ')
-    gtv.send_pairing_request(client_name)
-    gtv.recv_pairing_request_ack()
-    gtv.send_options()
-    gtv.recv_options()
-    gtv.send_configuration()
-    gtv.recv_configuration_ack()
+    ack = gtv.handshake(client_name, pipelined=options.pipeline)
     code = raw_input('Code from Google TV: ')
     gtv.send_secret(code)
 
     to_hex = lambda byte_str: ''.join(['%02X' % ord(x) for x in byte_str])
     try:
       secret = to_hex(gtv.recv_secret_ack().secret)
-      print 'Success! Received secret (hash) from Google TV: %s' % secret
     except:
       print 'Pairing failed'
+      return
+    print 'Success! Received secret (hash) from Google TV: %s' % secret
+    if credentials:
+      credentials.put(host, gtv.peer_fingerprint(), cert,
+                      server_name=ack.server_name)
 
 
 if __name__ == '__main__':
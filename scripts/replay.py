@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+#
+# Copyright 2012 Steven Le (stevenle08@gmail.com)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Replays a session captured with googletv.recorder.SessionRecorder.
+
+Every recorded host's frames are sent to one target, a Google TV or, with
+--emulator, a local emulator. The original timing is kept, scaled by
+--speed, and the timing drift is reported. Only one session is replayed, by
+default the latest; pick another with --session.
+
+  scripts$ ./replay.py --recording=session.rec --cert=cert.pem --emulator \
+      --speed=10
+"""
+
+import optparse
+import os
+import sys
+import googletv
+from googletv import emulator
+from googletv import replay
+
+
+def get_parser():
+  """Creates an optparse.OptionParser object used by this script."""
+  usage = ('Usage: %prog --recording=session.rec [--session=-1] '
+           '[--cert=cert.pem] (--host=<host> [--port=9551] | --emulator) '
+           '[--speed=1|2|10|max]')
+  parser = optparse.OptionParser(usage=usage)
+
+  parser.add_option(
+      '--recording',
+      default=None,
+      help='Path the session was recorded with, without the .0000 suffix.')
+
+  parser.add_option(
+      '--session',
+      default=-1,
+      type='int',
+      help='Session to replay, counting from 0; negative counts from the '
+           'latest. Each recorder run is a session.')
+
+  parser.add_option(
+      '--cert',
+      default='cert.pem',
+      help='Path to cert file.')
+
+  parser.add_option(
+      '--host',
+      default=None,
+      help='Host to replay to.')
+
+  parser.add_option(
+      '--port',
+      default=9551,
+      type='int',
+      help='Anymote port of the host.')
+
+  parser.add_option(
+      '--emulator',
+      action='store_true',
+      default=False,
+      help='Replay to a local emulator instead of --host.')
+
+  parser.add_option(
+      '--speed',
+      default='1',
+      help='Speed relative to the recording, or "max".')
+
+  return parser
+
+
+def run(options, host, port):
+  speed = None if options.speed == 'max' else float(options.speed)
+  connections = []
+
+  def get_protocol(unused_recorded_host):
+    gtv = googletv.AnymoteProtocol(host, options.cert, port=port)
+    gtv.connect()
+    connections.append(gtv)
+    return gtv
+
+  try:
+    report = replay.Replayer(get_protocol, speed=speed).replay(
+        replay.read_session(options.recording, session=options.session))
+  finally:
+    for gtv in connections:
+      gtv.close()
+  print report
+
+
+def main():
+  parser = get_parser()
+  options = parser.parse_args()[0]
+  if not options.recording or not replay.session_files(options.recording):
+    sys.exit('No recording found. Use --recording.')
+  count = len(replay.sessions(options.recording))
+  if not -count <= options.session < count:
+    sys.exit('There are %d sessions. Use --session.' % count)
+  if not os.path.isfile(options.cert):
+    sys.exit('No cert file. Use --cert.')
+
+  if options.emulator:
+    with emulator.Emulator(options.cert) as tv:
+      run(options, '127.0.0.1', tv.anymote_port)
+  elif options.host:
+    run(options, options.host, options.port)
+  else:
+    sys.exit('No target. Use --host or --emulator.')
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+#
+# Copyright 2012 Steven Le (stevenle08@gmail.com)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Checks the library end to end on loopback, without a TV.
+
+Each check exercises one part of the library against the local stand-ins
+(e.g. googletv.emulator) and prints "ok" or "FAIL" with the reason. The exit
+status is 1 if any check failed, so the script can gate changes:
+
+  scripts$ ./selftest.py --cert=cert.pem
+  scripts$ ./selftest.py --cert=cert.pem --only=decode
+"""
+
+import Queue
+import optparse
+import os
+import socket
+import sys
+import traceback
+import googletv
+from googletv import emulator
+from googletv import mdns
+from googletv import responder
+from googletv import scan
+from googletv.proto import keycodes_pb2
+from googletv.proto import polo_pb2
+
+
+def get_parser():
+  """Creates an optparse.OptionParser object used by this script."""
+  usage = 'Usage: %prog [--cert=cert.pem] [--only=NAME]'
+  parser = optparse.OptionParser(usage=usage)
+
+  parser.add_option(
+      '--cert',
+      default='cert.pem',
+      help='Path to cert file, used by both the clients and the stand-ins.')
+
+  parser.add_option(
+      '--only',
+      help='Run only the named check: %s.' % ', '.join(
+          name for name, _ in CHECKS))
+
+  return parser
+
+
+class CheckError(Exception):
+  """Raised by a check that failed."""
+
+
+def expect(condition, message):
+  if not condition:
+    raise CheckError(message)
+
+
+def polo_samples():
+  """Returns one message of every polo type, as sent by clients or TVs."""
+  options = polo_pb2.Options(preferred_role=googletv.ROLE_TYPE_INPUT)
+  encoding = options.input_encodings.add()
+  encoding.type = googletv.ENCODING_TYPE_HEXADECIMAL
+  encoding.symbol_length = 4
+  configuration = polo_pb2.Configuration(client_role=googletv.ROLE_TYPE_INPUT)
+  configuration.encoding.CopyFrom(encoding)
+  return [
+      polo_pb2.PairingRequest(service_name='AnyMote', client_name='selftest'),
+      polo_pb2.PairingRequestAck(server_name='selftest'),
+      options,
+      configuration,
+      polo_pb2.ConfigurationAck(),
+      polo_pb2.Secret(secret='\x01' * 32),
+      polo_pb2.SecretAck(secret='\x02' * 32),
+  ]
+
+
+def check_decode(unused_options):
+  """Decodes every polo message type in place from a reused frame buffer."""
+  # pylint: disable=protected-access
+  types = dict((cls, message_type) for message_type, cls
+               in googletv.POLO_MESSAGE_CLASSES.iteritems())
+  buf = bytearray(4096)
+  for message in polo_samples():
+    outer = polo_pb2.OuterMessage(
+        protocol_version=1, status=polo_pb2.OuterMessage.STATUS_OK,
+        type=types[message.__class__], payload=message.SerializeToString())
+    data = outer.SerializeToString()
+    buf[:len(data)] = data
+    _, message_type, payload = googletv.decode_outer_message(buf, len(data))
+    decoded = googletv._parse_from_view(
+        googletv.POLO_MESSAGE_CLASSES[message_type], payload)
+    expect(decoded == message, '%s decoded as %r' % (
+        message.__class__.__name__, decoded))
+
+  untyped = polo_pb2.OuterMessage(protocol_version=1,
+                                  status=polo_pb2.OuterMessage.STATUS_OK)
+  data = untyped.SerializeToString()
+  try:
+    googletv.decode_outer_message(bytearray(data), len(data))
+  except googletv.DecodeError:
+    pass
+  else:
+    raise CheckError('an OuterMessage without a type was accepted')
+  return '%d message types' % len(types)
+
+
+def check_emulator(options):
+  """Pairs with the emulator, then presses a key and flings a URI."""
+  with emulator.Emulator(options.cert) as tv:
+    with googletv.PairingProtocol('127.0.0.1', options.cert,
+                                  port=tv.pairing_port, timeout=5) as gtv:
+      ack = gtv.handshake('selftest')
+      expect(ack.server_name == tv.server_name,
+             'server name %r' % ack.server_name)
+      gtv.send_secret(tv.code)
+      gtv.recv_secret_ack()
+    with googletv.AnymoteProtocol('127.0.0.1', options.cert,
+                                  port=tv.anymote_port, timeout=5) as gtv:
+      gtv.press(keycodes_pb2.KEYCODE_ENTER)
+      gtv.fling('http://www.google.com')
+      # Replies come in order, so the key events have been handled too.
+      reply = gtv.recv_message()
+      expect(reply.response_message.HasField('fling_result_message'),
+             'fling answered with %r' % reply)
+    stats = tv.stats()
+  expect(stats.get('pairings') == 1, 'stats %r' % stats)
+  expect(stats.get('key_event_message') == 2, 'stats %r' % stats)
+  return 'paired, 2 key events, 1 fling'
+
+
+def check_mdns(unused_options):
+  """Discovers services from the local responder, one-shot and cached."""
+  names = ['Living Room._anymote._tcp.local', 'KITCHEN._anymote._tcp.local']
+  with responder.Responder(additionals=False) as fake:
+    fake.add(names[0], 'tv1.local', '127.0.0.1', 9551)
+    fake.add(names[1], 'tv2.local', '127.0.0.2', 9551)
+    # A host name as the query address, resolved like any other.
+    services = mdns.discover(address=('localhost', fake.port), timeout=0.5)
+    found = sorted((s.name, s.address, s.port) for s in services)
+    expect(found == [(names[1], '127.0.0.2', 9551),
+                     (names[0], '127.0.0.1', 9551)],
+           'discover() found %r' % found)
+
+    # DiscoveryCache relies on answers carrying every record, as announcements
+    # on the mDNS group do.
+    fake.additionals = True
+    events = Queue.Queue()
+    cache = mdns.DiscoveryCache(address=('localhost', fake.port),
+                                bind_address=('127.0.0.1', 0))
+    cache.subscribe(lambda event, service: events.put((event, service.name)))
+    cache.start()
+    try:
+      added = set(events.get(timeout=2)[1] for _ in names)
+      expect(added == set(names), 'cache added %r' % added)
+      fake.remove(names[1])
+      event = events.get(timeout=2)
+      expect(event == ('remove', names[1]), 'expected a goodbye, got %r' %
+             (event,))
+      expect([s.name for s in cache.services()] == [names[0]],
+             'cache still holds %r' % cache.services())
+    finally:
+      cache.stop()
+  return '%d services, goodbye seen' % len(names)
+
+
+def check_scan(options):
+  """Scans loopback: the emulator's ports are found and speak TLS."""
+  plain = socket.socket()
+  plain.bind(('127.0.0.1', 0))
+  plain.listen(1)
+  closed = socket.socket()
+  closed.bind(('127.0.0.1', 0))
+  try:
+    with emulator.Emulator(options.cert) as tv:
+      ports = [tv.pairing_port, tv.anymote_port, plain.getsockname()[1],
+               closed.getsockname()[1]]
+      results = scan.scan(['127.0.0.1'], ports, verify_tls=True,
+                          tls_timeout=0.5)
+  finally:
+    plain.close()
+    closed.close()
+  found = dict((r.port, r.tls) for r in results)
+  expected = {ports[0]: True, ports[1]: True, ports[2]: False}
+  expect(found == expected, 'expected %r, found %r' % (expected, found))
+  return '%d open ports, %d with TLS' % (len(found), sum(found.values()))
+
+
+CHECKS = [
+    ('decode', check_decode),
+    ('emulator', check_emulator),
+    ('mdns', check_mdns),
+    ('scan', check_scan),
+]
+
+
+def main():
+  parser = get_parser()
+  options = parser.parse_args()[0]
+  if not os.path.isfile(options.cert):
+    sys.exit('No cert file. Use --cert.')
+
+  failed = 0
+  for name, check in CHECKS:
+    if options.only and name != options.only:
+      continue
+    try:
+      detail = check(options)
+    except CheckError as e:
+      failed += 1
+      print 'FAIL  %-10s %s' % (name, e)
+    except Exception:  # pylint: disable=broad-except
+      failed += 1
+      print 'FAIL  %-10s %s' % (name, traceback.format_exc())
+    else:
+      print 'ok    %-10s %s' % (name, detail or '')
+  if failed:
+    sys.exit(1)
+
+
+if __name__ == '__main__':
+  main()